@@ -1,3 +1,3 @@
-from async_rabbitmq import client, config
+from async_rabbitmq import client, codecs, compression, config, rpc
 
-__all__ = ("client", "config")
+__all__ = ("client", "codecs", "compression", "config", "rpc")
@@ -1,32 +1,344 @@
+import asyncio
+import contextlib
+import dataclasses
 import datetime
-import json
 import logging
 import ssl
-from typing import Any, AsyncGenerator, Dict, NamedTuple, Optional
+import time
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
 import aio_pika
-import jsons
 import yarl
 from opentelemetry import propagate
-from prometheus_client import Counter
+from prometheus_client import Counter, Gauge, Histogram
 
-from async_rabbitmq import config
+from async_rabbitmq import codecs, compression, config
 
 logger = logging.getLogger(__name__)
 
 PRIORITY = 0
 DELIVERY_MODE = 2
 CONTENT_ENCODING = "utf-8"
-CONTENT_TYPE = "application/json"
+CONTENT_TYPE = codecs.JSON_CONTENT_TYPE
 
 CONSUME_COUNTER = Counter("async_rabbitmq_consume", "Number of fetch message", ["service_name", "status"])
 PRODUCE_COUNTER = Counter("async_rabbitmq_produce", "Number of produce message", ["service_name", "status"])
+PUBLISH_HISTOGRAM = Histogram(
+    "async_rabbitmq_publish_duration_seconds",
+    "Time from publish to the broker confirm",
+    ["service_name"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, float("inf")),
+)
+CHANNEL_POOL_WAIT_HISTOGRAM = Histogram(
+    "async_rabbitmq_channel_pool_wait_seconds",
+    "Time waiting for an open channel of the pool",
+    ["service_name"],
+    buckets=(0.0001, 0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf")),
+)
+CHANNEL_POOL_CHANNELS_GAUGE = Gauge(
+    "async_rabbitmq_channel_pool_channels",
+    "Channels of the pool: open, busy - with operations in progress",
+    ["service_name", "state"],
+)
+CHANNEL_POOL_OPERATIONS_GAUGE = Gauge(
+    "async_rabbitmq_channel_pool_operations", "Operations in progress on the pool channels", ["service_name"]
+)
 
 
-class Response(NamedTuple):
-    data: Dict[str, Any]
-    headers: Dict[str, Any]
-    message: aio_pika.abc.AbstractIncomingMessage
+T = TypeVar("T")
+_NOT_DECODED = object()
+
+
+class DecodeError(ValueError):
+    """The message body does not match its content_type or the requested type"""
+
+
+class Response:
+    """Received message. data is decoded by the codec of the message content_type on first access,
+    body is the payload without a copy, so routing and relaying messages do not pay for decoding;
+    a compressed body (content_encoding gzip/zstd) is decompressed on first access.
+    The first decode of data or parse is counted as correct or error, an error is raised as DecodeError
+    and decode_failed is set: Client.receive nacks such a message without requeue,
+    consumers with manual ack must nack it themselves.
+    Unpacking and indexing work as for the former NamedTuple (data, headers, message)
+    """
+
+    __slots__ = (
+        "message",
+        "headers",
+        "queue",
+        "decode_failed",
+        "_payload",
+        "_data",
+        "_service_name",
+        "_counted",
+    )
+    _fields = ("data", "headers", "message")
+
+    def __init__(
+        self, message: aio_pika.abc.AbstractIncomingMessage, queue: Optional[str] = None, service_name: str = ""
+    ):
+        self.message = message
+        self.headers: Dict[str, Any] = dict(message.headers)
+        self.queue = queue
+        self.decode_failed = False
+        self._payload: Optional[bytes] = None
+        self._data: Any = _NOT_DECODED
+        self._service_name = service_name
+        self._counted = False
+
+    def __repr__(self) -> str:
+        return f"Response(queue={self.queue!r}, headers={self.headers!r}, body=<{len(self.message.body)} bytes>)"
+
+    def __iter__(self) -> Iterator[Any]:
+        return (getattr(self, field) for field in self._fields)
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        return getattr(self, self._fields[index])
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    @property
+    def body(self) -> memoryview:
+        return memoryview(self._get_payload())
+
+    @property
+    def data(self) -> Any:
+        if self._data is _NOT_DECODED:
+            payload = self._get_payload()
+            self._data = self._decode(lambda: codecs.CODECS.get(self.message.content_type).decode(payload))
+            self._count("correct")
+        return self._data
+
+    def parse(self, type_: Type[T]) -> T:
+        """Decode the body into type_ (a pydantic model, dataclass, List[...], ...) by a cached TypeAdapter.
+        A JSON body is validated by pydantic directly, without the intermediate dict
+        """
+        adapter = codecs.get_type_adapter(type_)
+        codec = codecs.CODECS.get(self.message.content_type)
+        if codec.content_type == codecs.JSON_CONTENT_TYPE and self._data is _NOT_DECODED:
+            payload = self._get_payload()
+            value = self._decode(lambda: adapter.validate_json(payload))
+        else:
+            data = self.data
+            value = self._decode(lambda: adapter.validate_python(data))
+        self._count("correct")
+        return value
+
+    def _get_payload(self) -> bytes:
+        if self._payload is None:
+            message = self.message
+            self._payload = self._decode(
+                lambda: compression.decompress(message.body, message.content_encoding, self._service_name)
+            )
+        return self._payload
+
+    def _decode(self, decode: Callable[[], T]) -> T:
+        try:
+            return decode()
+        except Exception as exc:
+            if not self.decode_failed:
+                self.decode_failed = True
+                self._count("error")
+                logger.critical(f"Incorrect format of rabbitmq message {self.headers=}: {exc}")
+            raise DecodeError(f"Error decode rabbitmq message {self.message.message_id}: {exc}") from exc
+
+    def _count(self, status: str) -> None:
+        """A message is counted once, by the result of its first decode"""
+        if not self._counted:
+            self._counted = True
+            CONSUME_COUNTER.labels(self._service_name, status).inc()
+
+
+class OutgoingMessage(NamedTuple):
+    """Message of send_messages, properties are the aio_pika.Message arguments (content_type, priority, ...)"""
+
+    data: bytes
+    headers: Optional[dict] = None
+    routing_key: Optional[str] = None
+    exchange: Optional[str] = None
+    properties: Optional[Dict[str, Any]] = None
+
+
+class ChannelCache:
+    """Exchanges and queues checked on the channel, so the hot path does not redeclare them.
+    Cleared when the robust channel is closed or reopened and when the connection reconnects,
+    detach when the channel is closed for good, so the connection does not keep the cache
+    """
+
+    def __init__(self, channel: aio_pika.abc.AbstractRobustChannel, connection: aio_pika.abc.AbstractRobustConnection):
+        self.channel = channel
+        self.connection = connection
+        self.exchanges: Dict[str, aio_pika.abc.AbstractExchange] = {}
+        self.queues: Dict[str, aio_pika.abc.AbstractQueue] = {}
+        channel.close_callbacks.add(self.clear)
+        channel.reopen_callbacks.add(self.clear)
+        connection.reconnect_callbacks.add(self.clear)
+
+    def clear(self, *args) -> None:
+        self.exchanges.clear()
+        self.queues.clear()
+
+    def detach(self) -> None:
+        self.channel.close_callbacks.discard(self.clear)
+        self.channel.reopen_callbacks.discard(self.clear)
+        self.connection.reconnect_callbacks.discard(self.clear)
+        self.clear()
+
+    async def get_exchange(self, name: str) -> aio_pika.abc.AbstractExchange:
+        exchange = self.exchanges.get(name)
+        if exchange is None:
+            exchange = self.exchanges[name] = await self.channel.get_exchange(name, ensure=True)
+        return exchange
+
+    async def get_queue(self, name: str) -> aio_pika.abc.AbstractQueue:
+        queue = self.queues.get(name)
+        if queue is None:
+            queue = self.queues[name] = await self.channel.get_queue(name, ensure=True)
+        return queue
+
+
+@dataclasses.dataclass
+class PooledChannel:
+    channel: aio_pika.abc.AbstractRobustChannel
+    cache: ChannelCache
+    in_use: int = 0
+
+
+class ChannelPool:
+    """Channels for publishing. An operation checks out the least busy open channel (round-robin among equally
+    busy ones), so a slow confirm or flow control on one channel does not stall the others.
+    A closed channel is replaced by a new one in the background; while every channel is closed,
+    acquire waits for one up to wait_timeout seconds
+    """
+
+    def __init__(
+        self,
+        connection: aio_pika.abc.AbstractRobustConnection,
+        size: int,
+        publisher_confirms: bool = True,
+        service_name: str = "async_rabbitmq",
+        wait_timeout: float = 10,
+    ):
+        self.connection = connection
+        self.size = size
+        self.publisher_confirms = publisher_confirms
+        self.wait_timeout = wait_timeout
+        self.channels: List[PooledChannel] = []
+        self._cursor = 0
+        self._available = asyncio.Event()
+        self._recovering: Dict[int, asyncio.Task] = {}
+        self._wait_histogram = CHANNEL_POOL_WAIT_HISTOGRAM.labels(service_name)
+        self._open_gauge = CHANNEL_POOL_CHANNELS_GAUGE.labels(service_name, "open")
+        self._busy_gauge = CHANNEL_POOL_CHANNELS_GAUGE.labels(service_name, "busy")
+        self._operations_gauge = CHANNEL_POOL_OPERATIONS_GAUGE.labels(service_name)
+
+    async def open(self) -> None:
+        for _ in range(self.size):
+            self.channels.append(await self._open_channel())
+        self._update_gauges()
+
+    async def close(self) -> None:
+        for task in self._recovering.values():
+            task.cancel()
+        await asyncio.gather(*self._recovering.values(), return_exceptions=True)
+        self._recovering.clear()
+        channels, self.channels = self.channels, []
+        for pooled in channels:
+            await self._close_channel(pooled)
+        self._update_gauges()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[PooledChannel]:
+        if not self.channels:
+            raise RuntimeError("Channel pool is closed")
+        start = time.perf_counter()
+        pooled = self._checkout()
+        if pooled is None:
+            async with asyncio.timeout(self.wait_timeout):
+                while pooled is None:
+                    self._available.clear()
+                    with contextlib.suppress(TimeoutError):
+                        async with asyncio.timeout(1):
+                            await self._available.wait()
+                    pooled = self._checkout()
+        self._wait_histogram.observe(time.perf_counter() - start)
+        pooled.in_use += 1
+        self._update_gauges()
+        try:
+            yield pooled
+        finally:
+            pooled.in_use -= 1
+            self._update_gauges()
+
+    async def _open_channel(self) -> PooledChannel:
+        channel = await self.connection.channel(publisher_confirms=self.publisher_confirms)
+        channel.reopen_callbacks.add(self._on_reopen)
+        return PooledChannel(channel, ChannelCache(channel, self.connection))
+
+    async def _close_channel(self, pooled: PooledChannel) -> None:
+        pooled.channel.reopen_callbacks.discard(self._on_reopen)
+        pooled.cache.detach()
+        with contextlib.suppress(Exception):
+            await pooled.channel.close()
+
+    def _on_reopen(self, *args) -> None:
+        self._available.set()
+
+    def _checkout(self) -> Optional[PooledChannel]:
+        selected: Optional[PooledChannel] = None
+        size = len(self.channels)
+        for offset in range(size):
+            index = (self._cursor + offset) % size
+            pooled = self.channels[index]
+            if pooled.channel.is_closed:
+                self._recover(index)
+            elif selected is None or pooled.in_use < selected.in_use:
+                selected = pooled
+        self._cursor = (self._cursor + 1) % max(size, 1)
+        return selected
+
+    def _recover(self, index: int) -> None:
+        if index not in self._recovering and not self.connection.is_closed:
+            self._recovering[index] = asyncio.create_task(self._replace(index))
+
+    async def _replace(self, index: int) -> None:
+        try:
+            pooled = await self._open_channel()
+        except Exception as exc:
+            # retried on the next checkout
+            logger.warning(f"Error reopen rabbitmq channel {index} of the pool: {exc}")
+            return
+        finally:
+            self._recovering.pop(index, None)
+        closed, self.channels[index] = self.channels[index], pooled
+        logger.info(f"Rabbitmq channel {index} of the pool is replaced")
+        await self._close_channel(closed)
+        self._available.set()
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        self._open_gauge.set(sum(not pooled.channel.is_closed for pooled in self.channels))
+        self._busy_gauge.set(sum(pooled.in_use > 0 for pooled in self.channels))
+        self._operations_gauge.set(sum(pooled.in_use for pooled in self.channels))
 
 
 class Client:
@@ -36,23 +348,78 @@ def __init__(
         queue: Optional[str] = None,
         ssl_context: Optional[ssl.SSLContext] = None,
         service_name: str = "async_rabbitmq",
+        publisher_confirms: bool = True,
+        publish_window: int = 100,
+        channel_pool_size: int = 1,
+        channel_pool_wait_seconds: float = 10,
+        prefetch_count: Optional[int] = None,
+        prefetch_size: Optional[int] = None,
+        content_type: str = CONTENT_TYPE,
+        compression_encoding: Optional[compression.Encoding] = None,
+        compression_threshold_bytes: int = 64 * 1024,
+        compression_level: Optional[int] = None,
     ):
+        if content_type not in codecs.CODECS:
+            raise ValueError(f"No codec for {content_type=}")
         self._url = url
         self._queue = queue
         self._ssl_context = ssl_context
         self._connection: Optional[aio_pika.abc.AbstractRobustConnection] = None
         self._channel: Optional[aio_pika.abc.AbstractRobustChannel] = None
+        self._cache: Optional[ChannelCache] = None
+        # publishing goes through the pool, the channel above is for consuming and declaring
+        self._pool: Optional[ChannelPool] = None
+        self._channel_pool_size = channel_pool_size
+        self._channel_pool_wait_seconds = channel_pool_wait_seconds
+        self._content_type = content_type
+        self._compressor: Optional[compression.Compressor] = None
+        if compression_encoding:
+            self._compressor = compression.COMPRESSORS[compression_encoding](compression_level)
+        self._compression_threshold_bytes = compression_threshold_bytes
+        self._prefetch_count = prefetch_count
+        self._prefetch_size = prefetch_size
         self._service_name = service_name
+        self._publisher_confirms = publisher_confirms
+        self._publish_window = publish_window
+        self._publish_histogram = PUBLISH_HISTOGRAM.labels(service_name)
+        self._produce_correct = PRODUCE_COUNTER.labels(service_name, "correct")
+        self._produce_error = PRODUCE_COUNTER.labels(service_name, "error")
 
     async def __aenter__(self) -> "Client":
         self._connection = await aio_pika.connect_robust(self._url, ssl_context=self._ssl_context)
-        self._channel = await self._connection.channel()
+        self._channel = await self._connection.channel(publisher_confirms=self._publisher_confirms)
+        if self._prefetch_count is not None or self._prefetch_size is not None:
+            # per consumer, restored by the robust channel on reconnect
+            await self._channel.set_qos(
+                prefetch_count=self._prefetch_count or 0, prefetch_size=self._prefetch_size or 0
+            )
+        self._cache = ChannelCache(self._channel, self._connection)
+        self._pool = ChannelPool(
+            self._connection,
+            self._channel_pool_size,
+            publisher_confirms=self._publisher_confirms,
+            service_name=self._service_name,
+            wait_timeout=self._channel_pool_wait_seconds,
+        )
+        await self._pool.open()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._pool is not None:
+            await self._pool.close()
+        if self._cache is not None:
+            self._cache.detach()
         await self._connection.close()
         self._connection = None
         self._channel = None
+        self._cache = None
+        self._pool = None
+
+    @property
+    def connection(self) -> aio_pika.abc.AbstractRobustConnection:
+        if not self._connection:
+            raise RuntimeError("Connection not open")
+        return self._connection
 
     @classmethod
     def from_settings(cls, settings: config.Settings) -> "Client":
@@ -61,19 +428,28 @@ def from_settings(cls, settings: config.Settings) -> "Client":
             queue=settings.queue,
             ssl_context=settings.ssl_settings and settings.ssl_settings.ssl_context,
             service_name=settings.service_name,
+            publisher_confirms=settings.publisher_confirms,
+            publish_window=settings.publish_window,
+            channel_pool_size=settings.channel_pool_size,
+            channel_pool_wait_seconds=settings.channel_pool_wait_seconds,
+            prefetch_count=settings.prefetch_count,
+            prefetch_size=settings.prefetch_size,
+            content_type=settings.content_type,
+            compression_encoding=settings.compression,
+            compression_threshold_bytes=settings.compression_threshold_bytes,
+            compression_level=settings.compression_level,
         )
 
     @classmethod
-    def serialize(cls, value: object, encoding: str = "utf-8") -> bytes:
+    def serialize(cls, value: object, encoding: str = "utf-8", content_type: str = CONTENT_TYPE) -> bytes:
+        """Encode the value by the codec of content_type, JSON objects with dumps() serialize themselves"""
         if value is None:
             raise ValueError("Cannot serialize None value")
-        if hasattr(value, "dumps") and callable(value.dumps):
+        codec = codecs.CODECS.get(content_type)
+        if codec.content_type == codecs.JSON_CONTENT_TYPE and hasattr(value, "dumps") and callable(value.dumps):
             data: str | bytes = value.dumps()
-        elif hasattr(value, "model_dump_json") and callable(value.model_dump_json):
-            data = value.model_dump_json(by_alias=True)
-        else:
-            data = jsons.dumps(value, jdkwargs={"ensure_ascii": False})
-        return data if isinstance(data, bytes) else data.encode(encoding)
+            return data if isinstance(data, bytes) else data.encode(encoding)
+        return codec.encode(value)
 
     async def send(
         self,
@@ -83,7 +459,9 @@ async def send(
         exchange: Optional[str] = None,
         **kwargs,
     ) -> None:
-        await self.send_message(self.serialize(value), headers, routing_key=routing_key, exchange=exchange, **kwargs)
+        content_type = kwargs.setdefault("content_type", self._content_type)
+        data = self.serialize(value, content_type=content_type)
+        await self.send_message(data, headers, routing_key=routing_key, exchange=exchange, **kwargs)
 
     async def send_message(
         self,
@@ -93,12 +471,72 @@ async def send_message(
         exchange: Optional[str] = None,
         **kwargs,
     ) -> None:
-        if not self._channel:
+        if not self._pool:
+            raise ValueError("Channel not open")
+        compressor = self._compressor
+        if compressor and "content_encoding" not in kwargs and len(data) >= self._compression_threshold_bytes:
+            # a body with content_encoding (e.g. republished as it was received) is sent as it is
+            data = await asyncio.to_thread(compression.compress, compressor, data, self._service_name)
+            kwargs["content_encoding"] = compressor.encoding
+        message = self.build_message(data, headers, **kwargs)
+        async with self._pool.acquire() as pooled:
+            exchange_ = await self._get_exchange(pooled, exchange)
+            await self._publish(exchange_, message, self._get_routing_key(routing_key))
+
+    async def send_many(
+        self,
+        values: Iterable[object],
+        headers: Optional[dict] = None,
+        routing_key: Optional[str] = None,
+        exchange: Optional[str] = None,
+        **kwargs,
+    ) -> List[Optional[Exception]]:
+        """Publish the values to one destination, see send_messages"""
+        content_type = kwargs.setdefault("content_type", self._content_type)
+        return await self.send_messages(
+            OutgoingMessage(self.serialize(value, content_type=content_type), headers, routing_key, exchange, kwargs)
+            for value in values
+        )
+
+    async def send_messages(self, messages: Iterable[OutgoingMessage]) -> List[Optional[Exception]]:
+        """Publish the messages without waiting for the confirm of each one before the next:
+        up to publish_window messages are unconfirmed at once, spread over the channel pool.
+        Returns the result of every message in the same order: None if it is confirmed, else the error
+        """
+        if not self._pool:
             raise ValueError("Channel not open")
+        window = asyncio.Semaphore(self._publish_window)
+        results: List[Optional[Exception]] = []
+
+        async def publish(index: int, item: OutgoingMessage) -> None:
+            try:
+                await self.send_message(
+                    item.data,
+                    item.headers,
+                    routing_key=item.routing_key,
+                    exchange=item.exchange,
+                    **(item.properties or {}),
+                )
+            except Exception as exc:
+                results[index] = exc
+            finally:
+                window.release()
+
+        async with asyncio.TaskGroup() as group:
+            for item in messages:
+                await window.acquire()
+                results.append(None)
+                group.create_task(publish(len(results) - 1, item))
+        return results
+
+    @staticmethod
+    def build_message(data: bytes, headers: Optional[dict] = None, **kwargs) -> aio_pika.Message:
         if headers:
-            headers = dict(headers)
-            propagate.inject(headers)
-        message = aio_pika.Message(
+            carrier: Dict[str, str] = {}
+            propagate.inject(carrier)
+            # the trace context given in headers (e.g. of a relayed message) takes precedence over the current one
+            headers = {**carrier, **headers}
+        return aio_pika.Message(
             data,
             headers=headers,
             delivery_mode=kwargs.pop("delivery_mode", DELIVERY_MODE),  # persistent
@@ -108,66 +546,139 @@ async def send_message(
             timestamp=kwargs.pop("timestamp", datetime.datetime.now(datetime.timezone.utc)),
             **kwargs,
         )
+
+    @staticmethod
+    async def _get_exchange(pooled: PooledChannel, exchange: Optional[str]) -> aio_pika.abc.AbstractExchange:
         if not exchange:
-            exchange_ = self._channel.default_exchange
-        else:
-            exchange_ = await self._channel.get_exchange(exchange, ensure=True)
+            return pooled.channel.default_exchange
+        return await pooled.cache.get_exchange(exchange)
+
+    def _get_routing_key(self, routing_key: Optional[str]) -> str:
         routing_key = routing_key or self._queue
         if not routing_key:
             raise RuntimeError("Not set routing_key")
+        return routing_key
+
+    async def _publish(
+        self, exchange_: aio_pika.abc.AbstractExchange, message: aio_pika.Message, routing_key: str
+    ) -> None:
+        start = time.perf_counter()
         try:
             await exchange_.publish(message, routing_key)
-            PRODUCE_COUNTER.labels(self._service_name, "correct").inc()
+            self._produce_correct.inc()
         except Exception:
-            PRODUCE_COUNTER.labels(self._service_name, "error").inc()
+            self._produce_error.inc()
             raise
+        finally:
+            self._publish_histogram.observe(time.perf_counter() - start)
+
+    async def set_qos(self, prefetch_count: int, prefetch_size: int = 0) -> None:
+        """Limit the unacked messages per consumer, 0 - no limit"""
+        if not self._channel:
+            raise RuntimeError("Channel not open")
+        await self._channel.set_qos(prefetch_count=prefetch_count, prefetch_size=prefetch_size)
+        self._prefetch_count, self._prefetch_size = prefetch_count, prefetch_size
+
+    async def declare_queue(self, name: str, arguments: Optional[Dict[str, Any]] = None, durable: bool = True) -> None:
+        if not self._channel or not self._cache:
+            raise RuntimeError("Channel not open")
+        self._cache.queues[name] = await self._channel.declare_queue(name, durable=durable, arguments=arguments)
 
     async def fetch(
         self, *, queue: Optional[str] = None, no_ack: bool = False, fail: bool = True, timeout: int = 5
     ) -> Optional[Response]:
+        """Get one message, its body is decoded: a message that can not be decoded is nacked without requeue
+        and None is returned
+        """
         queue = queue or self._queue
         if not queue:
             raise RuntimeError("Queue not set")
-        if not self._channel:
+        if not self._cache:
             raise RuntimeError("Channel not open")
-        queue_ = await self._channel.get_queue(queue)
+        queue_ = await self._cache.get_queue(queue)
         message = await queue_.get(no_ack=no_ack, fail=fail, timeout=timeout)  # noqa
         if not message:
             return None
+        response = self._create_response(message, queue)
         try:
-            result = Response(
-                data=json.loads(message.body.decode(CONTENT_ENCODING)),
-                headers=dict(message.headers),
-                message=message,
-            )
-            CONSUME_COUNTER.labels(self._service_name, "correct").inc()
-        except Exception as exc:
-            logger.critical(f"Skip rabbitmq message incorrect format {message.headers=}: {exc}")
-            CONSUME_COUNTER.labels(self._service_name, "error").inc()
-            await message.nack(requeue=False)
+            response.data
+        except DecodeError:
+            if not no_ack:
+                await message.nack(requeue=False)
             return None
-        return result
+        return response
 
-    async def receive(self) -> AsyncGenerator[Response, None]:
-        queue = self._queue
-        if not queue:
+    async def receive(
+        self, *, manual_ack: bool = False, queues: Optional[Sequence[str]] = None
+    ) -> AsyncGenerator[Response, None]:
+        """Consume messages from the queue or from several queues.
+        Messages of several queues are taken in turn from the queues with delivered messages, so a busy queue
+        does not starve the others; every queue has up to prefetch_count unacked messages.
+        By default, a message that was not processed by the consumer is acked when the next one is requested.
+        With manual_ack=True the consumer must ack/nack every message itself, so several messages may be in progress.
+        Bodies are decoded on access, see Response
+        """
+        queues = list(queues or ([self._queue] if self._queue else []))
+        if not queues:
             raise RuntimeError("Queue not set")
-        if not self._channel:
+        if not self._cache:
             raise RuntimeError("Channel not open")
-        queue_ = await self._channel.get_queue(queue)
-        async with queue_.iterator() as queue_iter:
-            async for message in queue_iter:  # type: aio_pika.abc.AbstractIncomingMessage
+        buffers: List[asyncio.Queue[aio_pika.abc.AbstractIncomingMessage]] = [asyncio.Queue() for _ in queues]
+        delivered = asyncio.Event()
+        consumers: List[Tuple[aio_pika.abc.AbstractQueue, aio_pika.abc.ConsumerTag]] = []
+
+        def on_message(buffer: asyncio.Queue[aio_pika.abc.AbstractIncomingMessage]):
+            async def callback(message: aio_pika.abc.AbstractIncomingMessage) -> None:
+                buffer.put_nowait(message)
+                delivered.set()
+
+            return callback
+
+        try:
+            for queue, buffer in zip(queues, buffers):
+                queue_ = await self._cache.get_queue(queue)
+                consumers.append((queue_, await queue_.consume(on_message(buffer))))
+            cursor = 0
+            while True:
+                for offset in range(len(buffers)):
+                    index = (cursor + offset) % len(buffers)
+                    if not buffers[index].empty():
+                        break
+                else:
+                    delivered.clear()
+                    await delivered.wait()
+                    continue
+                cursor = index + 1
+                message = buffers[index].get_nowait()
+                result = self._create_response(message, queues[index])
+                if manual_ack:
+                    yield result
+                    continue
                 async with message.process(ignore_processed=True):
-                    try:
-                        result = Response(
-                            data=json.loads(message.body.decode(CONTENT_ENCODING)),
-                            headers=dict(message.headers),
-                            message=message,
-                        )
-                        CONSUME_COUNTER.labels(self._service_name, "correct").inc()
-                    except Exception as exc:
-                        CONSUME_COUNTER.labels(self._service_name, "error").inc()
-                        logger.critical(f"Skip rabbitmq message incorrect format {message.headers=}: {exc}")
-                        await message.nack(requeue=False)
-                        continue
                     yield result
+                    if result.decode_failed:
+                        await message.nack(requeue=False)
+        finally:
+            await self._stop_consumers(consumers, buffers)
+
+    @staticmethod
+    async def _stop_consumers(
+        consumers: List[Tuple[aio_pika.abc.AbstractQueue, aio_pika.abc.ConsumerTag]],
+        buffers: List[asyncio.Queue[aio_pika.abc.AbstractIncomingMessage]],
+    ) -> None:
+        """Cancel the consumers and return the delivered messages that were not yielded to the queues"""
+        for queue_, consumer_tag in consumers:
+            try:
+                await queue_.cancel(consumer_tag)
+            except Exception as exc:
+                logger.warning(f"Error cancel rabbitmq consumer of {queue_.name}: {exc}")
+        for buffer in buffers:
+            while not buffer.empty():
+                message = buffer.get_nowait()
+                try:
+                    await message.nack(requeue=True)
+                except Exception as exc:
+                    logger.warning(f"Error return rabbitmq message {message.delivery_tag}: {exc}")
+
+    def _create_response(self, message: aio_pika.abc.AbstractIncomingMessage, queue: Optional[str]) -> Response:
+        return Response(message, queue, self._service_name)
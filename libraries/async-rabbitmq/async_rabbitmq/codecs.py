@@ -0,0 +1,107 @@
+import abc
+import dataclasses
+import datetime
+import logging
+from typing import Any, Dict, Iterable, Optional
+
+import jsons
+import msgpack
+import orjson
+import pydantic
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+
+def _to_builtins(value: Any) -> Any:
+    """Fallback for the types the codec does not support natively"""
+    if hasattr(value, "model_dump") and callable(value.model_dump):
+        return value.model_dump(mode="json", by_alias=True)
+    return jsons.dump(value)
+
+
+_TYPE_ADAPTERS: Dict[Any, pydantic.TypeAdapter] = {}
+
+
+def get_type_adapter(type_: Any) -> pydantic.TypeAdapter:
+    """TypeAdapter builds the validator of the type, it is done once per type"""
+    adapter = _TYPE_ADAPTERS.get(type_)
+    if adapter is None:
+        adapter = _TYPE_ADAPTERS[type_] = pydantic.TypeAdapter(type_)
+    return adapter
+
+
+class Codec(metaclass=abc.ABCMeta):
+    content_type: str
+
+    @abc.abstractmethod
+    def encode(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def decode(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """orjson: dicts, lists, dataclasses, datetime, UUID and enums natively, pydantic models by model_dump_json"""
+
+    content_type = JSON_CONTENT_TYPE
+
+    def encode(self, value: Any) -> bytes:
+        if hasattr(value, "model_dump_json") and callable(value.model_dump_json):
+            return value.model_dump_json(by_alias=True).encode()
+        return orjson.dumps(value, default=_to_builtins, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    content_type = MSGPACK_CONTENT_TYPE
+
+    def encode(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=self._default)
+
+    def decode(self, data: bytes) -> Any:
+        # maps with int keys, which encode accepts, are decoded as they were sent
+        return msgpack.unpackb(data, strict_map_key=False)
+
+    @staticmethod
+    def _default(value: Any) -> Any:
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return value.isoformat()
+        return _to_builtins(value)
+
+
+class CodecRegistry:
+    """Codecs by content_type. Messages with an unknown or empty content_type are decoded by the default codec"""
+
+    def __init__(self, codecs: Iterable[Codec], default_content_type: str = JSON_CONTENT_TYPE):
+        self._codecs: Dict[str, Codec] = {}
+        for codec in codecs:
+            self.register(codec)
+        self.default = self._codecs[default_content_type]
+
+    def register(self, codec: Codec) -> None:
+        self._codecs[codec.content_type] = codec
+
+    def get(self, content_type: Optional[str]) -> Codec:
+        """Codec of the content_type, e.g. "application/json; charset=utf-8" """
+        if not content_type:
+            return self.default
+        codec = self._codecs.get(content_type.split(";", 1)[0].strip().lower())
+        if codec is None:
+            logger.debug(f"No codec for {content_type=}, use {self.default.content_type}")
+            return self.default
+        return codec
+
+    def __contains__(self, content_type: str) -> bool:
+        return content_type in self._codecs
+
+
+CODECS = CodecRegistry([JsonCodec(), MsgpackCodec()])
@@ -0,0 +1,89 @@
+import abc
+import gzip
+import time
+from typing import Dict, Literal, Optional, Type
+
+import zstandard
+from prometheus_client import Histogram
+
+Encoding = Literal["gzip", "zstd"]
+
+COMPRESSION_RATIO_HISTOGRAM = Histogram(
+    "async_rabbitmq_compression_ratio",
+    "Compressed size to original size of the sent bodies",
+    ["service_name", "encoding"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, float("inf")),
+)
+COMPRESSION_HISTOGRAM = Histogram(
+    "async_rabbitmq_compression_duration_seconds",
+    "Time spent compressing and decompressing bodies",
+    ["service_name", "encoding", "operation"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, float("inf")),
+)
+
+
+class Compressor(metaclass=abc.ABCMeta):
+    """Compression of the message body, the message content_encoding is the encoding of the compressor"""
+
+    encoding: str
+
+    def __init__(self, level: Optional[int] = None):
+        self.level = level
+
+    @abc.abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class GzipCompressor(Compressor):
+    encoding = "gzip"
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=6 if self.level is None else self.level, mtime=0)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+class ZstdCompressor(Compressor):
+    encoding = "zstd"
+
+    def compress(self, data: bytes) -> bytes:
+        # zstandard compressors are not thread-safe, a new one is cheap
+        return zstandard.ZstdCompressor(level=3 if self.level is None else self.level).compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+COMPRESSORS: Dict[str, Type[Compressor]] = {
+    GzipCompressor.encoding: GzipCompressor,
+    ZstdCompressor.encoding: ZstdCompressor,
+}
+_DECOMPRESSORS: Dict[str, Compressor] = {encoding: compressor() for encoding, compressor in COMPRESSORS.items()}
+
+
+def compress(compressor: Compressor, data: bytes, service_name: str) -> bytes:
+    start = time.perf_counter()
+    compressed = compressor.compress(data)
+    COMPRESSION_HISTOGRAM.labels(service_name, compressor.encoding, "compress").observe(time.perf_counter() - start)
+    COMPRESSION_RATIO_HISTOGRAM.labels(service_name, compressor.encoding).observe(len(compressed) / max(len(data), 1))
+    return compressed
+
+
+def decompress(data: bytes, content_encoding: Optional[str], service_name: str) -> bytes:
+    """The body as it was before compression, a body with another content_encoding (e.g. utf-8) as it is"""
+    compressor = _DECOMPRESSORS.get(content_encoding or "")
+    if compressor is None:
+        return data
+    start = time.perf_counter()
+    try:
+        return compressor.decompress(data)
+    finally:
+        COMPRESSION_HISTOGRAM.labels(service_name, compressor.encoding, "decompress").observe(
+            time.perf_counter() - start
+        )
@@ -1,6 +1,6 @@
 import logging
 import ssl
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Literal, Optional
 
 import pydantic
 import yarl
@@ -45,6 +45,43 @@ class Settings(pydantic_base_settings.BaseSettings):
     password: Optional[str] = pydantic.Field("guest", validation_alias="RABBITMQ_PASSWORD")
     queue: Optional[str] = pydantic.Field(None, validation_alias="RABBITMQ_QUEUE")
     service_name: str = pydantic.Field("async_rabbitmq")
+    content_type: str = pydantic.Field(
+        "application/json",
+        validation_alias="RABBITMQ_CONTENT_TYPE",
+        description="Codec of the sent values: application/json, application/msgpack",
+    )
+    compression: Optional[Literal["gzip", "zstd"]] = pydantic.Field(
+        None, validation_alias="RABBITMQ_COMPRESSION", description="Compress sent bodies, received ones are always"
+    )
+    compression_threshold_bytes: int = pydantic.Field(
+        64 * 1024, validation_alias="RABBITMQ_COMPRESSION_THRESHOLD_BYTES", ge=0, description="Smaller bodies as is"
+    )
+    compression_level: Optional[int] = pydantic.Field(None, validation_alias="RABBITMQ_COMPRESSION_LEVEL")
+    publisher_confirms: bool = pydantic.Field(
+        True, validation_alias="RABBITMQ_PUBLISHER_CONFIRMS", description="Wait for the broker to confirm publishes"
+    )
+    publish_window: int = pydantic.Field(
+        100, validation_alias="RABBITMQ_PUBLISH_WINDOW", ge=1, description="Unconfirmed messages of send_many"
+    )
+    prefetch_count: Optional[int] = pydantic.Field(
+        None,
+        validation_alias="RABBITMQ_PREFETCH_COUNT",
+        ge=0,
+        description="Unacked messages per consumer, 0 - no limit. Not set: the free slots of an async_workers reader",
+    )
+    prefetch_size: Optional[int] = pydantic.Field(
+        None, validation_alias="RABBITMQ_PREFETCH_SIZE", ge=0, description="Unacked bytes per consumer, 0 - no limit"
+    )
+    channel_pool_size: int = pydantic.Field(1, validation_alias="RABBITMQ_CHANNEL_POOL_SIZE", ge=1)
+    channel_pool_wait_seconds: float = pydantic.Field(
+        10, validation_alias="RABBITMQ_CHANNEL_POOL_WAIT_SECONDS", gt=0, description="Wait for an open channel to send"
+    )
+    rpc_timeout_seconds: float = pydantic.Field(
+        30, validation_alias="RABBITMQ_RPC_TIMEOUT_SECONDS", gt=0, description="Default timeout of RpcClient calls"
+    )
+    rpc_max_in_flight: int = pydantic.Field(
+        1000, validation_alias="RABBITMQ_RPC_MAX_IN_FLIGHT", ge=1, description="RpcClient calls waiting for replies"
+    )
 
     ssl_settings: Optional[SslSettings] = pydantic.Field(default_factory=SslSettings.read)
 
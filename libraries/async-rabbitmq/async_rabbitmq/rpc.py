@@ -0,0 +1,167 @@
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import aio_pika
+from prometheus_client import Counter, Gauge, Histogram
+
+from async_rabbitmq import client, config
+
+logger = logging.getLogger(__name__)
+
+REPLY_TO = "amq.rabbitmq.reply-to"
+
+RPC_COUNTER = Counter("async_rabbitmq_rpc", "Number of rpc calls", ["service_name", "status"])
+RPC_HISTOGRAM = Histogram(
+    "async_rabbitmq_rpc_duration_seconds",
+    "Time from the request to the reply of rpc calls",
+    ["service_name"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf")),
+)
+RPC_IN_FLIGHT_GAUGE = Gauge("async_rabbitmq_rpc_in_flight", "Rpc calls waiting for the reply", ["service_name"])
+
+
+class RpcClient:
+    """Request/response over RabbitMQ direct reply-to: a request is published with reply_to=amq.rabbitmq.reply-to
+    on the channel of a single no-ack consumer, its reply is matched to the waiting call by correlation_id,
+    so no reply queue is declared per call. Replies are sent by rabbitmq.TaskReader.complete of async_workers.
+    Up to max_in_flight calls wait for replies at once, the others wait for a slot within their timeout.
+    A request that can not be routed to a queue fails at once. The reply address is lost with the channel:
+    calls waiting for replies fail with ConnectionError when it is closed
+    """
+
+    def __init__(
+        self,
+        rabbitmq: client.Client,
+        timeout: float = 30,
+        max_in_flight: int = 1000,
+        content_type: str = client.CONTENT_TYPE,
+        service_name: str = "async_rabbitmq",
+    ):
+        self._rabbitmq = rabbitmq
+        self.timeout = timeout
+        self._content_type = content_type
+        self._service_name = service_name
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._futures: Dict[str, asyncio.Future[client.Response]] = {}
+        # unique per client, cheaper than an uuid per call
+        self._correlation_prefix = f"{uuid.uuid4().hex}."
+        self._correlation_ids = itertools.count()
+        self._channel: Optional[aio_pika.abc.AbstractRobustChannel] = None
+        self._cache: Optional[client.ChannelCache] = None
+        self._histogram = RPC_HISTOGRAM.labels(service_name)
+        self._in_flight_gauge = RPC_IN_FLIGHT_GAUGE.labels(service_name)
+        self._correct_counter = RPC_COUNTER.labels(service_name, "correct")
+        self._error_counter = RPC_COUNTER.labels(service_name, "error")
+        self._timeout_counter = RPC_COUNTER.labels(service_name, "timeout")
+        self._late_counter = RPC_COUNTER.labels(service_name, "late")
+
+    @classmethod
+    def from_settings(cls, rabbitmq: client.Client, settings: config.Settings) -> "RpcClient":
+        return cls(
+            rabbitmq,
+            timeout=settings.rpc_timeout_seconds,
+            max_in_flight=settings.rpc_max_in_flight,
+            content_type=settings.content_type,
+            service_name=settings.service_name,
+        )
+
+    async def __aenter__(self) -> "RpcClient":
+        connection = self._rabbitmq.connection
+        # the replies of the requests published with confirms: an unroutable request raises DeliveryError
+        self._channel = await connection.channel(publisher_confirms=True, on_return_raises=True)
+        self._channel.close_callbacks.add(self._on_close)
+        self._cache = client.ChannelCache(self._channel, connection)
+        # the robust queue restores the consumer when the channel is reopened
+        queue = await self._channel.declare_queue(REPLY_TO, passive=True)
+        await queue.consume(self._on_reply, no_ack=True)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        channel, self._channel, self._cache = self._channel, None, None
+        self._fail_calls(ConnectionError("Rpc client is closed"))
+        if channel is not None:
+            await channel.close()
+
+    async def call(
+        self,
+        value: object,
+        routing_key: str,
+        exchange: Optional[str] = None,
+        headers: Optional[dict] = None,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> client.Response:
+        content_type = kwargs.setdefault("content_type", self._content_type)
+        data = client.Client.serialize(value, content_type=content_type)
+        return await self.call_message(data, routing_key, exchange, headers, timeout, **kwargs)
+
+    async def call_message(
+        self,
+        data: bytes,
+        routing_key: str,
+        exchange: Optional[str] = None,
+        headers: Optional[dict] = None,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> client.Response:
+        """Send the request and wait for the reply up to timeout seconds (the client timeout by default).
+        Requests are not persistent and expire with the timeout, so a server does not handle abandoned calls
+        """
+        timeout = self.timeout if timeout is None else timeout
+        correlation_id = f"{self._correlation_prefix}{next(self._correlation_ids)}"
+        kwargs.setdefault("delivery_mode", aio_pika.DeliveryMode.NOT_PERSISTENT)
+        kwargs.setdefault("expiration", timeout)
+        message = client.Client.build_message(
+            data, headers, correlation_id=correlation_id, reply_to=REPLY_TO, **kwargs
+        )
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(timeout):
+                async with self._in_flight:
+                    response = await self._call(correlation_id, message, routing_key, exchange)
+        except TimeoutError:
+            self._timeout_counter.inc()
+            raise TimeoutError(f"No reply to rpc call {correlation_id} to {routing_key} in {timeout} sec") from None
+        except Exception:
+            self._error_counter.inc()
+            raise
+        finally:
+            self._histogram.observe(time.perf_counter() - start)
+        self._correct_counter.inc()
+        return response
+
+    async def _call(
+        self, correlation_id: str, message: aio_pika.Message, routing_key: str, exchange: Optional[str]
+    ) -> client.Response:
+        if self._channel is None or self._cache is None:
+            raise RuntimeError("Channel not open")
+        exchange_ = await self._cache.get_exchange(exchange) if exchange else self._channel.default_exchange
+        future = self._futures[correlation_id] = asyncio.get_running_loop().create_future()
+        self._in_flight_gauge.inc()
+        try:
+            await exchange_.publish(message, routing_key)
+            return await future
+        finally:
+            self._futures.pop(correlation_id, None)
+            self._in_flight_gauge.dec()
+
+    async def _on_reply(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        future = self._futures.get(message.correlation_id or "")
+        if future is None or future.done():
+            # the call is timed out or cancelled
+            self._late_counter.inc()
+            logger.debug(f"No rpc call waits for the reply {message.correlation_id}")
+            return
+        future.set_result(client.Response(message, REPLY_TO, self._service_name))
+
+    def _on_close(self, sender: Any, exc: Optional[BaseException] = None) -> None:
+        self._fail_calls(ConnectionError(f"Rabbitmq rpc channel is closed: {exc}"))
+
+    def _fail_calls(self, exc: Exception) -> None:
+        for future in self._futures.values():
+            if not future.done():
+                future.set_exception(exc)
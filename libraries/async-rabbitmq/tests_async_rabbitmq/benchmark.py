@@ -0,0 +1,131 @@
+"""Latency of Client.send_message to a named exchange and of Client.fetch with the ChannelCache
+and without it (the cache is cleared before every call, one passive declare per call as before the cache).
+Requires RabbitMQ, the connection is configured by the RABBITMQ_* environment variables.
+
+    python -m tests_async_rabbitmq.benchmark --output benchmark.json
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import json
+import pathlib
+import platform
+import statistics
+import sys
+import time
+import uuid
+from typing import Awaitable, Callable, List, Optional
+
+import aio_pika
+
+from async_rabbitmq import client, config
+
+
+@dataclasses.dataclass
+class Result:
+    scenario: str
+    calls: int
+    calls_per_second: float
+    latency_p50_us: float
+    latency_p99_us: float
+    latency_mean_us: float
+
+
+def _percentile(values: List[float], percent: int) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1] if len(values) > 1 else values[0]
+
+
+async def measure(scenario: str, calls: int, call: Callable[[], Awaitable[object]]) -> Result:
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        call_start = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - call_start)
+    duration = time.perf_counter() - start
+    result = Result(
+        scenario=scenario,
+        calls=calls,
+        calls_per_second=round(calls / duration, 1),
+        latency_p50_us=round(_percentile(latencies, 50) * 1e6, 2),
+        latency_p99_us=round(_percentile(latencies, 99) * 1e6, 2),
+        latency_mean_us=round(statistics.fmean(latencies) * 1e6, 2),
+    )
+    print(
+        f"{result.scenario:<20} {result.calls_per_second:>10.1f} calls/s "
+        f"p50={result.latency_p50_us:.1f}us p99={result.latency_p99_us:.1f}us",
+        file=sys.stderr,
+    )
+    return result
+
+
+async def run(settings: config.Settings, calls: int) -> List[Result]:
+    name = f"async-rabbitmq-benchmark-{uuid.uuid4()}"
+    rabbitmq = client.Client.from_settings(settings)
+    async with rabbitmq:
+        channel, cache, pool = rabbitmq._channel, rabbitmq._cache, rabbitmq._pool
+        assert channel is not None and cache is not None and pool is not None
+
+        def clear_caches() -> None:
+            cache.clear()
+            for pooled in pool.channels:
+                pooled.cache.clear()
+
+        exchange = await channel.declare_exchange(name, aio_pika.ExchangeType.DIRECT, auto_delete=True)
+        queue = await channel.declare_queue(name, exclusive=True)
+        await queue.bind(exchange, routing_key=name)
+
+        async def send() -> None:
+            await rabbitmq.send_message(b"{}", routing_key=name, exchange=name)
+
+        async def send_uncached() -> None:
+            clear_caches()
+            await send()
+
+        async def fetch() -> None:
+            await rabbitmq.fetch(queue=name, no_ack=True)
+
+        async def fetch_uncached() -> None:
+            clear_caches()
+            await fetch()
+
+        # warm up the connection and metric label children
+        await measure("warm up", min(calls, 100), send)
+        results = [
+            await measure("publish uncached", calls, send_uncached),
+            await measure("publish cached", calls, send),
+        ]
+        # the queue holds the messages of the warm up and of both publish scenarios
+        results.extend(
+            [
+                await measure("fetch uncached", calls, fetch_uncached),
+                await measure("fetch cached", calls, fetch),
+            ]
+        )
+        await queue.delete(if_unused=False, if_empty=False)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000, help="calls per scenario")
+    parser.add_argument("--output", type=pathlib.Path, help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    results = [dataclasses.asdict(result) for result in asyncio.run(run(config.Settings(), args.calls))]
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "calls": args.calls,
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
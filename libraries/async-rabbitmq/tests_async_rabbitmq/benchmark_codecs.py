@@ -0,0 +1,134 @@
+"""Encode and decode time of the codecs against the jsons path used by Client before the codec registry,
+on typical payloads. Does not need RabbitMQ.
+
+    python -m tests_async_rabbitmq.benchmark_codecs --output codecs.json
+"""
+
+import argparse
+import dataclasses
+import datetime
+import json
+import pathlib
+import platform
+import statistics
+import sys
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+import jsons
+import pydantic
+
+from async_rabbitmq import client, codecs
+
+
+@dataclasses.dataclass
+class Event:
+    event_id: str
+    created_at: datetime.datetime
+    user_id: int
+    tags: List[str]
+    attributes: Dict[str, Any]
+
+
+class Task(pydantic.BaseModel):
+    task_id: str
+    priority: int
+    payload: Dict[str, Any]
+
+
+def _event(index: int) -> Event:
+    return Event(
+        event_id=str(uuid.UUID(int=index)),
+        created_at=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=index),
+        user_id=index,
+        tags=["a", "b", "c"],
+        attributes={"source": "api", "score": index / 3, "active": index % 2 == 0},
+    )
+
+
+PAYLOADS: Dict[str, Callable[[], Any]] = {
+    "small dict": lambda: {"task_id": "42", "status": "done", "attempt": 1},
+    "dataclass": lambda: _event(1),
+    "pydantic": lambda: Task(task_id="42", priority=1, payload={"items": list(range(20)), "name": "report"}),
+    "report 1000 rows": lambda: {
+        "rows": [{"id": i, "name": f"row {i}", "value": i * 1.5, "tags": ["x", "y"]} for i in range(1000)]
+    },
+}
+
+
+@dataclasses.dataclass
+class Result:
+    payload: str
+    codec: str
+    size_bytes: int
+    encode_us: float
+    decode_us: float
+
+
+def jsons_encode(value: Any) -> bytes:
+    if hasattr(value, "model_dump_json") and callable(value.model_dump_json):
+        return value.model_dump_json(by_alias=True).encode()
+    return jsons.dumps(value, jdkwargs={"ensure_ascii": False}).encode()
+
+
+def jsons_decode(data: bytes) -> Any:
+    return json.loads(data.decode(client.CONTENT_ENCODING))
+
+
+def _median_us(function: Callable[[], Any], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings) * 1e6, 2)
+
+
+def run(repeat: int) -> List[Result]:
+    candidates: Dict[str, tuple] = {"jsons": (jsons_encode, jsons_decode)}
+    for content_type in (codecs.JSON_CONTENT_TYPE, codecs.MSGPACK_CONTENT_TYPE):
+        codec = codecs.CODECS.get(content_type)
+        candidates[content_type] = (codec.encode, codec.decode)
+    results = []
+    for payload_name, factory in PAYLOADS.items():
+        value = factory()
+        for codec_name, (encode, decode) in candidates.items():
+            data = encode(value)
+            result = Result(
+                payload=payload_name,
+                codec=codec_name,
+                size_bytes=len(data),
+                encode_us=_median_us(lambda: encode(value), repeat),
+                decode_us=_median_us(lambda: decode(data), repeat),
+            )
+            print(
+                f"{result.payload:<18} {result.codec:<20} {result.size_bytes:>8} B "
+                f"encode={result.encode_us:.1f}us decode={result.decode_us:.1f}us",
+                file=sys.stderr,
+            )
+            results.append(result)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="calls per payload and codec")
+    parser.add_argument("--output", type=pathlib.Path, help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    results = [dataclasses.asdict(result) for result in run(args.repeat)]
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
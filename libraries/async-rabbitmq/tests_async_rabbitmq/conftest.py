@@ -0,0 +1,13 @@
+from typing import Any
+
+
+class CallbackCollection(set):
+    """aio_pika.tools.CallbackCollection: callbacks are called with the sender"""
+
+    def __init__(self, sender: Any) -> None:
+        super().__init__()
+        self.sender = sender
+
+    def __call__(self, *args: Any) -> None:
+        for callback in list(self):
+            callback(self.sender, *args)
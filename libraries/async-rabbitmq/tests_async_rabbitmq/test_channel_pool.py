@@ -0,0 +1,65 @@
+import asyncio
+from typing import Any, List
+
+from async_rabbitmq import client
+from tests_async_rabbitmq.conftest import CallbackCollection
+
+
+class Channel:
+    def __init__(self) -> None:
+        self.is_closed = False
+        self.close_callbacks = CallbackCollection(self)
+        self.reopen_callbacks = CallbackCollection(self)
+
+    async def close(self) -> None:
+        self.is_closed = True
+
+    async def get_exchange(self, name: str, ensure: bool) -> Any:
+        return (self, name)
+
+
+class Connection:
+    def __init__(self) -> None:
+        self.is_closed = False
+        self.channels: List[Channel] = []
+        self.reconnect_callbacks = CallbackCollection(self)
+
+    async def channel(self, **kwargs: Any) -> Channel:
+        self.channels.append(Channel())
+        return self.channels[-1]
+
+
+async def test_replaced_channel_is_detached():
+    connection = Connection()
+    pool = client.ChannelPool(connection, 1, wait_timeout=1)  # type: ignore[arg-type]
+    await pool.open()
+    closed = connection.channels[0]
+    closed.is_closed = True
+
+    async with pool.acquire() as pooled:
+        assert pooled.channel is connection.channels[1]
+    await asyncio.sleep(0)
+    assert not closed.close_callbacks and not closed.reopen_callbacks
+    assert connection.reconnect_callbacks == {pooled.cache.clear}
+
+    await pool.close()
+    assert not connection.reconnect_callbacks
+
+
+async def test_closed_channel_is_not_reused():
+    connection = Connection()
+    pool = client.ChannelPool(connection, 1, wait_timeout=1)  # type: ignore[arg-type]
+    await pool.open()
+    async with pool.acquire() as pooled:
+        closed, cache = pooled.channel, pooled.cache
+        assert await cache.get_exchange("exchange") == (closed, "exchange")
+
+    # the broker closed the channel, e.g. on a publish to a missing exchange
+    closed.is_closed = True
+    closed.close_callbacks()
+    assert not cache.exchanges
+
+    async with pool.acquire() as pooled:
+        assert pooled.channel is connection.channels[1] and pooled.channel is not closed
+        assert await pooled.cache.get_exchange("exchange") == (pooled.channel, "exchange")
+    await pool.close()
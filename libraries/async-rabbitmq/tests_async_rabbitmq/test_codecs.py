@@ -0,0 +1,38 @@
+import pytest
+
+from async_rabbitmq import client, codecs
+from tests_async_rabbitmq import benchmark_codecs
+
+
+@pytest.mark.parametrize("content_type", [codecs.JSON_CONTENT_TYPE, codecs.MSGPACK_CONTENT_TYPE])
+def test_round_trip(content_type: str):
+    codec = codecs.CODECS.get(content_type)
+    data = client.Client.serialize(benchmark_codecs._event(1), content_type=content_type)
+    assert codec.decode(data) == {
+        "event_id": "00000000-0000-0000-0000-000000000001",
+        "created_at": "2024-01-01T00:00:01+00:00",
+        "user_id": 1,
+        "tags": ["a", "b", "c"],
+        "attributes": {"source": "api", "score": 1 / 3, "active": False},
+    }
+    task = benchmark_codecs.Task(task_id="1", priority=2, payload={"a": [1]})
+    assert codec.decode(client.Client.serialize(task, content_type=content_type)) == task.model_dump()
+
+
+def test_msgpack_int_keys():
+    codec = codecs.CODECS.get(codecs.MSGPACK_CONTENT_TYPE)
+    value = {1: "a", "b": {2: [3]}}
+    assert codec.decode(codec.encode(value)) == value
+
+
+def test_registry_get():
+    assert codecs.CODECS.get("application/msgpack").content_type == codecs.MSGPACK_CONTENT_TYPE
+    assert codecs.CODECS.get("Application/JSON; charset=utf-8").content_type == codecs.JSON_CONTENT_TYPE
+    assert codecs.CODECS.get(None).content_type == codecs.JSON_CONTENT_TYPE
+    assert codecs.CODECS.get("text/plain").content_type == codecs.JSON_CONTENT_TYPE
+
+
+def test_benchmark():
+    results = benchmark_codecs.run(repeat=2)
+    assert len(results) == len(benchmark_codecs.PAYLOADS) * 3
+    assert all(result.size_bytes > 0 for result in results)
@@ -0,0 +1,40 @@
+import dataclasses
+from typing import Any, Dict, Optional
+
+import pytest
+
+from async_rabbitmq import client, codecs, compression
+
+
+@dataclasses.dataclass
+class Message:
+    body: bytes
+    content_encoding: Optional[str]
+    content_type: Optional[str] = codecs.JSON_CONTENT_TYPE
+    headers: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    message_id: Optional[str] = "1"
+
+
+@pytest.mark.parametrize("encoding", list(compression.COMPRESSORS))
+def test_round_trip(encoding: str):
+    data = b'{"rows": [' + b",".join(b'{"id": %d}' % i for i in range(1000)) + b"]}"
+    compressed = compression.compress(compression.COMPRESSORS[encoding](), data, "test-compression")
+    assert len(compressed) < len(data)
+    assert compression.decompress(compressed, encoding, "test-compression") == data
+
+    message = Message(compressed, encoding)
+    response = client.Response(message, service_name="test-compression")  # type: ignore[arg-type]
+    assert bytes(response.body) == data
+    assert response.data["rows"][-1] == {"id": 999}
+
+
+def test_not_compressed():
+    assert compression.decompress(b"{}", client.CONTENT_ENCODING, "test-compression") == b"{}"
+    assert compression.decompress(b"{}", None, "test-compression") == b"{}"
+
+
+def test_corrupted():
+    response = client.Response(Message(b"not gzip", "gzip"), service_name="test-compression")  # type: ignore[arg-type]
+    with pytest.raises(client.DecodeError):
+        response.data
+    assert response.decode_failed
@@ -0,0 +1,92 @@
+from typing import Any, Awaitable, Callable, Dict, List
+
+import pytest_mock
+import yarl
+
+from async_rabbitmq import client
+from tests_async_rabbitmq.conftest import CallbackCollection
+
+
+class Message:
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+        self.headers: Dict[str, Any] = {}
+        self.delivery_tag = body
+        self.nacked: List[bool] = []
+
+    async def nack(self, requeue: bool = True) -> None:
+        self.nacked.append(requeue)
+
+
+class Queue:
+    """The broker pushes the delivered messages to the consumer as soon as it starts"""
+
+    def __init__(self, name: str, *bodies: bytes) -> None:
+        self.name = name
+        self.delivered = [Message(body) for body in bodies]
+        self.cancelled: List[str] = []
+
+    async def consume(self, callback: Callable[[Message], Awaitable[None]]) -> str:
+        for message in self.delivered:
+            await callback(message)
+        return f"ctag-{self.name}"
+
+    async def cancel(self, consumer_tag: str) -> None:
+        self.cancelled.append(consumer_tag)
+
+
+class Cache:
+    def __init__(self, *queues: Queue) -> None:
+        self.queues = {queue.name: queue for queue in queues}
+
+    async def get_queue(self, name: str) -> Queue:
+        return self.queues[name]
+
+
+def create_client(*queues: Queue, **kwargs: Any) -> client.Client:
+    rabbitmq = client.Client(yarl.URL("amqp://localhost"), **kwargs)
+    rabbitmq._cache = Cache(*queues)  # type: ignore[assignment]
+    return rabbitmq
+
+
+async def test_queues_in_turn():
+    high, low = Queue("high", b"1", b"2", b"3"), Queue("low", b"4")
+    consumer = create_client(high, low).receive(manual_ack=True, queues=["high", "low"])
+
+    responses = [await anext(consumer) for _ in range(4)]
+    # a busy queue does not starve the others
+    assert [(response.queue, response.message.body) for response in responses] == [
+        ("high", b"1"),
+        ("low", b"4"),
+        ("high", b"2"),
+        ("high", b"3"),
+    ]
+    await consumer.aclose()
+
+
+async def test_consumers_cancelled_on_close():
+    high, low = Queue("high", b"1", b"2"), Queue("low", b"3")
+    consumer = create_client(high, low).receive(manual_ack=True, queues=["high", "low"])
+    assert (await anext(consumer)).message.body == b"1"
+
+    await consumer.aclose()
+    assert high.cancelled == ["ctag-high"] and low.cancelled == ["ctag-low"]
+    # the delivered messages that were not yielded go back to the queues
+    assert [message.nacked for message in high.delivered + low.delivered] == [[], [True], [True]]
+
+
+async def test_prefetch_per_consumer(mocker: pytest_mock.MockerFixture):
+    channel = mocker.AsyncMock()
+    channel.close_callbacks = CallbackCollection(channel)
+    channel.reopen_callbacks = CallbackCollection(channel)
+    connection = mocker.AsyncMock()
+    connection.channel.return_value = channel
+    connection.reconnect_callbacks = CallbackCollection(connection)
+    mocker.patch("aio_pika.connect_robust", return_value=connection)
+    rabbitmq = client.Client(yarl.URL("amqp://localhost"), prefetch_count=5)
+
+    async with rabbitmq:
+        # not global: every consumer of the channel, i.e. every queue of receive, has its own prefetch_count
+        channel.set_qos.assert_awaited_once_with(prefetch_count=5, prefetch_size=0)
+        await rabbitmq.set_qos(3)
+        channel.set_qos.assert_awaited_with(prefetch_count=3, prefetch_size=0)
@@ -0,0 +1,104 @@
+import dataclasses
+from typing import Any, Dict, List, Optional
+
+import pydantic
+import pytest
+import pytest_mock
+import yarl
+
+from async_rabbitmq import client, codecs
+
+
+@dataclasses.dataclass
+class Message:
+    body: bytes
+    content_type: Optional[str] = codecs.JSON_CONTENT_TYPE
+    content_encoding: Optional[str] = client.CONTENT_ENCODING
+    headers: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    message_id: Optional[str] = "1"
+
+
+class Item(pydantic.BaseModel):
+    name: str
+    tags: List[str]
+
+
+def create_response(body: bytes, content_type: Optional[str] = codecs.JSON_CONTENT_TYPE) -> client.Response:
+    return client.Response(Message(body, content_type), service_name="test-response")  # type: ignore[arg-type]
+
+
+@pytest.mark.parametrize("content_type", [codecs.JSON_CONTENT_TYPE, codecs.MSGPACK_CONTENT_TYPE])
+def test_parse(content_type: str):
+    value = {"name": "a", "tags": ["x"]}
+    response = create_response(codecs.CODECS.get(content_type).encode(value), content_type)
+    assert bytes(response.body) == response.message.body
+    assert response.parse(Item) == Item(name="a", tags=["x"])
+    assert response.parse(Dict[str, Any]) == value
+    assert response.data == value
+
+
+def test_decode_error():
+    errors = client.CONSUME_COUNTER.labels("test-response", "error")
+    before = errors._value.get()
+    response = create_response(b"{not json")
+    assert not response.decode_failed
+    with pytest.raises(client.DecodeError):
+        response.data
+    with pytest.raises(client.DecodeError):
+        response.parse(Item)
+    assert response.decode_failed
+    assert errors._value.get() == before + 1
+
+    with pytest.raises(client.DecodeError):
+        create_response(b'{"name": "a"}').parse(Item)
+
+
+def test_consume_counter():
+    correct = client.CONSUME_COUNTER.labels("test-response", "correct")
+    errors = client.CONSUME_COUNTER.labels("test-response", "error")
+    before = correct._value.get(), errors._value.get()
+
+    response = create_response(b'{"name": "a", "tags": []}')
+    assert bytes(response.body) == response.message.body
+    assert (correct._value.get(), errors._value.get()) == before
+    response.parse(Item)
+    response.data
+    assert (correct._value.get(), errors._value.get()) == (before[0] + 1, before[1])
+
+    with pytest.raises(client.DecodeError):
+        create_response(b"{not json").data
+    assert (correct._value.get(), errors._value.get()) == (before[0] + 1, before[1] + 1)
+
+
+def test_tuple_compatibility():
+    response = create_response(b'{"name": "a"}')
+    response.headers["x"] = 1
+    data, headers, message = response
+    assert data == response[0] == {"name": "a"}
+    assert headers == response[1] == {"x": 1}
+    assert message is response[-1] is response.message
+    assert response[:2] == (data, headers)
+    assert len(response) == 3
+
+
+class Queue:
+    def __init__(self, message: Message) -> None:
+        self.message = message
+
+    async def get(self, **kwargs: Any) -> Message:
+        return self.message
+
+
+@pytest.mark.parametrize("body, nacked", [(b'{"name": "a"}', False), (b"{not json", True)])
+async def test_fetch_nacks_undecodable(mocker: pytest_mock.MockerFixture, body: bytes, nacked: bool):
+    message = Message(body)
+    message.nack = mocker.AsyncMock()  # type: ignore[attr-defined]
+    rabbitmq = client.Client(yarl.URL("amqp://localhost"), queue="test", service_name="test-response")
+    rabbitmq._cache = mocker.Mock(get_queue=mocker.AsyncMock(return_value=Queue(message)))
+
+    response = await rabbitmq.fetch()
+    assert (response is None) is nacked
+    if nacked:
+        message.nack.assert_awaited_once_with(requeue=False)  # type: ignore[attr-defined]
+    else:
+        message.nack.assert_not_awaited()  # type: ignore[attr-defined]
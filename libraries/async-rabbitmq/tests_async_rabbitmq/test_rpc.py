@@ -0,0 +1,96 @@
+import asyncio
+import dataclasses
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aio_pika
+import pytest
+
+from async_rabbitmq import rpc
+from tests_async_rabbitmq.conftest import CallbackCollection
+
+
+@dataclasses.dataclass
+class Reply:
+    body: bytes
+    correlation_id: Optional[str]
+    content_type: Optional[str] = "application/json"
+    content_encoding: Optional[str] = "utf-8"
+    headers: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    message_id: Optional[str] = None
+
+
+class Queue:
+    def __init__(self) -> None:
+        self.callback: Optional[Callable[[Reply], Awaitable[None]]] = None
+
+    async def consume(self, callback: Callable[[Reply], Awaitable[None]], no_ack: bool = False) -> str:
+        assert no_ack
+        self.callback = callback
+        return "ctag"
+
+
+class Exchange:
+    """Echo server: replies to every request with its body, except the requests to "silent" """
+
+    def __init__(self, queue: Queue) -> None:
+        self.queue = queue
+
+    async def publish(self, message: aio_pika.Message, routing_key: str) -> None:
+        assert message.reply_to == rpc.REPLY_TO
+        if routing_key != "silent":
+            reply = Reply(message.body, message.correlation_id)
+            asyncio.get_running_loop().call_soon(asyncio.ensure_future, self.queue.callback(reply))  # type: ignore
+
+
+class Channel:
+    def __init__(self) -> None:
+        self.queue = Queue()
+        self.default_exchange = Exchange(self.queue)
+        self.close_callbacks = CallbackCollection(self)
+        self.reopen_callbacks = CallbackCollection(self)
+
+    async def declare_queue(self, name: str, passive: bool = False) -> Queue:
+        assert name == rpc.REPLY_TO and passive
+        return self.queue
+
+    async def close(self) -> None:
+        self.close_callbacks(None)
+
+
+class Connection:
+    def __init__(self) -> None:
+        self.channels: list = []
+        self.reconnect_callbacks = CallbackCollection(self)
+
+    async def channel(self, **kwargs: Any) -> Channel:
+        self.channels.append(Channel())
+        return self.channels[-1]
+
+
+@dataclasses.dataclass
+class Client:
+    connection: Connection = dataclasses.field(default_factory=Connection)
+
+
+async def test_concurrent_calls():
+    async with rpc.RpcClient(Client(), max_in_flight=50) as client:  # type: ignore[arg-type]
+        responses = await asyncio.gather(*(client.call({"index": index}, "echo") for index in range(2000)))
+        assert [response.data["index"] for response in responses] == list(range(2000))
+        assert not client._futures
+
+
+async def test_timeout():
+    async with rpc.RpcClient(Client()) as client:  # type: ignore[arg-type]
+        with pytest.raises(TimeoutError):
+            await client.call({}, "silent", timeout=0.01)
+        assert not client._futures
+
+
+async def test_channel_closed():
+    rabbitmq = Client()
+    async with rpc.RpcClient(rabbitmq) as client:  # type: ignore[arg-type]
+        call = asyncio.create_task(client.call({}, "silent"))
+        await asyncio.sleep(0.01)
+        rabbitmq.connection.channels[0].close_callbacks(ConnectionError("lost"))
+        with pytest.raises(ConnectionError):
+            await call
@@ -0,0 +1,69 @@
+import asyncio
+import contextlib
+import types
+from typing import AsyncIterator, Dict, List
+
+import aio_pika
+import yarl
+
+from async_rabbitmq import client
+
+
+class Exchange:
+    """Default exchange that confirms a message after its delay or fails it"""
+
+    def __init__(self, delays: Dict[bytes, float], errors: Dict[bytes, Exception]) -> None:
+        self.delays = delays
+        self.errors = errors
+        self.published: List[bytes] = []
+        self.confirmed: List[bytes] = []
+        self.unconfirmed = 0
+        self.max_unconfirmed = 0
+
+    async def publish(self, message: aio_pika.Message, routing_key: str) -> None:
+        self.published.append(message.body)
+        self.unconfirmed += 1
+        self.max_unconfirmed = max(self.max_unconfirmed, self.unconfirmed)
+        try:
+            await asyncio.sleep(self.delays.get(message.body, 0))
+            if message.body in self.errors:
+                raise self.errors[message.body]
+            self.confirmed.append(message.body)
+        finally:
+            self.unconfirmed -= 1
+
+
+class Pool:
+    def __init__(self, exchange: Exchange) -> None:
+        self.pooled = types.SimpleNamespace(channel=types.SimpleNamespace(default_exchange=exchange))
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[types.SimpleNamespace]:
+        yield self.pooled
+
+
+def create_client(exchange: Exchange, publish_window: int) -> client.Client:
+    rabbitmq = client.Client(yarl.URL("amqp://localhost"), "queue", publish_window=publish_window)
+    rabbitmq._pool = Pool(exchange)  # type: ignore[assignment]
+    return rabbitmq
+
+
+async def test_publish_window():
+    exchange = Exchange({str(i).encode(): 0.01 for i in range(10)}, {})
+    rabbitmq = create_client(exchange, publish_window=3)
+
+    results = await rabbitmq.send_many(range(10))
+    assert results == [None] * 10
+    assert exchange.max_unconfirmed == 3
+    assert exchange.published == [str(i).encode() for i in range(10)]
+
+
+async def test_errors_in_order():
+    errors = {b"1": ConnectionError("nack 1"), b"4": ConnectionError("nack 4")}
+    # the first messages are confirmed last
+    exchange = Exchange({str(i).encode(): 0.01 * (6 - i) for i in range(6)}, errors)
+    rabbitmq = create_client(exchange, publish_window=10)
+
+    results = await rabbitmq.send_messages(client.OutgoingMessage(str(i).encode()) for i in range(6))
+    assert results == [None, errors[b"1"], None, None, errors[b"4"], None]
+    assert exchange.confirmed == [b"5", b"3", b"2", b"0"]
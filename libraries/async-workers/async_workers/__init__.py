@@ -1,29 +1,78 @@
 import asyncio
 import logging
+from typing import Callable, Dict, Iterable, Optional
 
-from async_workers import base, cron, rabbitmq
+from async_workers import base, cron, dedup, memory, outbox, postgres, process, rabbitmq, supervisor
 
-__all__ = ("base", "cron", "rabbitmq")
+__all__ = ("base", "cron", "dedup", "memory", "outbox", "postgres", "process", "rabbitmq", "supervisor")
 
 logger = logging.getLogger(__name__)
 
 
 class WorkersLifespan:
-    def __init__(self, workers_module, **dependencies):
+    """Run workers of the workers_module.
+    Workers from skip_workers are not started, workers from processes are started in separate OS processes
+    (worker_name -> number of replicas), their dependencies are created by dependencies_factory in every process
+    inside process_lifespan (e.g. an event loop watchdog, the parent process enters its own one).
+    On exit workers stop reading and have drain_timeout seconds to finish the tasks in progress
+    """
+
+    def __init__(
+        self,
+        workers_module,
+        *,
+        skip_workers: Iterable[str] = (),
+        processes: Optional[Dict[str, int]] = None,
+        dependencies_factory: Optional[supervisor.DependenciesFactory] = None,
+        initializer: Optional[Callable[[], None]] = None,
+        process_lifespan: Optional[supervisor.ProcessLifespan] = None,
+        drain_timeout: float = 30,
+        **dependencies,
+    ):
         self.workers_module = workers_module
+        self.skip_workers = set(skip_workers)
+        self.processes = processes or {}
+        self.dependencies_factory = dependencies_factory
+        self.initializer = initializer
+        self.process_lifespan = process_lifespan
+        self.drain_timeout = drain_timeout
         self.dependencies = dependencies
+        self.stop_event = asyncio.Event()
         self.started_workers: list[asyncio.Task] = []
+        self.supervisor: Optional[supervisor.Supervisor] = None
 
     async def __aenter__(self):
         workers_cls = (getattr(self.workers_module, worker_name).Worker for worker_name in self.workers_module.__all__)
+        workers_processes = {}
         for worker_cls in workers_cls:
             worker_name = worker_cls.get_worker_name()
+            if worker_name in self.skip_workers:
+                logger.info(f"Skip worker {worker_name}")
+                continue
+            if self.processes.get(worker_name):
+                workers_processes[worker_cls] = self.processes[worker_name]
+                continue
             logger.info(f"Run worker {worker_name}")
             task = asyncio.create_task(
-                worker_cls.run_with_restarts(**self.dependencies), name=f"WORKER::{worker_name}"
+                worker_cls.run_with_restarts(stop_event=self.stop_event, **self.dependencies),
+                name=f"WORKER::{worker_name}",
             )
             self.started_workers.append(task)
+        if workers_processes:
+            if self.dependencies_factory is None:
+                raise ValueError("dependencies_factory is required to run workers in separate processes")
+            self.supervisor = supervisor.Supervisor(
+                workers_processes,
+                self.dependencies_factory,
+                self.initializer,
+                drain_timeout=self.drain_timeout,
+                process_lifespan=self.process_lifespan,
+            )
+            await self.supervisor.__aenter__()
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        for task in self.started_workers:
-            task.cancel()
+        stopping = [base.stop_workers(self.started_workers, self.stop_event, self.drain_timeout)]
+        if self.supervisor is not None:
+            stopping.append(self.supervisor.__aexit__(exc_type, exc_val, exc_tb))
+        await asyncio.gather(*stopping)
+        self.supervisor = None
@@ -1,11 +1,28 @@
 import abc
 import asyncio
 import concurrent.futures
+import contextlib
+import contextvars
 import dataclasses
 import logging
+import random
 import time
 import traceback
-from typing import Any, AsyncIterator, Callable, Generic, Optional, Type, TypeVar
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Collection,
+    FrozenSet,
+    Generic,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Type,
+    TypeVar,
+)
 
 import pydantic
 from opentelemetry import propagate, trace
@@ -14,6 +31,8 @@
 import async_utils
 import pydantic_base_settings
 
+from async_workers import dedup, process
+
 tracer = trace.get_tracer(__name__)
 logger = logging.getLogger(__name__)
 
@@ -21,6 +40,9 @@
 class TaskReaderSettings(pydantic_base_settings.BaseSettings):
     run_once: bool = pydantic.Field(False, validation_alias="TASK_READER_RUN_ONCE")
     sleep_seconds: float = pydantic.Field(0.1, validation_alias="TASK_READER_SLEEP_SECONDS")
+    sleep_max_seconds: Optional[float] = pydantic.Field(None, validation_alias="TASK_READER_SLEEP_MAX_SECONDS")
+    sleep_multiplier: float = pydantic.Field(2, validation_alias="TASK_READER_SLEEP_MULTIPLIER", ge=1)
+    sleep_jitter: float = pydantic.Field(0.1, validation_alias="TASK_READER_SLEEP_JITTER", ge=0, le=1)
 
 
 @dataclasses.dataclass
@@ -33,12 +55,71 @@ class BaseTask:
 TaskReaderObj = TypeVar("TaskReaderObj", bound="TaskReader")
 TaskObj = TypeVar("TaskObj", bound="BaseTask")
 
+TASK_READERS_EMPTY_FETCH_COUNTER = Counter("task_readers_empty_fetch", "Number of empty fetches", ["worker_name"])
+TASK_READERS_IDLE_COUNTER = Counter(
+    "task_readers_idle_seconds", "Time spent idle after empty fetches", ["worker_name"]
+)
+
+
+class IdleStrategy(metaclass=abc.ABCMeta):
+    """Delay between fetches while there are no tasks"""
+
+    @abc.abstractmethod
+    def next_delay(self) -> float:
+        """Delay after an empty fetch"""
+        pass
+
+    def reset(self) -> None:
+        """A task has been received"""
+        pass
+
+
+class FixedIdleStrategy(IdleStrategy):
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def next_delay(self) -> float:
+        return self.delay
+
+
+class BackoffIdleStrategy(IdleStrategy):
+    """Exponential backoff with jitter, capped by max_delay"""
+
+    def __init__(self, delay: float, max_delay: float, multiplier: float = 2, jitter: float = 0.1):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self._current_delay = delay
+
+    def next_delay(self) -> float:
+        delay = self._current_delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+        self._current_delay = min(self._current_delay * self.multiplier, self.max_delay)
+        return min(delay, self.max_delay)
+
+    def reset(self) -> None:
+        self._current_delay = self.delay
+
+
+def create_idle_strategy(settings: TaskReaderSettings) -> IdleStrategy:
+    if settings.sleep_max_seconds is None or settings.sleep_max_seconds <= settings.sleep_seconds:
+        return FixedIdleStrategy(settings.sleep_seconds)
+    return BackoffIdleStrategy(
+        settings.sleep_seconds, settings.sleep_max_seconds, settings.sleep_multiplier, settings.sleep_jitter
+    )
+
 
 class TaskReader(Generic[TaskReaderSettingsObj, TaskObj], metaclass=abc.ABCMeta):
     """Interface for receiving tasks"""
 
-    def __init__(self, settings: TaskReaderSettingsObj, **kwargs):
+    def __init__(self, settings: TaskReaderSettingsObj, idle_strategy: Optional[IdleStrategy] = None, **kwargs):
         self.settings = settings
+        self.idle_strategy = idle_strategy or create_idle_strategy(settings)
+        # replaced by the TaskHandler that owns the reader
+        self.worker_name = type(self).__name__
+        # tasks the handler may have in progress at once, readers with push delivery do not buffer more
+        self.max_in_flight: Optional[int] = None
+        self._wake_up_event = asyncio.Event()
 
     @abc.abstractmethod
     async def __aenter__(self) -> "TaskReader":
@@ -63,15 +144,75 @@ async def error(self, task: TaskObj, error_message: str, error_details: Optional
         """End task with error"""
         pass
 
-    async def receive(self) -> AsyncIterator[TaskObj]:
+    def get_enqueued_at(self, task: TaskObj) -> Optional[float]:
+        """Unix time when the task was added to the source, None if unknown"""
+        return None
+
+    async def fetch_many(self, max_items: int, max_wait: float) -> List[TaskObj]:
+        """Get up to max_items tasks, waiting for them no longer than max_wait seconds"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait
+        tasks: List[TaskObj] = []
+        while len(tasks) < max_items:
+            task = await self.fetch()
+            if task:
+                tasks.append(task)
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            await asyncio.sleep(min(self.settings.sleep_seconds, timeout))
+        return tasks
+
+    def wake_up(self) -> None:
+        """Interrupt the idle sleep, e.g. when the source has notified about a new task"""
+        self._wake_up_event.set()
+
+    async def wait_wake_up(self, timeout: float) -> bool:
+        """Wait for wake_up no longer than timeout seconds, True if the reader has been woken up"""
+        try:
+            async with asyncio.timeout(timeout):
+                await self._wake_up_event.wait()
+        except TimeoutError:
+            return False
+        self._wake_up_event.clear()
+        return True
+
+    async def idle(self) -> None:
+        """Sleep after an empty fetch for the idle strategy delay or until wake_up is called"""
+        delay = self.idle_strategy.next_delay()
+        TASK_READERS_EMPTY_FETCH_COUNTER.labels(self.worker_name).inc()
+        start = time.monotonic()
+        try:
+            if await self.wait_wake_up(delay):
+                logger.debug(f"Task reader {self.worker_name} woken up")
+                self.idle_strategy.reset()
+        finally:
+            TASK_READERS_IDLE_COUNTER.labels(self.worker_name).inc(time.monotonic() - start)
+
+    async def receive(self) -> AsyncGenerator[TaskObj, None]:
         while True:
             logger.debug("Start fetch task ...")
             result = await self.fetch()
             logger.debug(f"Fetch task: {result}")
             if result:
+                self.idle_strategy.reset()
+                yield result
+            else:
+                await self.idle()
+            if self.settings.run_once:
+                break
+
+    async def receive_many(self, max_items: int, max_wait: float) -> AsyncGenerator[List[TaskObj], None]:
+        while True:
+            logger.debug("Start fetch batch ...")
+            result = await self.fetch_many(max_items, max_wait)
+            logger.debug(f"Fetch batch: {len(result)} tasks")
+            if result:
+                self.idle_strategy.reset()
                 yield result
             else:
-                await asyncio.sleep(self.settings.sleep_seconds)
+                await self.idle()
             if self.settings.run_once:
                 break
 
@@ -79,16 +220,66 @@ async def receive(self) -> AsyncIterator[TaskObj]:
 class BaseHandlerSettings(pydantic_base_settings.BaseSettings):
     task_max_time_seconds: float = pydantic.Field(15 * 60, validation_alias="WORKER_TASK_MAX_TIME_SECONDS")
     max_restarts: Optional[int] = pydantic.Field(None, validation_alias="WORKER_MAX_RESTARTS")
-    restart_time_seconds: float = pydantic.Field(30, validation_alias="WORKER_RESTART_TIME_SECONDS")
+    restart_time_seconds: float = pydantic.Field(
+        30, validation_alias="WORKER_RESTART_TIME_SECONDS", description="Cap of the delay before the first restart"
+    )
+    restart_max_time_seconds: float = pydantic.Field(5 * 60, validation_alias="WORKER_RESTART_MAX_TIME_SECONDS")
+    restart_multiplier: float = pydantic.Field(2, validation_alias="WORKER_RESTART_MULTIPLIER", ge=1)
+    restart_reset_seconds: float = pydantic.Field(
+        60,
+        validation_alias="WORKER_RESTART_RESET_SECONDS",
+        ge=0,
+        description="Run time after which the worker is healthy and the restart delay starts over",
+    )
+    crash_loop_restarts: int = pydantic.Field(
+        5,
+        validation_alias="WORKER_CRASH_LOOP_RESTARTS",
+        ge=1,
+        description="Restarts in a row without a healthy run after which the worker is in crash loop",
+    )
+    max_concurrency: int = pydantic.Field(1, validation_alias="WORKER_MAX_CONCURRENCY", ge=1)
+    batch_size: int = pydantic.Field(1, validation_alias="WORKER_BATCH_SIZE", ge=1)
+    batch_max_wait_seconds: float = pydantic.Field(0.1, validation_alias="WORKER_BATCH_MAX_WAIT_SECONDS", ge=0)
+    process_pool_size: int = pydantic.Field(0, validation_alias="WORKER_PROCESS_POOL_SIZE", ge=0)
+    process_pool_max_tasks_per_child: Optional[int] = pydantic.Field(
+        None, validation_alias="WORKER_PROCESS_POOL_MAX_TASKS_PER_CHILD", ge=1
+    )
+    dedup_cache_size: int = pydantic.Field(
+        0, validation_alias="WORKER_DEDUP_CACHE_SIZE", ge=0, description="Completed task ids kept in memory, 0 - off"
+    )
+    dedup_ttl_seconds: float = pydantic.Field(60 * 60, validation_alias="WORKER_DEDUP_TTL_SECONDS", gt=0)
+    adaptive_concurrency: bool = pydantic.Field(
+        False,
+        validation_alias="WORKER_ADAPTIVE_CONCURRENCY",
+        description="Adjust the limit of tasks in progress between min_concurrency and max_concurrency",
+    )
+    min_concurrency: int = pydantic.Field(1, validation_alias="WORKER_MIN_CONCURRENCY", ge=1)
+    adaptive_latency_tolerance: float = pydantic.Field(
+        2, validation_alias="WORKER_ADAPTIVE_LATENCY_TOLERANCE", ge=1, description="Overload if latency > x * baseline"
+    )
+    adaptive_backoff_ratio: float = pydantic.Field(0.9, validation_alias="WORKER_ADAPTIVE_BACKOFF_RATIO", gt=0, lt=1)
+
+    def get_restart_delay(self, failures: int) -> float:
+        """Exponential backoff with full jitter, so replicas that failed together do not restart in lockstep"""
+        cap = self.restart_time_seconds * self.restart_multiplier ** min(max(failures - 1, 0), 32)
+        return random.uniform(0, min(cap, max(self.restart_max_time_seconds, self.restart_time_seconds)))
 
     def __hash__(self):
         return hash((type(self),) + tuple(self.__dict__.values()))
 
 
+_STOPPED = object()
+
 BaseHandlerSettingsObj = TypeVar("BaseHandlerSettingsObj", bound="BaseHandlerSettings")
 TaskHandlerObj = TypeVar("TaskHandlerObj", bound="TaskHandler")
 
 TASK_HANDLERS_RESTART_COUNTER = Counter("task_handlers_restart", "Number of restarts", ["worker_name"])
+TASK_HANDLERS_CRASH_LOOP_GAUGE = Gauge(
+    "task_handlers_crash_loop",
+    "1 if the worker fails right after every restart",
+    ["worker_name"],
+    multiprocess_mode="livemax",
+)
 TASK_HANDLERS_TASK_COUNTER = Counter("task_handlers_task", "Number of tasks", ["worker_name", "status"])
 TASK_HANDLERS_TASK_GAUGE = Gauge("task_handlers_task_duration_total_seconds", "", ["worker_name"])
 TASK_HANDLERS_TASK_HISTOGRAM = Histogram(
@@ -97,19 +288,198 @@ def __hash__(self):
     ["worker_name"],
     buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 7.5, 10.0, 30.0, 60.0, 300.0, float("inf")),
 )
+TASK_HANDLERS_BATCH_HISTOGRAM = Histogram(
+    "task_handlers_batch_duration_seconds",
+    "",
+    ["worker_name"],
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 7.5, 10.0, 30.0, 60.0, 300.0, float("inf")),
+)
+TASK_HANDLERS_DRAIN_COUNTER = Counter(
+    "task_handlers_drain", "Number of tasks in progress on worker stop", ["worker_name", "status"]
+)
+TASK_HANDLERS_BATCH_SIZE_HISTOGRAM = Histogram(
+    "task_handlers_batch_size",
+    "Number of tasks in a batch",
+    ["worker_name"],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, float("inf")),
+)
+TASK_HANDLERS_CONCURRENCY_LIMIT_GAUGE = Gauge(
+    "task_handlers_concurrency_limit", "Current limit of tasks in progress", ["worker_name"]
+)
+TASK_HANDLERS_STAGE_HISTOGRAM = Histogram(
+    "task_handlers_stage_duration_seconds",
+    "Duration of the task lifecycle stages: queue_wait, fetch, handle, complete, error",
+    ["worker_name", "stage"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, float("inf")),
+)
+
+# workers of the process in crash loop, see crash_looping_workers
+_CRASH_LOOPING_WORKERS: Set[str] = set()
+
+
+def crash_looping_workers() -> FrozenSet[str]:
+    """Workers of the current process in crash loop, e.g. for a health check.
+    Workers in supervisor processes are reported by the task_handlers_crash_loop metric
+    """
+    return frozenset(_CRASH_LOOPING_WORKERS)
+
+
+def _set_crash_loop(worker_name: str, crash_loop: bool) -> None:
+    if crash_loop and worker_name not in _CRASH_LOOPING_WORKERS:
+        logger.error(f"Worker {worker_name} is in crash loop")
+    elif not crash_loop and worker_name in _CRASH_LOOPING_WORKERS:
+        logger.info(f"Worker {worker_name} is out of crash loop")
+    if crash_loop:
+        _CRASH_LOOPING_WORKERS.add(worker_name)
+    else:
+        _CRASH_LOOPING_WORKERS.discard(worker_name)
+    TASK_HANDLERS_CRASH_LOOP_GAUGE.labels(worker_name).set(int(crash_loop))
+
+
+# duration of the fetch that returned the task (or batch) handled in the current asyncio task
+_FETCH_SECONDS: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("_FETCH_SECONDS", default=None)
+
+
+class HandlerMetrics:
+    """Label children bound once per worker, so metrics cost no labels() lookup per task"""
+
+    def __init__(self, worker_name: str):
+        self.task_process = TASK_HANDLERS_TASK_COUNTER.labels(worker_name, "process")
+        self.task_complete = TASK_HANDLERS_TASK_COUNTER.labels(worker_name, "complete")
+        self.task_error = TASK_HANDLERS_TASK_COUNTER.labels(worker_name, "error")
+        self.task_duplicate = TASK_HANDLERS_TASK_COUNTER.labels(worker_name, "duplicate")
+        self.task_duration_total = TASK_HANDLERS_TASK_GAUGE.labels(worker_name)
+        self.task_duration = TASK_HANDLERS_TASK_HISTOGRAM.labels(worker_name)
+        self.batch_duration = TASK_HANDLERS_BATCH_HISTOGRAM.labels(worker_name)
+        self.batch_size = TASK_HANDLERS_BATCH_SIZE_HISTOGRAM.labels(worker_name)
+        self.queue_wait = TASK_HANDLERS_STAGE_HISTOGRAM.labels(worker_name, "queue_wait")
+        self.fetch = TASK_HANDLERS_STAGE_HISTOGRAM.labels(worker_name, "fetch")
+        self.handle = TASK_HANDLERS_STAGE_HISTOGRAM.labels(worker_name, "handle")
+        self.complete = TASK_HANDLERS_STAGE_HISTOGRAM.labels(worker_name, "complete")
+        self.error = TASK_HANDLERS_STAGE_HISTOGRAM.labels(worker_name, "error")
+
+
+class AdaptiveLimiter:
+    """Limit of tasks in progress adjusted by AIMD from the observed latency and errors.
+    The limit grows by one per limit successful tasks while it is utilized and is multiplied by backoff_ratio
+    on an error or when the smoothed latency exceeds latency_tolerance * baseline (the lowest latency seen).
+    After a decrease the next one is possible only after limit more samples, so one slow burst of concurrent
+    tasks is counted once
+    """
+
+    def __init__(
+        self,
+        worker_name: str,
+        min_limit: int,
+        max_limit: int,
+        latency_tolerance: float = 2,
+        backoff_ratio: float = 0.9,
+        smoothing: float = 0.1,
+        baseline_drift: float = 0.001,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.smoothing = smoothing
+        self.baseline_drift = baseline_drift
+        self.limit = float(min_limit)
+        self.in_flight = 0
+        self.baseline_latency: Optional[float] = None
+        self.smoothed_latency: Optional[float] = None
+        self._samples_to_decrease = 0
+        self._waiters: List[asyncio.Future] = []
+        self._gauge = TASK_HANDLERS_CONCURRENCY_LIMIT_GAUGE.labels(worker_name)
+        self._gauge.set(self.limit)
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.in_flight >= int(self.limit):
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake_up()
+
+    def _wake_up(self) -> None:
+        free = int(self.limit) - self.in_flight
+        for waiter in self._waiters[: max(free, 0)]:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def observe(self, latency: float, error: bool = False) -> None:
+        """Adjust the limit by the latency and the outcome of a finished task (or batch)"""
+        if self.baseline_latency is None or self.smoothed_latency is None:
+            self.baseline_latency = self.smoothed_latency = latency
+        else:
+            # the baseline slowly follows the latency up, so it recovers after a permanent change of the downstream
+            self.baseline_latency = min(latency, self.baseline_latency * (1 + self.baseline_drift))
+            self.smoothed_latency += self.smoothing * (latency - self.smoothed_latency)
+        self._samples_to_decrease -= 1
+        overloaded = error or self.smoothed_latency > self.latency_tolerance * self.baseline_latency
+        if overloaded:
+            if self._samples_to_decrease > 0:
+                return
+            self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+            self._samples_to_decrease = int(self.limit)
+        # in_flight still counts the finished task, it is released after observe
+        elif self.in_flight >= int(self.limit) / 2:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._gauge.set(self.limit)
+        self._wake_up()
 
 
 class TaskHandler(Generic[BaseHandlerSettingsObj, TaskReaderObj, TaskObj], metaclass=abc.ABCMeta):
-    def __init__(self, settings: BaseHandlerSettingsObj, task_reader: TaskReaderObj, **kwargs):
+    def __init__(
+        self,
+        settings: BaseHandlerSettingsObj,
+        task_reader: TaskReaderObj,
+        dedup_store: Optional[dedup.DedupStore] = None,
+        **kwargs,
+    ):
         self.settings = settings
         self.task_reader = task_reader
         self.worker_name = self.get_worker_name()
+        self.task_reader.worker_name = self.worker_name
+        self.metrics = HandlerMetrics(self.worker_name)
+        # once set, the handler stops reading and finishes the tasks in progress
+        self.stop_event = asyncio.Event()
+        self.process_pool: Optional[process.ProcessPool] = None
+        if settings.process_pool_size:
+            self.process_pool = process.ProcessPool(
+                self.worker_name, settings.process_pool_size, settings.process_pool_max_tasks_per_child
+            )
+        # completed tasks are not processed again when they are redelivered, the stored result is replayed
+        self.deduplicator: Optional[dedup.Deduplicator] = None
+        if settings.dedup_cache_size or dedup_store is not None:
+            cache = None
+            if settings.dedup_cache_size:
+                cache = dedup.MemoryDedupStore(settings.dedup_cache_size, settings.dedup_ttl_seconds)
+            self.deduplicator = dedup.Deduplicator(self.worker_name, cache, dedup_store)
+        self.limiter: Optional[AdaptiveLimiter] = None
+        if settings.adaptive_concurrency:
+            self.limiter = AdaptiveLimiter(
+                self.worker_name,
+                settings.min_concurrency,
+                settings.max_concurrency,
+                settings.adaptive_latency_tolerance,
+                settings.adaptive_backoff_ratio,
+            )
 
     async def __aenter__(self) -> "TaskHandler[BaseHandlerSettingsObj, TaskReaderObj, TaskObj]":
+        if self.process_pool:
+            await self.process_pool.__aenter__()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        pass
+        if self.process_pool:
+            await self.process_pool.__aexit__(exc_type, exc_val, exc_tb)
 
     @classmethod
     @abc.abstractmethod
@@ -127,7 +497,13 @@ def get_worker_name(cls) -> str:
         raise NotImplementedError
 
     @classmethod
-    async def run_with_restarts(cls: Type[TaskHandlerObj], **kwargs):
+    async def run_with_restarts(cls: Type[TaskHandlerObj], stop_event: Optional[asyncio.Event] = None, **kwargs):
+        """Run the worker and restart it on errors until stop_event is set.
+        The restart delay grows exponentially with failures in a row and starts over after a run of
+        restart_reset_seconds. After crash_loop_restarts failures in a row the worker is in crash loop
+        (crash_looping_workers, task_handlers_crash_loop metric) until a run lasts restart_reset_seconds
+        """
+        stop_event = stop_event or asyncio.Event()
         worker_name = cls.get_worker_name()
         with async_utils.LogExtraManager(worker_name=worker_name):
             restart_count = 0
@@ -137,21 +513,40 @@ async def run_with_restarts(cls: Type[TaskHandlerObj], **kwargs):
                 logger.critical(f"Error load TaskHandler settings: {exc}")
                 raise
             logger.debug(f"Settings loaded: {settings=}")
-            while True:
+            loop = asyncio.get_running_loop()
+            failures = 0
+            _set_crash_loop(worker_name, False)
+            while not stop_event.is_set():
+                started = loop.time()
+                healthy = loop.call_later(settings.restart_reset_seconds, _set_crash_loop, worker_name, False)
                 try:
                     task_handler = await cls.initialization(settings, **kwargs)
+                    task_handler.stop_event = stop_event
                     async with task_handler:
                         await task_handler.run()
                 except Exception as exc:
+                    healthy.cancel()
+                    if loop.time() - started >= settings.restart_reset_seconds:
+                        failures = 0
+                    failures += 1
+                    restart_count += 1
+                    delay = settings.get_restart_delay(failures)
                     logger.exception(
-                        f"Error execute worker {worker_name}, restart after {settings.restart_time_seconds} seconds",
+                        f"Error execute worker {worker_name} ({failures} in a row), "
+                        f"restart after {round(delay, 3)} seconds",
                         exc_info=exc,
                     )
                     TASK_HANDLERS_RESTART_COUNTER.labels(worker_name).inc()
-                    restart_count += 1
+                    if failures >= settings.crash_loop_restarts:
+                        _set_crash_loop(worker_name, True)
                     if settings.max_restarts and restart_count >= settings.max_restarts:
                         raise
-                    await asyncio.sleep(settings.restart_time_seconds)
+                    with contextlib.suppress(TimeoutError):
+                        async with asyncio.timeout(delay):
+                            await stop_event.wait()
+                finally:
+                    healthy.cancel()
+            _set_crash_loop(worker_name, False)
 
     @classmethod
     async def run_in_executor(
@@ -163,46 +558,292 @@ async def run_in_executor(
     ) -> async_utils.ReturnType:
         return await async_utils.run_in_executor_with_log_extra(executor, function, *args, **kwargs)
 
+    async def run_in_process(
+        self, function: Callable[..., async_utils.ReturnType], *args, **kwargs
+    ) -> async_utils.ReturnType:
+        """Run a CPU-bound function in the worker process pool (WORKER_PROCESS_POOL_SIZE)"""
+        if not self.process_pool:
+            raise RuntimeError(f"Process pool is not configured for worker {self.worker_name}")
+        return await self.process_pool.run(function, *args, **kwargs)
+
+    def get_max_concurrency(self) -> int:
+        return self.settings.max_concurrency
+
     async def run(self):
         """Start reading and processing cycle"""
+        self.task_reader.max_in_flight = self.get_max_concurrency() * self.settings.batch_size
         async with self.task_reader:
-            async for task in self.task_reader.receive():
-                await self.process_task(task)
+            if self.settings.batch_size > 1:
+                items = self.task_reader.receive_many(self.settings.batch_size, self.settings.batch_max_wait_seconds)
+                await self._run(items, self.process_batch)
+            else:
+                await self._run(self.task_reader.receive(), self.process_task)
+
+    async def _run(self, items: AsyncGenerator[Any, None], handle: Callable[[Any], Awaitable[Any]]):
+        stopping = asyncio.ensure_future(self.stop_event.wait())
+        try:
+            async with contextlib.aclosing(items):
+                max_concurrency = self.get_max_concurrency()
+                if max_concurrency > 1 or self.limiter is not None:
+                    await self._run_concurrently(items, handle, stopping, max_concurrency)
+                    return
+                while (item := await self._next_item(items, stopping)) is not _STOPPED:
+                    await self._handle_item(handle, item)
+        finally:
+            stopping.cancel()
+
+    async def _run_concurrently(
+        self,
+        items: AsyncGenerator[Any, None],
+        handle: Callable[[Any], Awaitable[Any]],
+        stopping: asyncio.Future,
+        max_concurrency: int,
+    ):
+        """Process up to max_concurrency items at once (or up to the adaptive limit),
+        the next item is read only when there is a free slot
+        """
+        semaphore: asyncio.Semaphore | AdaptiveLimiter
+        if self.limiter is not None:
+            semaphore = self.limiter
+        else:
+            semaphore = asyncio.Semaphore(max_concurrency)
+            TASK_HANDLERS_CONCURRENCY_LIMIT_GAUGE.labels(self.worker_name).set(max_concurrency)
+        async with asyncio.TaskGroup() as group:
+            while True:
+                await semaphore.acquire()
+                item = await self._next_item(items, stopping)
+                if item is _STOPPED:
+                    semaphore.release()
+                    break
+                group.create_task(self._handle_item(handle, item, semaphore), name=f"TASK::{self.worker_name}")
+
+    async def _next_item(self, items: AsyncGenerator[Any, None], stopping: asyncio.Future) -> Any:
+        """Next task (or batch) from the reader, _STOPPED when the reader is exhausted or the handler is stopping"""
+        if stopping.done():
+            return _STOPPED
+        fetch_start = time.perf_counter()
+        next_item = asyncio.ensure_future(anext(items))
+        try:
+            await asyncio.wait((next_item, stopping), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not next_item.done():
+                next_item.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await next_item
+        if next_item.cancelled():
+            logger.info(f"Stop reading tasks {self.worker_name}")
+            return _STOPPED
+        try:
+            item = next_item.result()
+        except StopAsyncIteration:
+            return _STOPPED
+        # the handling task is created in (or copies) the current context
+        _FETCH_SECONDS.set(time.perf_counter() - fetch_start)
+        return item
+
+    async def _handle_item(
+        self,
+        handle: Callable[[Any], Awaitable[Any]],
+        item: Any,
+        semaphore: Optional[asyncio.Semaphore | AdaptiveLimiter] = None,
+    ):
+        tasks_count = len(item) if isinstance(item, list) else 1
+        try:
+            await handle(item)
+            if self.stop_event.is_set():
+                TASK_HANDLERS_DRAIN_COUNTER.labels(self.worker_name, "drained").inc(tasks_count)
+        except asyncio.CancelledError:
+            if self.stop_event.is_set():
+                TASK_HANDLERS_DRAIN_COUNTER.labels(self.worker_name, "cancelled").inc(tasks_count)
+            raise
+        finally:
+            if semaphore is not None:
+                semaphore.release()
 
     async def process_task(self, task: TaskObj) -> Any:
         timeout = self.settings.task_max_time_seconds
+        metrics = self.metrics
         with tracer.start_as_current_span(
             self.worker_name, context=propagate.extract({"traceparent": task.traceparent})
-        ):
+        ) as span:
+            self._observe_arrival(span, [task])
+            if self.deduplicator is not None and not await self._skip_duplicates([task]):
+                return None
             logger.info(f"Start process_task worker_name={self.worker_name} {task.task_id=}")
             start = time.time()
+            failed = True
             try:
-                TASK_HANDLERS_TASK_COUNTER.labels(self.worker_name, "process").inc()
-                if timeout:
-                    result = await asyncio.wait_for(self._process_task(task), timeout=timeout)
-                else:
-                    result = await self._process_task(task)
-                TASK_HANDLERS_TASK_COUNTER.labels(self.worker_name, "complete").inc()
-                await self.task_reader.complete(task, result=result)
+                metrics.task_process.inc()
+                handle_start = time.perf_counter()
+                try:
+                    if timeout:
+                        result = await asyncio.wait_for(self._process_task(task), timeout=timeout)
+                    else:
+                        result = await self._process_task(task)
+                finally:
+                    self._observe_stage(span, metrics.handle, "handle", time.perf_counter() - handle_start)
+                failed = False
+                metrics.task_complete.inc()
+                if self.deduplicator is not None:
+                    await self.deduplicator.set(task.task_id, result)
+                await self._complete(span, task, result)
             except asyncio.TimeoutError as exc:
                 error_message = f"Error process_task '{self.worker_name}': Task timeout exceeded ({timeout} sec)"
                 logger.error(error_message)
-                TASK_HANDLERS_TASK_COUNTER.labels(self.worker_name, "error").inc()
-                await self.task_reader.error(
-                    task, error_message, "".join(traceback.format_tb(exc.__traceback__)) + str(exc)
+                metrics.task_error.inc()
+                await self._error(
+                    span, task, error_message, "".join(traceback.format_tb(exc.__traceback__)) + str(exc)
                 )
             except Exception as exc:
                 error_message = f"Error process_task '{self.worker_name}': {str(exc)}"
                 logger.error(error_message, exc_info=exc)
-                TASK_HANDLERS_TASK_COUNTER.labels(self.worker_name, "error").inc()
-                await self.task_reader.error(
-                    task, error_message, "".join(traceback.format_tb(exc.__traceback__)) + str(exc)
+                metrics.task_error.inc()
+                await self._error(
+                    span, task, error_message, "".join(traceback.format_tb(exc.__traceback__)) + str(exc)
                 )
             finally:
                 work_time = time.time() - start
-                TASK_HANDLERS_TASK_GAUGE.labels(self.worker_name).inc(work_time)
-                TASK_HANDLERS_TASK_HISTOGRAM.labels(self.worker_name).observe(work_time)
+                metrics.task_duration_total.inc(work_time)
+                metrics.task_duration.observe(work_time)
+                if self.limiter is not None:
+                    self.limiter.observe(work_time, failed)
                 logger.info(f"Processed task {self.worker_name=} {task.task_id=} work_time={round(work_time, 3)}")
 
+    async def process_batch(self, tasks: List[TaskObj]) -> None:
+        timeout = self.settings.task_max_time_seconds
+        metrics = self.metrics
+        contexts = (propagate.extract({"traceparent": task.traceparent}) for task in tasks)
+        span_contexts = (trace.get_current_span(context).get_span_context() for context in contexts)
+        links = [trace.Link(span_context) for span_context in span_contexts if span_context.is_valid]
+        with tracer.start_as_current_span(
+            self.worker_name, links=links, attributes={"batch_size": len(tasks)}
+        ) as span:
+            self._observe_arrival(span, tasks)
+            if self.deduplicator is not None and not (tasks := await self._skip_duplicates(tasks)):
+                return
+            logger.info(f"Start process_batch worker_name={self.worker_name} batch_size={len(tasks)}")
+            start = time.time()
+            metrics.task_process.inc(len(tasks))
+            metrics.batch_size.observe(len(tasks))
+            results: Sequence[Any]
+            handle_start = time.perf_counter()
+            try:
+                if timeout:
+                    results = await asyncio.wait_for(self._process_batch(tasks), timeout=timeout)
+                else:
+                    results = await self._process_batch(tasks)
+                if len(results) != len(tasks):
+                    raise RuntimeError(f"Batch result size mismatch: {len(results)} results for {len(tasks)} tasks")
+            except asyncio.TimeoutError as exc:
+                logger.error(f"Error process_batch '{self.worker_name}': Batch timeout exceeded ({timeout} sec)")
+                results = [exc] * len(tasks)
+            except Exception as exc:
+                logger.error(f"Error process_batch '{self.worker_name}': {str(exc)}", exc_info=exc)
+                results = [exc] * len(tasks)
+            finally:
+                self._observe_stage(span, metrics.handle, "handle", time.perf_counter() - handle_start)
+            try:
+                for task, result in zip(tasks, results):
+                    try:
+                        await self._finish_batch_task(span, task, result)
+                    except Exception as exc:
+                        # the other tasks of the batch are still acked, this one is redelivered by the source
+                        logger.error(f"Error finish task '{self.worker_name}' {task.task_id=}: {exc}", exc_info=exc)
+            finally:
+                work_time = time.time() - start
+                metrics.task_duration_total.inc(work_time)
+                metrics.batch_duration.observe(work_time)
+                if self.limiter is not None:
+                    self.limiter.observe(work_time, any(isinstance(result, BaseException) for result in results))
+                logger.info(
+                    f"Processed batch {self.worker_name=} batch_size={len(tasks)} work_time={round(work_time, 3)}"
+                )
+
+    async def _finish_batch_task(self, span: trace.Span, task: TaskObj, result: Any) -> None:
+        """Complete the task of the batch or end it with the error of its result"""
+        if isinstance(result, BaseException):
+            error_message = f"Error process_task '{self.worker_name}': {str(result) or repr(result)}"
+            logger.error(f"{error_message} {task.task_id=}")
+            self.metrics.task_error.inc()
+            await self._error(
+                span, task, error_message, "".join(traceback.format_tb(result.__traceback__)) + str(result)
+            )
+            return
+        self.metrics.task_complete.inc()
+        if self.deduplicator is not None:
+            await self.deduplicator.set(task.task_id, result)
+        await self._complete(span, task, result)
+
+    @staticmethod
+    def _observe_stage(span: trace.Span, histogram: Histogram, stage: str, duration: float) -> None:
+        histogram.observe(duration)
+        if span.is_recording():
+            span.add_event(stage, {"duration_seconds": duration})
+
+    def _observe_arrival(self, span: trace.Span, tasks: List[TaskObj]) -> None:
+        """Time spent by the reader in fetch and by the tasks in the source queue"""
+        fetch_seconds = _FETCH_SECONDS.get()
+        if fetch_seconds is not None:
+            self._observe_stage(span, self.metrics.fetch, "fetch", fetch_seconds)
+        now = time.time()
+        max_wait: Optional[float] = None
+        for task in tasks:
+            enqueued_at = self.task_reader.get_enqueued_at(task)
+            if enqueued_at is not None:
+                wait = max(now - enqueued_at, 0)
+                self.metrics.queue_wait.observe(wait)
+                max_wait = wait if max_wait is None else max(max_wait, wait)
+        # one event per span: the longest wait of the batch
+        if max_wait is not None and span.is_recording():
+            span.add_event("queue_wait", {"duration_seconds": max_wait})
+
+    async def _complete(self, span: trace.Span, task: TaskObj, result: Any) -> None:
+        start = time.perf_counter()
+        try:
+            await self.task_reader.complete(task, result=result)
+        finally:
+            self._observe_stage(span, self.metrics.complete, "complete", time.perf_counter() - start)
+
+    async def _error(self, span: trace.Span, task: TaskObj, error_message: str, error_details: str) -> None:
+        start = time.perf_counter()
+        try:
+            await self.task_reader.error(task, error_message, error_details)
+        finally:
+            self._observe_stage(span, self.metrics.error, "error", time.perf_counter() - start)
+
+    async def _skip_duplicates(self, tasks: List[TaskObj]) -> List[TaskObj]:
+        """Complete already completed tasks with the stored result, returns the tasks to process"""
+        if self.deduplicator is None:
+            return tasks
+        new_tasks = []
+        for task in tasks:
+            record = await self.deduplicator.get(task.task_id)
+            if record is None:
+                new_tasks.append(task)
+                continue
+            logger.info(f"Skip completed task worker_name={self.worker_name} {task.task_id=}")
+            self.metrics.task_duplicate.inc()
+            await self.task_reader.complete(task, result=record.result)
+        return new_tasks
+
     @abc.abstractmethod
     async def _process_task(self, task: TaskObj): ...
+
+    async def _process_batch(self, tasks: List[TaskObj]) -> Sequence[Any]:
+        """Process a batch of tasks (WORKER_BATCH_SIZE > 1).
+        Returns one item per task in the same order: the task result, or an exception if that task failed.
+        Override it to handle the whole batch at once, e.g. with a single bulk write to the database
+        """
+        return await asyncio.gather(*(self._process_task(task) for task in tasks), return_exceptions=True)
+
+
+async def stop_workers(workers: Collection[asyncio.Task], stop_event: asyncio.Event, timeout: float) -> None:
+    """Stop reading new tasks, wait for the tasks in progress and cancel workers that are not done after timeout"""
+    stop_event.set()
+    if not workers:
+        return
+    _, pending = await asyncio.wait(workers, timeout=timeout)
+    for worker in pending:
+        logger.warning(f"Cancel worker {worker.get_name()}: drain timeout exceeded ({timeout} sec)")
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
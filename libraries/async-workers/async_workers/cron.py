@@ -4,10 +4,11 @@
 import datetime
 import logging
 import uuid
-from typing import Any, Generic, Optional, TypeVar
+from typing import Any, Generic, List, Literal, Optional, TypeVar
 
 import croniter
 import pydantic
+from prometheus_client import Counter, Histogram
 
 from async_workers import base
 
@@ -17,43 +18,190 @@
 @dataclasses.dataclass
 class Task(base.BaseTask):
     start_time: datetime.datetime
+    # with lock_shards > 1 every replica handles its part of the tick work
+    shard: int = 0
+    shards: int = 1
+
+
+MisfirePolicy = Literal["skip", "coalesce", "catch_up"]
+
+CRON_TICK_COUNTER = Counter("cron_tick", "Number of cron ticks", ["worker_name", "status"])
+CRON_SCHEDULING_DELAY_HISTOGRAM = Histogram(
+    "cron_scheduling_delay_seconds",
+    "Time from the scheduled tick to its start",
+    ["worker_name"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, float("inf")),
+)
 
 
 class TaskReaderSettings(base.TaskReaderSettings):
     cron_mask: str = pydantic.Field(..., description="Time start in cron format", examples=["* * * * * H/10"])
+    lock_shards: int = pydantic.Field(
+        1,
+        validation_alias="CRON_LOCK_SHARDS",
+        ge=1,
+        description="Number of replicas running each tick with a lock, a replica holds one shard: "
+        "it must not exceed the number of live replicas, otherwise some shards are not run",
+    )
+    misfire_policy: MisfirePolicy = pydantic.Field(
+        "coalesce",
+        validation_alias="CRON_MISFIRE_POLICY",
+        description="Ticks missed while the previous runs were in progress: "
+        "skip - drop them, coalesce - run once for all of them, catch_up - run every one of them",
+    )
+    misfire_grace_seconds: float = pydantic.Field(
+        1,
+        validation_alias="CRON_MISFIRE_GRACE_SECONDS",
+        ge=0,
+        description="A tick later than this is missed by skip and counted as late",
+    )
+    max_overlap: int = pydantic.Field(
+        1, validation_alias="CRON_MAX_OVERLAP", ge=1, description="Number of runs of the worker at the same time"
+    )
+
+
+class TickLock(metaclass=abc.ABCMeta):
+    """Lock shared by the replicas of a cron worker, so a tick runs once fleet-wide instead of on every replica"""
+
+    @abc.abstractmethod
+    async def acquire(self, name: str, shards: int) -> Optional[int]:
+        """Shard held by this replica, it is kept between ticks while the replica is alive.
+        None if every shard is held by other replicas
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def release(self) -> None:
+        raise NotImplementedError
 
 
 TaskReaderSettingsObj = TypeVar("TaskReaderSettingsObj", bound="TaskReaderSettings")
 
 
 class TaskReader(base.TaskReader[TaskReaderSettings, Task], Generic[TaskReaderSettingsObj], metaclass=abc.ABCMeta):
-    def __init__(self, settings: TaskReaderSettingsObj, **kwargs):
+    """Ticks by the cron mask.
+    Up to max_overlap ticks are in progress at once, ticks that happen when there is no free run are missed
+    and handled by misfire_policy.
+    Without a lock every replica gets every tick. With a lock (e.g. async_workers.postgres.AdvisoryLock)
+    a tick is received by lock_shards replicas only, each with its own shard; other replicas skip ticks
+    and take over a shard when its holder dies
+    """
+
+    def __init__(self, settings: TaskReaderSettingsObj, lock: Optional[TickLock] = None, **kwargs):
         super().__init__(settings, **kwargs)
+        self.lock = lock
         self._scheduler = croniter.croniter(
             settings.cron_mask,
             start_time=datetime.datetime.now(datetime.timezone.utc),
             ret_type=datetime.datetime,
             hash_id=str(uuid.uuid4()),
         )
+        self._last_tick: datetime.datetime = self._scheduler.get_current()
+        self._running = 0
+        self._run_finished = asyncio.Event()
 
     async def __aenter__(self) -> "TaskReader":
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        pass
+        if self.lock is not None:
+            await self.lock.release()
+
+    def _due_ticks(self, now: datetime.datetime) -> List[datetime.datetime]:
+        ticks = []
+        tick: datetime.datetime = self._scheduler.get_next(start_time=self._last_tick)
+        while tick <= now:
+            ticks.append(tick)
+            tick = self._scheduler.get_next(start_time=tick)
+        return ticks
+
+    def _seconds_to_tick(self, now: datetime.datetime) -> float:
+        """0 if there is a due tick"""
+        next_time: datetime.datetime = self._scheduler.get_next(start_time=self._last_tick)
+        return max((next_time - now).total_seconds(), 0)
+
+    def _select_tick(self, due: List[datetime.datetime], now: datetime.datetime) -> Optional[datetime.datetime]:
+        """Tick to run from the due ticks by misfire_policy, the other ones are skipped"""
+        grace = datetime.timedelta(seconds=self.settings.misfire_grace_seconds)
+        policy = self.settings.misfire_policy
+        selected: Optional[datetime.datetime]
+        if policy == "catch_up":
+            selected, skipped = due[0], 0
+        elif policy == "coalesce":
+            selected, skipped = due[-1], len(due) - 1
+        else:
+            selected = due[-1] if now - due[-1] <= grace else None
+            skipped = len(due) - 1 if selected else len(due)
+        self._last_tick = due[0] if policy == "catch_up" else due[-1]
+        if skipped:
+            logger.warning(f"Skip {skipped} missed ticks of {self.worker_name} by misfire_policy={policy}")
+            CRON_TICK_COUNTER.labels(self.worker_name, "skipped").inc(skipped)
+        return selected
+
+    async def _wait_free_run(self) -> None:
+        while self._running >= self.settings.max_overlap:
+            self._run_finished.clear()
+            await self._run_finished.wait()
 
     async def fetch(self) -> Task:
-        now = datetime.datetime.now(datetime.timezone.utc)
-        next_time: datetime.datetime = self._scheduler.get_next(start_time=now)
-        sleep_time = (next_time - now).total_seconds()
-        await asyncio.sleep(sleep_time)
-        return Task(task_id=str(uuid.uuid4()), traceparent=None, start_time=self._scheduler.get_current())
+        while True:
+            await self._wait_free_run()
+            now = datetime.datetime.now(datetime.timezone.utc)
+            sleep_time = self._seconds_to_tick(now)
+            if sleep_time > 0:
+                await asyncio.sleep(sleep_time)
+                now = datetime.datetime.now(datetime.timezone.utc)
+            due = self._due_ticks(now)
+            if not due:
+                continue
+            start_time = self._select_tick(due, now)
+            if start_time is None:
+                continue
+            shard = 0
+            if self.lock is not None:
+                try:
+                    acquired = await self.lock.acquire(self.worker_name, self.settings.lock_shards)
+                except Exception as exc:
+                    logger.warning(f"Skip tick {start_time} of {self.worker_name}: error acquire lock: {exc}")
+                    continue
+                if acquired is None:
+                    logger.debug(f"Skip tick {start_time} of {self.worker_name}: lock is held by other replicas")
+                    continue
+                shard = acquired
+            delay = (now - start_time).total_seconds()
+            CRON_SCHEDULING_DELAY_HISTOGRAM.labels(self.worker_name).observe(delay)
+            if delay > self.settings.misfire_grace_seconds:
+                CRON_TICK_COUNTER.labels(self.worker_name, "late").inc()
+            CRON_TICK_COUNTER.labels(self.worker_name, "run").inc()
+            self._running += 1
+            return Task(
+                task_id=str(uuid.uuid4()),
+                traceparent=None,
+                start_time=start_time,
+                shard=shard,
+                shards=self.settings.lock_shards,
+            )
+
+    async def fetch_many(self, max_items: int, max_wait: float) -> List[Task]:
+        """A batch holds at most one tick, if it is due within max_wait"""
+        if self._running < self.settings.max_overlap:
+            if self._seconds_to_tick(datetime.datetime.now(datetime.timezone.utc)) <= max_wait:
+                return [await self.fetch()]
+        await asyncio.sleep(max_wait)
+        return []
+
+    def get_enqueued_at(self, task: Task) -> Optional[float]:
+        return task.start_time.timestamp()
+
+    def _finish_run(self) -> None:
+        self._running -= 1
+        self._run_finished.set()
 
     async def complete(self, task: Task, result: Optional[Any] = None):
-        pass
+        self._finish_run()
 
     async def error(self, task: Task, error_message: str, error_details: Optional[str] = None):
-        pass
+        self._finish_run()
 
 
 class HandlerSettings(base.BaseHandlerSettings):
@@ -66,4 +214,5 @@ class HandlerSettings(base.BaseHandlerSettings):
 class TaskHandler(
     base.TaskHandler[HandlerSettingsObj, TaskReader, Task], Generic[HandlerSettingsObj], metaclass=abc.ABCMeta
 ):
-    pass
+    def get_max_concurrency(self) -> int:
+        return max(self.settings.max_concurrency, self.task_reader.settings.max_overlap)
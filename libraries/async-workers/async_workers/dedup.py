@@ -0,0 +1,103 @@
+import abc
+import collections
+import dataclasses
+import logging
+import time
+from typing import Any, Optional, OrderedDict, Tuple
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+DEDUP_LOOKUP_COUNTER = Counter(
+    "task_handlers_dedup_lookup", "Lookups of completed task ids", ["worker_name", "result"]
+)
+
+
+@dataclasses.dataclass
+class Record:
+    """Result of an already completed task"""
+
+    result: Any
+
+
+class DedupStore(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    async def get(self, worker_name: str, task_id: str) -> Optional[Record]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def set(self, worker_name: str, task_id: str, result: Any) -> None:
+        raise NotImplementedError
+
+
+class MemoryDedupStore(DedupStore):
+    """In-process LRU cache of completed task ids, entries expire after ttl_seconds"""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._records: OrderedDict[Tuple[str, str], Tuple[float, Record]] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    async def get(self, worker_name: str, task_id: str) -> Optional[Record]:
+        key = (worker_name, task_id)
+        item = self._records.get(key)
+        if item is None:
+            return None
+        expires_at, record = item
+        if expires_at <= time.monotonic():
+            del self._records[key]
+            return None
+        self._records.move_to_end(key)
+        return record
+
+    async def set(self, worker_name: str, task_id: str, result: Any) -> None:
+        key = (worker_name, task_id)
+        self._records[key] = (time.monotonic() + self.ttl_seconds, Record(result))
+        self._records.move_to_end(key)
+        while len(self._records) > self.max_size:
+            self._records.popitem(last=False)
+
+
+class Deduplicator:
+    """Completed task ids of the worker: the in-process cache in front of an optional store shared by replicas.
+    Store errors are logged and the task is processed as if it were not seen
+    """
+
+    def __init__(self, worker_name: str, cache: Optional[MemoryDedupStore] = None, store: Optional[DedupStore] = None):
+        self.worker_name = worker_name
+        self.cache = cache
+        self.store = store
+        self._hit_cache = DEDUP_LOOKUP_COUNTER.labels(worker_name, "hit_cache")
+        self._hit_store = DEDUP_LOOKUP_COUNTER.labels(worker_name, "hit_store")
+        self._miss = DEDUP_LOOKUP_COUNTER.labels(worker_name, "miss")
+
+    async def get(self, task_id: str) -> Optional[Record]:
+        if self.cache is not None and (record := await self.cache.get(self.worker_name, task_id)) is not None:
+            self._hit_cache.inc()
+            return record
+        if self.store is not None:
+            try:
+                record = await self.store.get(self.worker_name, task_id)
+            except Exception as exc:
+                logger.warning(f"Error get completed task {task_id=} worker_name={self.worker_name}: {exc}")
+                record = None
+            if record is not None:
+                self._hit_store.inc()
+                if self.cache is not None:
+                    await self.cache.set(self.worker_name, task_id, record.result)
+                return record
+        self._miss.inc()
+        return None
+
+    async def set(self, task_id: str, result: Any) -> None:
+        if self.cache is not None:
+            await self.cache.set(self.worker_name, task_id, result)
+        if self.store is not None:
+            try:
+                await self.store.set(self.worker_name, task_id, result)
+            except Exception as exc:
+                logger.warning(f"Error save completed task {task_id=} worker_name={self.worker_name}: {exc}")
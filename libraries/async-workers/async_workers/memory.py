@@ -0,0 +1,86 @@
+import abc
+import asyncio
+import dataclasses
+import time
+import uuid
+from typing import Any, Dict, Generic, List, Optional, TypeVar
+
+from async_workers import base
+
+
+@dataclasses.dataclass
+class Task(base.BaseTask):
+    payload: Any
+    enqueued_at: float = dataclasses.field(default_factory=time.time)
+
+
+class TaskReaderSettings(base.TaskReaderSettings):
+    pass
+
+
+TaskReaderSettingsObj = TypeVar("TaskReaderSettingsObj", bound="TaskReaderSettings")
+
+
+class TaskReader(base.TaskReader[TaskReaderSettings, Task], Generic[TaskReaderSettingsObj], metaclass=abc.ABCMeta):
+    """Tasks from an in-process queue, e.g. for tests and benchmarks.
+    join() waits until every put task is completed or failed
+    """
+
+    def __init__(self, settings: TaskReaderSettingsObj, **kwargs):
+        super().__init__(settings, **kwargs)
+        self._queue: asyncio.Queue[Task] = asyncio.Queue()
+        self.results: Dict[str, Any] = {}
+        self.errors: Dict[str, str] = {}
+
+    async def __aenter__(self) -> "TaskReader":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def put(self, payload: Any, traceparent: Optional[str] = None, task_id: Optional[str] = None) -> Task:
+        task = Task(task_id=task_id or str(uuid.uuid4()), traceparent=traceparent, payload=payload)
+        self._queue.put_nowait(task)
+        self.wake_up()
+        return task
+
+    def get_enqueued_at(self, task: Task) -> Optional[float]:
+        return task.enqueued_at
+
+    async def join(self) -> None:
+        await self._queue.join()
+
+    async def fetch(self) -> Optional[Task]:
+        try:
+            return self._queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    async def fetch_many(self, max_items: int, max_wait: float) -> List[Task]:
+        if self._queue.empty() and max_wait > 0:
+            await self.wait_wake_up(max_wait)
+        tasks: List[Task] = []
+        while len(tasks) < max_items and not self._queue.empty():
+            tasks.append(self._queue.get_nowait())
+        return tasks
+
+    async def complete(self, task: Task, result: Optional[Any] = None):
+        self.results[task.task_id] = result
+        self._queue.task_done()
+
+    async def error(self, task: Task, error_message: str, error_details: Optional[str] = None):
+        self.errors[task.task_id] = error_message
+        self._queue.task_done()
+
+
+class HandlerSettings(base.BaseHandlerSettings):
+    pass
+
+
+HandlerSettingsObj = TypeVar("HandlerSettingsObj", bound="HandlerSettings")
+
+
+class TaskHandler(
+    base.TaskHandler[HandlerSettingsObj, TaskReader, Task], Generic[HandlerSettingsObj], metaclass=abc.ABCMeta
+):
+    pass
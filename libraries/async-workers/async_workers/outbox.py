@@ -0,0 +1,346 @@
+import abc
+import asyncio
+import contextlib
+import dataclasses
+import datetime
+import logging
+import uuid
+from typing import Any, Dict, Generic, List, Optional, Sequence, TypeVar
+
+import pydantic
+import sqlalchemy as sa
+from opentelemetry import propagate
+from prometheus_client import Counter
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import async_database_postgresql
+import async_rabbitmq
+
+from async_workers import base, postgres
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NOTIFY_CHANNEL = "outbox"
+
+OUTBOX_MESSAGES_COUNTER = Counter(
+    "task_readers_outbox_messages",
+    "Outbox messages relayed to RabbitMQ: published, retry - failed and left for the next batch, failed - given up",
+    ["worker_name", "status"],
+)
+
+
+def create_outbox_table(metadata: sa.MetaData, name: str = "outbox") -> sa.Table:
+    """Outbox table, add it to the service metadata and generate the migration with alembic"""
+    return sa.Table(
+        name,
+        metadata,
+        sa.Column("id", sa.BigInteger, primary_key=True, autoincrement=True),
+        sa.Column("exchange", sa.String(255), nullable=False, server_default=""),
+        sa.Column("routing_key", sa.String(255), nullable=True),
+        sa.Column("body", sa.LargeBinary, nullable=False),
+        sa.Column("headers", postgresql.JSONB(none_as_null=True), nullable=True),
+        # aio_pika.Message arguments: content_type, message_id, correlation_id, priority, ...
+        sa.Column("properties", postgresql.JSONB(none_as_null=True), nullable=True),
+        # trace context of add_messages, the relay publishes the message with it
+        sa.Column("traceparent", sa.String(255), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        # the row is claimed by a relay until visible_at, lease_id identifies the claim
+        sa.Column("visible_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column("lease_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("failed_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("error_message", sa.Text, nullable=True),
+        sa.Index(f"ix_{name}_visible_at", "visible_at", "id", postgresql_where=sa.text("failed_at IS NULL")),
+    )
+
+
+async def add_messages(
+    session: AsyncSession,
+    table: sa.Table,
+    messages: Sequence[async_rabbitmq.client.OutgoingMessage],
+    notify_channel: Optional[str] = DEFAULT_NOTIFY_CHANNEL,
+) -> Sequence[int]:
+    """Add the messages in the session transaction, the relay publishes them when the transaction is committed"""
+    if not messages:
+        return []
+    carrier: Dict[str, str] = {}
+    propagate.inject(carrier)
+    values = [
+        {
+            "exchange": message.exchange or "",
+            "routing_key": message.routing_key,
+            "body": message.data,
+            "headers": message.headers or None,
+            "properties": message.properties or None,
+            "traceparent": carrier.get("traceparent"),
+        }
+        for message in messages
+    ]
+    ids = (await session.execute(sa.insert(table).returning(table.c.id), values)).scalars().all()
+    if notify_channel:
+        await session.execute(sa.select(sa.func.pg_notify(notify_channel, table.name)))
+    return ids
+
+
+async def add(
+    session: AsyncSession,
+    table: sa.Table,
+    values: Sequence[object],
+    routing_key: Optional[str] = None,
+    exchange: Optional[str] = None,
+    headers: Optional[dict] = None,
+    content_type: str = async_rabbitmq.client.CONTENT_TYPE,
+    notify_channel: Optional[str] = DEFAULT_NOTIFY_CHANNEL,
+    **properties,
+) -> Sequence[int]:
+    """Serialize the values as Client.send does and add them to the outbox, properties must be JSON serializable"""
+    properties["content_type"] = content_type
+    messages = [
+        async_rabbitmq.client.OutgoingMessage(
+            async_rabbitmq.client.Client.serialize(value, content_type=content_type),
+            headers,
+            routing_key,
+            exchange,
+            properties,
+        )
+        for value in values
+    ]
+    return await add_messages(session, table, messages, notify_channel)
+
+
+@dataclasses.dataclass
+class Task(base.BaseTask):
+    """Batch of outbox rows claimed by one query"""
+
+    ids: List[int]
+    messages: List[async_rabbitmq.client.OutgoingMessage]
+    lease_id: uuid.UUID
+    created_at: datetime.datetime
+
+
+class TaskReaderSettings(base.TaskReaderSettings):
+    rabbitmq: async_rabbitmq.config.Settings = pydantic.Field(default_factory=async_rabbitmq.config.Settings)
+    batch_size: int = pydantic.Field(500, validation_alias="OUTBOX_BATCH_SIZE", ge=1)
+    visibility_timeout_seconds: float = pydantic.Field(
+        60, validation_alias="OUTBOX_VISIBILITY_TIMEOUT_SECONDS", gt=0, description="Time to publish a batch"
+    )
+    max_attempts: int = pydantic.Field(10, validation_alias="OUTBOX_MAX_ATTEMPTS", ge=1)
+    retry_delay_seconds: float = pydantic.Field(5, validation_alias="OUTBOX_RETRY_DELAY_SECONDS", ge=0)
+    notify_channel: Optional[str] = pydantic.Field(
+        DEFAULT_NOTIFY_CHANNEL, validation_alias="OUTBOX_NOTIFY_CHANNEL", description="None disables LISTEN"
+    )
+    # new messages wake the relay up by NOTIFY, polling is a fallback
+    sleep_max_seconds: Optional[float] = pydantic.Field(5, validation_alias="TASK_READER_SLEEP_MAX_SECONDS")
+
+
+TaskReaderSettingsObj = TypeVar("TaskReaderSettingsObj", bound="TaskReaderSettings")
+
+
+class TaskReader(base.TaskReader[TaskReaderSettings, Task], Generic[TaskReaderSettingsObj], metaclass=abc.ABCMeta):
+    """Batches of the outbox table for the relay.
+    Up to batch_size rows are claimed by one query with FOR UPDATE SKIP LOCKED and hidden from other relays
+    for the visibility timeout. The batch is published by Client.send_messages without waiting for the confirm
+    of each message before the next, the confirmed rows are deleted by one query. Failed rows are published again
+    after retry_delay_seconds * attempts, after max_attempts they stay in the table with failed_at.
+    Delivery is at least once: a relay that dies after publishing leaves the rows to be published again,
+    up to max_attempts as well.
+    A message is published with the traceparent of the add_messages call, not of the relay.
+    Messages of a batch are published concurrently, their order is not kept
+    """
+
+    def __init__(
+        self,
+        settings: TaskReaderSettingsObj,
+        storage: async_database_postgresql.storage.Storage,
+        table: sa.Table,
+        **kwargs,
+    ):
+        super().__init__(settings, **kwargs)
+        self.storage = storage
+        self.table = table
+        self._rabbitmq = async_rabbitmq.client.Client.from_settings(settings.rabbitmq)
+        self._visibility_timeout = datetime.timedelta(seconds=settings.visibility_timeout_seconds)
+        self._retry_delay = datetime.timedelta(seconds=settings.retry_delay_seconds)
+        self._listen_stack = contextlib.AsyncExitStack()
+
+    async def __aenter__(self) -> "TaskReader":
+        await self._rabbitmq.__aenter__()
+        if self.settings.notify_channel:
+            listener = postgres.NotifyListener(
+                self.storage, self.settings.notify_channel, self.table.name, self.wake_up
+            )
+            await self._listen_stack.enter_async_context(listener)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._listen_stack.aclose()
+        await self._rabbitmq.__aexit__(exc_type, exc_val, exc_tb)
+
+    def _fail_expired_statement(self) -> sa.Update:
+        """Rows whose lease of the last attempt has expired (the relay died during the batch) are failed,
+        otherwise they are never claimed again and stay without failed_at
+        """
+        table = self.table
+        expired = (
+            sa.select(table.c.id)
+            .where(
+                table.c.failed_at.is_(None),
+                table.c.visible_at <= sa.func.now(),
+                table.c.attempts >= self.settings.max_attempts,
+            )
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        return (
+            sa.update(table)
+            .where(table.c.id.in_(expired))
+            .values(failed_at=sa.func.now(), lease_id=None, error_message=postgres.LEASE_EXPIRED_ERROR)
+        )
+
+    def _claim_statement(self, lease_id: uuid.UUID, limit: int) -> sa.Update:
+        table = self.table
+        claimed = (
+            sa.select(table.c.id)
+            .where(
+                table.c.failed_at.is_(None),
+                table.c.visible_at <= sa.func.now(),
+                table.c.attempts < self.settings.max_attempts,
+            )
+            .order_by(table.c.visible_at, table.c.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        return (
+            sa.update(table)
+            .where(table.c.id.in_(claimed))
+            .values(
+                visible_at=sa.func.now() + self._visibility_timeout, lease_id=lease_id, attempts=table.c.attempts + 1
+            )
+            .returning(
+                table.c.id,
+                table.c.exchange,
+                table.c.routing_key,
+                table.c.body,
+                table.c.headers,
+                table.c.properties,
+                table.c.traceparent,
+                table.c.created_at,
+            )
+        )
+
+    async def fetch(self) -> Optional[Task]:
+        lease_id = uuid.uuid4()
+        async with self.storage.session_maker.begin() as session:
+            expired = (await session.execute(self._fail_expired_statement())).rowcount
+            rows = (await session.execute(self._claim_statement(lease_id, self.settings.batch_size))).all()
+        if expired:
+            OUTBOX_MESSAGES_COUNTER.labels(self.worker_name, "failed").inc(expired)
+            logger.error(f"{expired} messages of outbox {self.table.name} failed: {postgres.LEASE_EXPIRED_ERROR}")
+        if not rows:
+            return None
+        rows.sort(key=lambda row: row.id)
+        return Task(
+            task_id=f"{rows[0].id}-{rows[-1].id}",
+            traceparent=None,
+            ids=[row.id for row in rows],
+            messages=[
+                async_rabbitmq.client.OutgoingMessage(
+                    row.body, self._get_headers(row), row.routing_key, row.exchange or None, row.properties
+                )
+                for row in rows
+            ],
+            lease_id=lease_id,
+            created_at=min(row.created_at for row in rows),
+        )
+
+    @staticmethod
+    def _get_headers(row: Any) -> Optional[dict]:
+        """Headers with the trace context of add_messages, headers of the message take precedence"""
+        if not row.traceparent:
+            return row.headers
+        return {"traceparent": row.traceparent, **(row.headers or {})}
+
+    async def fetch_many(self, max_items: int, max_wait: float) -> List[Task]:
+        """A task is already a batch of rows, one is fetched at once"""
+        task = await self.fetch()
+        if task is None and max_wait > 0 and await self.wait_wake_up(max_wait):
+            task = await self.fetch()
+        return [task] if task else []
+
+    def get_enqueued_at(self, task: Task) -> Optional[float]:
+        return task.created_at.timestamp()
+
+    async def publish(self, task: Task) -> List[Optional[Exception]]:
+        """Publish the batch within the lease of its rows,
+        returns the result of every message: None if it is confirmed, else the error
+        """
+        async with asyncio.timeout(self.settings.visibility_timeout_seconds):
+            return await self._rabbitmq.send_messages(task.messages)
+
+    def _release_statement(self, task: Task, ids: Sequence[int], error_message: str) -> sa.Update:
+        table = self.table
+        return (
+            sa.update(table)
+            .where(table.c.id.in_(ids), table.c.lease_id == task.lease_id)
+            .values(
+                lease_id=None,
+                error_message=error_message,
+                visible_at=sa.func.now() + sa.literal(self._retry_delay, sa.Interval) * table.c.attempts,
+                failed_at=sa.case((table.c.attempts >= self.settings.max_attempts, sa.func.now()), else_=None),
+            )
+            .returning(table.c.failed_at)
+        )
+
+    async def complete(self, task: Task, result: Optional[Any] = None):
+        """Delete the confirmed rows, the failed ones (result is the list of publish) are published again"""
+        results: Sequence[Optional[Exception]] = result or [None] * len(task.ids)
+        confirmed = [id_ for id_, error in zip(task.ids, results) if error is None]
+        failed = {id_: error for id_, error in zip(task.ids, results) if error is not None}
+        async with self.storage.session_maker.begin() as session:
+            if confirmed:
+                stmt = sa.delete(self.table).where(
+                    self.table.c.id.in_(confirmed), self.table.c.lease_id == task.lease_id
+                )
+                deleted = (await session.execute(stmt)).rowcount
+                if deleted != len(confirmed):
+                    logger.warning(
+                        f"Outbox lease of {task.task_id} has expired: deleted {deleted} of {len(confirmed)} "
+                        f"published messages, the others may be published again"
+                    )
+            if failed:
+                error = next(iter(failed.values()))
+                await self._release(session, task, list(failed), f"{type(error).__name__}: {error}")
+        OUTBOX_MESSAGES_COUNTER.labels(self.worker_name, "published").inc(len(confirmed))
+
+    async def error(self, task: Task, error_message: str, error_details: Optional[str] = None):
+        async with self.storage.session_maker.begin() as session:
+            await self._release(session, task, task.ids, error_message)
+
+    async def _release(self, session: AsyncSession, task: Task, ids: List[int], error_message: str) -> None:
+        failed_at = (await session.execute(self._release_statement(task, ids, error_message[:1000]))).scalars().all()
+        given_up = sum(value is not None for value in failed_at)
+        OUTBOX_MESSAGES_COUNTER.labels(self.worker_name, "retry").inc(len(failed_at) - given_up)
+        OUTBOX_MESSAGES_COUNTER.labels(self.worker_name, "failed").inc(given_up)
+        if given_up:
+            logger.error(
+                f"Outbox {task.task_id}: {given_up} messages failed after {self.settings.max_attempts} attempts"
+            )
+        logger.warning(f"Outbox {task.task_id}: {len(failed_at)} messages are not published: {error_message}")
+
+
+class HandlerSettings(base.BaseHandlerSettings):
+    pass
+
+
+HandlerSettingsObj = TypeVar("HandlerSettingsObj", bound="HandlerSettings")
+
+
+class TaskHandler(
+    base.TaskHandler[HandlerSettingsObj, TaskReader, Task], Generic[HandlerSettingsObj], metaclass=abc.ABCMeta
+):
+    """Relay of the outbox to RabbitMQ, set WORKER_MAX_CONCURRENCY to publish several batches at once"""
+
+    async def _process_task(self, task: Task) -> List[Optional[Exception]]:
+        return await self.task_reader.publish(task)
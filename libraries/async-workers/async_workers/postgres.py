@@ -0,0 +1,481 @@
+import abc
+import asyncio
+import contextlib
+import dataclasses
+import datetime
+import logging
+import uuid
+from typing import Any, Callable, Dict, Generic, List, Optional, Sequence, TypeVar
+
+import pydantic
+import pydantic_core
+import sqlalchemy as sa
+from opentelemetry import propagate
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+import async_database_postgresql
+
+from async_workers import base, cron, dedup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE = "default"
+DEFAULT_NOTIFY_CHANNEL = "task_queue"
+LEASE_EXPIRED_ERROR = "Lease of the last attempt expired"
+
+
+def create_queue_table(metadata: sa.MetaData, name: str = "task_queue") -> sa.Table:
+    """Task queue table, add it to the service metadata and generate the migration with alembic"""
+    return sa.Table(
+        name,
+        metadata,
+        sa.Column("id", sa.BigInteger, primary_key=True, autoincrement=True),
+        sa.Column("queue", sa.String(255), nullable=False, server_default=DEFAULT_QUEUE),
+        sa.Column("payload", postgresql.JSONB, nullable=False),
+        sa.Column("traceparent", sa.String(255), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        # the row is claimed by a consumer until visible_at (visibility timeout), lease_id identifies the claim
+        sa.Column("visible_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column("lease_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("failed_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("error_message", sa.Text, nullable=True),
+        sa.Column("error_details", sa.Text, nullable=True),
+        sa.Index(f"ix_{name}_queue_visible_at", "queue", "visible_at", postgresql_where=sa.text("failed_at IS NULL")),
+    )
+
+
+def create_dedup_table(metadata: sa.MetaData, name: str = "task_dedup") -> sa.Table:
+    """Completed task ids for DedupStore"""
+    return sa.Table(
+        name,
+        metadata,
+        sa.Column("worker_name", sa.String(255), primary_key=True),
+        sa.Column("task_id", sa.String(255), primary_key=True),
+        sa.Column("result", postgresql.JSONB(none_as_null=True), nullable=True),
+        sa.Column("completed_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Index(f"ix_{name}_completed_at", "completed_at"),
+    )
+
+
+class DedupStore(dedup.DedupStore):
+    """Completed task ids shared by worker replicas, results are stored as JSON.
+    Expired rows are ignored, call delete_expired periodically (e.g. from a cron worker) to remove them
+    """
+
+    def __init__(self, storage: async_database_postgresql.storage.Storage, table: sa.Table, ttl_seconds: float):
+        self.storage = storage
+        self.table = table
+        self.ttl = datetime.timedelta(seconds=ttl_seconds)
+
+    async def get(self, worker_name: str, task_id: str) -> Optional[dedup.Record]:
+        table = self.table
+        stmt = sa.select(table.c.result).where(
+            table.c.worker_name == worker_name,
+            table.c.task_id == task_id,
+            table.c.completed_at > sa.func.now() - self.ttl,
+        )
+        async with self.storage.session_maker() as session:
+            row = (await session.execute(stmt)).first()
+        return None if row is None else dedup.Record(row.result)
+
+    async def set(self, worker_name: str, task_id: str, result: Any) -> None:
+        stmt = postgresql.insert(self.table).values(
+            worker_name=worker_name, task_id=task_id, result=pydantic_core.to_jsonable_python(result, by_alias=True)
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.table.c.worker_name, self.table.c.task_id],
+            set_={"result": stmt.excluded.result, "completed_at": sa.func.now()},
+        )
+        async with self.storage.session_maker.begin() as session:
+            await session.execute(stmt)
+
+    async def delete_expired(self) -> int:
+        stmt = sa.delete(self.table).where(self.table.c.completed_at <= sa.func.now() - self.ttl)
+        async with self.storage.session_maker.begin() as session:
+            result = await session.execute(stmt)
+        return result.rowcount
+
+
+PG_LOCKS = sa.table(
+    "pg_locks",
+    sa.column("locktype"),
+    sa.column("classid"),
+    sa.column("objid"),
+    sa.column("objsubid"),
+    sa.column("granted"),
+)
+
+
+class AdvisoryLock(cron.TickLock):
+    """Session-level advisory locks pg_try_advisory_lock(hashtext(name), shard) for cron.TaskReader.
+    A lock is held by a dedicated connection until release, so it is freed by the server when the replica dies.
+    A replica holds one shard, shards without a live replica are not run: the holders log a warning
+    """
+
+    def __init__(self, storage: async_database_postgresql.storage.Storage):
+        self.storage = storage
+        self._connection: Optional[AsyncConnection] = None
+        self._shard: Optional[int] = None
+        self._held_shards: Optional[int] = None
+
+    async def acquire(self, name: str, shards: int) -> Optional[int]:
+        if self._connection is not None and self._shard is not None:
+            try:
+                await self._check_shards(self._connection, name, shards)
+                return self._shard
+            except Exception as exc:
+                logger.warning(f"Lock {name} shard={self._shard} lost: {exc}")
+                await self.release()
+        if self._connection is None:
+            connection = await self.storage.engine.connect()
+            self._connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        for shard in range(shards):
+            stmt = sa.select(sa.func.pg_try_advisory_lock(sa.func.hashtext(name), shard))
+            if (await self._connection.execute(stmt)).scalar():
+                logger.info(f"Lock {name} shard={shard} acquired")
+                self._shard = shard
+                await self._check_shards(self._connection, name, shards)
+                return shard
+        # no lock is held by the connection, it may go back to the pool
+        connection, self._connection = self._connection, None
+        await connection.close()
+        return None
+
+    async def _check_shards(self, connection: AsyncConnection, name: str, shards: int) -> None:
+        """Warn when some shards are held by no replica (fewer live replicas than shards), their work is not run"""
+        stmt = (
+            sa.select(sa.func.count())
+            .select_from(PG_LOCKS)
+            .where(
+                PG_LOCKS.c.locktype == "advisory",
+                PG_LOCKS.c.classid == sa.cast(sa.func.hashtext(name), postgresql.OID),
+                PG_LOCKS.c.objid < shards,
+                # objsubid 2 is a lock with two int4 keys
+                PG_LOCKS.c.objsubid == 2,
+                PG_LOCKS.c.granted.is_(True),
+            )
+        )
+        held = (await connection.execute(stmt)).scalar()
+        if held != self._held_shards:
+            if held is not None and held < shards:
+                logger.warning(
+                    f"Lock {name}: {shards - held} of {shards} shards are held by no replica and are not run, "
+                    f"CRON_LOCK_SHARDS must not exceed the number of live replicas"
+                )
+            elif self._held_shards is not None:
+                logger.info(f"Lock {name}: every one of {shards} shards is held")
+        self._held_shards = held
+
+    async def release(self) -> None:
+        self._shard = None
+        self._held_shards = None
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            with contextlib.suppress(Exception):
+                # closing the session releases its advisory locks
+                await connection.invalidate()
+                await connection.close()
+
+
+async def enqueue(
+    session: AsyncSession,
+    table: sa.Table,
+    payloads: Sequence[Any],
+    queue: str = DEFAULT_QUEUE,
+    notify_channel: Optional[str] = DEFAULT_NOTIFY_CHANNEL,
+    delay_seconds: float = 0,
+) -> Sequence[int]:
+    """Add tasks in the session transaction, consumers are notified when the transaction is committed"""
+    if not payloads:
+        return []
+    carrier: Dict[str, str] = {}
+    propagate.inject(carrier)
+    values = [{"queue": queue, "payload": payload, "traceparent": carrier.get("traceparent")} for payload in payloads]
+    stmt = sa.insert(table).returning(table.c.id)
+    if delay_seconds:
+        stmt = stmt.values(visible_at=sa.func.now() + datetime.timedelta(seconds=delay_seconds))
+    ids = (await session.execute(stmt, values)).scalars().all()
+    if notify_channel:
+        await session.execute(sa.select(sa.func.pg_notify(notify_channel, queue)))
+    return ids
+
+
+@dataclasses.dataclass
+class Task(base.BaseTask):
+    id: int
+    payload: Any
+    attempts: int
+    lease_id: uuid.UUID
+    created_at: datetime.datetime
+
+
+class NotifyListener:
+    """LISTEN channel on a dedicated connection and call on_notify for the notifications with payload.
+    A lost connection (e.g. the database restarts) is re-established every reconnect_seconds,
+    notifications sent meanwhile are missed: on_notify is called after the reconnect and readers poll until then
+    """
+
+    def __init__(
+        self,
+        storage: async_database_postgresql.storage.Storage,
+        channel: str,
+        payload: str,
+        on_notify: Callable[[], None],
+        reconnect_seconds: float = 5,
+    ):
+        self.storage = storage
+        self.channel = channel
+        self.payload = payload
+        self.on_notify = on_notify
+        self.reconnect_seconds = reconnect_seconds
+        self._stack = contextlib.AsyncExitStack()
+        self._reconnect: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "NotifyListener":
+        await self._listen()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reconnect
+            self._reconnect = None
+        await self._stack.aclose()
+
+    async def _listen(self) -> None:
+        async with contextlib.AsyncExitStack() as stack:
+            connection = await stack.enter_async_context(self.storage.engine.connect())
+            raw_connection = await connection.get_raw_connection()
+            driver_connection = raw_connection.driver_connection
+            await driver_connection.add_listener(self.channel, self._on_notify)
+            stack.push_async_callback(driver_connection.remove_listener, self.channel, self._on_notify)
+            # removed first, so closing the connection on exit is not taken for a lost connection
+            driver_connection.add_termination_listener(self._on_termination)
+            stack.callback(driver_connection.remove_termination_listener, self._on_termination)
+            self._stack = stack.pop_all()
+        logger.info(f"Listen channel {self.channel} for {self.payload}")
+
+    def _on_notify(self, _connection, _pid, _channel, payload) -> None:
+        if payload == self.payload:
+            self.on_notify()
+
+    def _on_termination(self, _connection) -> None:
+        logger.warning(f"Connection listening channel {self.channel} for {self.payload} is lost, reconnect")
+        if self._reconnect is None or self._reconnect.done():
+            self._reconnect = asyncio.create_task(self._relisten(), name=f"LISTEN::{self.channel}")
+
+    async def _relisten(self) -> None:
+        stack, self._stack = self._stack, contextlib.AsyncExitStack()
+        with contextlib.suppress(Exception):
+            await stack.aclose()
+        while True:
+            try:
+                await self._listen()
+            except Exception as exc:
+                logger.warning(f"Error listen channel {self.channel}, retry after {self.reconnect_seconds} sec: {exc}")
+                await asyncio.sleep(self.reconnect_seconds)
+                continue
+            # notifications may have been missed while the connection was lost
+            self.on_notify()
+            return
+
+
+class TaskReaderSettings(base.TaskReaderSettings):
+    queue: str = pydantic.Field(DEFAULT_QUEUE, validation_alias="TASK_QUEUE_NAME")
+    visibility_timeout_seconds: float = pydantic.Field(
+        60, validation_alias="TASK_QUEUE_VISIBILITY_TIMEOUT_SECONDS", gt=0
+    )
+    max_attempts: int = pydantic.Field(5, validation_alias="TASK_QUEUE_MAX_ATTEMPTS", ge=1)
+    retry_delay_seconds: float = pydantic.Field(10, validation_alias="TASK_QUEUE_RETRY_DELAY_SECONDS", ge=0)
+    notify_channel: Optional[str] = pydantic.Field(
+        DEFAULT_NOTIFY_CHANNEL, validation_alias="TASK_QUEUE_NOTIFY_CHANNEL", description="None disables LISTEN"
+    )
+    # new tasks wake the reader up by NOTIFY, polling is a fallback
+    sleep_max_seconds: Optional[float] = pydantic.Field(5, validation_alias="TASK_READER_SLEEP_MAX_SECONDS")
+
+
+TaskReaderSettingsObj = TypeVar("TaskReaderSettingsObj", bound="TaskReaderSettings")
+
+
+class TaskReader(base.TaskReader[TaskReaderSettings, Task], Generic[TaskReaderSettingsObj], metaclass=abc.ABCMeta):
+    """Competing consumers of the queue table.
+    Rows are claimed with FOR UPDATE SKIP LOCKED and hidden from other consumers for the visibility timeout,
+    the lease of a task in progress is extended until it is completed (the row is deleted) or failed.
+    A task whose lease has expired (e.g. the consumer died) is claimed again, up to max_attempts times:
+    when the lease of the last attempt expires, the task is failed by the next claim
+    """
+
+    def __init__(
+        self,
+        settings: TaskReaderSettingsObj,
+        storage: async_database_postgresql.storage.Storage,
+        table: sa.Table,
+        **kwargs,
+    ):
+        super().__init__(settings, **kwargs)
+        self.storage = storage
+        self.table = table
+        self._visibility_timeout = datetime.timedelta(seconds=settings.visibility_timeout_seconds)
+        self._in_progress: Dict[int, uuid.UUID] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._listen_stack = contextlib.AsyncExitStack()
+
+    async def __aenter__(self) -> "TaskReader":
+        if self.settings.notify_channel:
+            listener = NotifyListener(self.storage, self.settings.notify_channel, self.settings.queue, self.wake_up)
+            await self._listen_stack.enter_async_context(listener)
+        self._heartbeat = asyncio.create_task(self._extend_leases(), name=f"HEARTBEAT::{self.worker_name}")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._heartbeat
+            self._heartbeat = None
+        await self._listen_stack.aclose()
+
+    def _fail_expired_statement(self) -> sa.Update:
+        """Rows whose lease of the last attempt has expired (the consumer died without error) are failed,
+        otherwise they are never claimed again and stay without failed_at
+        """
+        table = self.table
+        expired = (
+            sa.select(table.c.id)
+            .where(
+                table.c.queue == self.settings.queue,
+                table.c.failed_at.is_(None),
+                table.c.visible_at <= sa.func.now(),
+                table.c.attempts >= self.settings.max_attempts,
+            )
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        return (
+            sa.update(table)
+            .where(table.c.id.in_(expired))
+            .values(failed_at=sa.func.now(), lease_id=None, error_message=LEASE_EXPIRED_ERROR)
+        )
+
+    async def _claim(self, limit: int) -> List[Task]:
+        table = self.table
+        lease_id = uuid.uuid4()
+        claimed = (
+            sa.select(table.c.id)
+            .where(
+                table.c.queue == self.settings.queue,
+                table.c.failed_at.is_(None),
+                table.c.visible_at <= sa.func.now(),
+                table.c.attempts < self.settings.max_attempts,
+            )
+            .order_by(table.c.visible_at, table.c.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        stmt = (
+            sa.update(table)
+            .where(table.c.id.in_(claimed))
+            .values(
+                visible_at=sa.func.now() + self._visibility_timeout,
+                lease_id=lease_id,
+                attempts=table.c.attempts + 1,
+            )
+            .returning(table.c.id, table.c.payload, table.c.traceparent, table.c.attempts, table.c.created_at)
+        )
+        async with self.storage.session_maker.begin() as session:
+            expired = (await session.execute(self._fail_expired_statement())).rowcount
+            rows = (await session.execute(stmt)).all()
+        if expired:
+            logger.error(f"{expired} tasks of queue {self.settings.queue} failed: {LEASE_EXPIRED_ERROR}")
+        tasks = []
+        for row in sorted(rows, key=lambda row: row.id):
+            self._in_progress[row.id] = lease_id
+            tasks.append(
+                Task(
+                    task_id=str(row.id),
+                    traceparent=row.traceparent,
+                    id=row.id,
+                    payload=row.payload,
+                    attempts=row.attempts,
+                    lease_id=lease_id,
+                    created_at=row.created_at,
+                )
+            )
+        return tasks
+
+    def get_enqueued_at(self, task: Task) -> Optional[float]:
+        return task.created_at.timestamp()
+
+    async def fetch(self) -> Optional[Task]:
+        tasks = await self._claim(1)
+        return tasks[0] if tasks else None
+
+    async def fetch_many(self, max_items: int, max_wait: float) -> List[Task]:
+        """Claim up to max_items rows by one query, if there are none wait for NOTIFY no longer than max_wait"""
+        tasks = await self._claim(max_items)
+        if not tasks and max_wait > 0 and await self.wait_wake_up(max_wait):
+            tasks = await self._claim(max_items)
+        return tasks
+
+    async def _extend_leases(self) -> None:
+        table = self.table
+        while True:
+            await asyncio.sleep(self.settings.visibility_timeout_seconds / 3)
+            if not self._in_progress:
+                continue
+            leases = list(self._in_progress.items())
+            stmt = (
+                sa.update(table)
+                .where(sa.tuple_(table.c.id, table.c.lease_id).in_(leases))
+                .values(visible_at=sa.func.now() + self._visibility_timeout)
+            )
+            try:
+                async with self.storage.session_maker.begin() as session:
+                    result = await session.execute(stmt)
+            except Exception as exc:
+                logger.warning(f"Error extend leases of {len(leases)} tasks: {exc}")
+                continue
+            if result.rowcount != len(leases):
+                logger.warning(f"Leases lost: extended {result.rowcount} of {len(leases)} tasks")
+
+    def _release(self, task: Task) -> bool:
+        return self._in_progress.pop(task.id, None) is not None
+
+    async def complete(self, task: Task, result: Optional[Any] = None):
+        self._release(task)
+        stmt = sa.delete(self.table).where(self.table.c.id == task.id, self.table.c.lease_id == task.lease_id)
+        async with self.storage.session_maker.begin() as session:
+            deleted = await session.execute(stmt)
+        if not deleted.rowcount:
+            logger.warning(f"Lease of task {task.task_id} has expired, the task may be processed again")
+
+    async def error(self, task: Task, error_message: str, error_details: Optional[str] = None):
+        self._release(task)
+        table = self.table
+        values: Dict[str, Any] = {"lease_id": None, "error_message": error_message, "error_details": error_details}
+        if task.attempts >= self.settings.max_attempts:
+            logger.error(f"Task {task.task_id} failed after {task.attempts} attempts")
+            values["failed_at"] = sa.func.now()
+        else:
+            retry_delay = datetime.timedelta(seconds=self.settings.retry_delay_seconds * task.attempts)
+            values["visible_at"] = sa.func.now() + retry_delay
+        stmt = sa.update(table).where(table.c.id == task.id, table.c.lease_id == task.lease_id).values(**values)
+        async with self.storage.session_maker.begin() as session:
+            await session.execute(stmt)
+
+
+class HandlerSettings(base.BaseHandlerSettings):
+    pass
+
+
+HandlerSettingsObj = TypeVar("HandlerSettingsObj", bound="HandlerSettings")
+
+
+class TaskHandler(
+    base.TaskHandler[HandlerSettingsObj, TaskReader, Task], Generic[HandlerSettingsObj], metaclass=abc.ABCMeta
+):
+    pass
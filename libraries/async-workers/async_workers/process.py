@@ -0,0 +1,181 @@
+import asyncio
+import concurrent.futures
+import dataclasses
+import functools
+import logging
+import logging.handlers
+import multiprocessing
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional
+
+from opentelemetry import context, propagate, trace
+from prometheus_client import Gauge, Histogram
+
+import async_utils
+
+logger = logging.getLogger(__name__)
+
+PROCESS_POOL_TASK_GAUGE = Gauge("process_pool_task", "Number of calls in the process pool", ["pool_name", "state"])
+PROCESS_POOL_WAIT_HISTOGRAM = Histogram(
+    "process_pool_wait_seconds",
+    "Time from submit to the start of execution in a child process",
+    ["pool_name"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, float("inf")),
+)
+PROCESS_POOL_EXECUTION_HISTOGRAM = Histogram(
+    "process_pool_execution_seconds",
+    "Execution time in a child process",
+    ["pool_name"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, float("inf")),
+)
+
+
+@dataclasses.dataclass
+class _CallResult:
+    started: float
+    duration: float
+    value: Any = None
+    error: Optional[BaseException] = None
+
+
+class _LogContextFilter(logging.Filter):
+    """Child side: put log extra and trace ids into the record before it is sent to the parent process"""
+
+    def filter(self, record):
+        for name, value in async_utils.get_log_extra().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        ctx = trace.get_current_span().get_span_context()
+        record.trace_id = ctx.trace_id
+        record.span_id = ctx.span_id
+        return True
+
+
+class _ForwardHandler(logging.Handler):
+    """Parent side: pass records from child processes to the parent loggers"""
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def _initialize_child(log_queue: multiprocessing.Queue, log_level: int) -> None:
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(_LogContextFilter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(log_level)
+
+
+def _call(
+    function: Callable[..., Any],
+    args: tuple,
+    kwargs: Dict[str, Any],
+    log_extra: Dict[str, Any],
+    carrier: Dict[str, str],
+) -> _CallResult:
+    started = time.time()
+    token = context.attach(propagate.extract(carrier))
+    try:
+        with async_utils.LogExtraManager(**log_extra):
+            value = function(*args, **kwargs)
+    except Exception as exc:
+        exc.add_note(f"Traceback in process pool:\n{traceback.format_exc()}")
+        return _CallResult(started=started, duration=time.time() - started, error=exc)
+    finally:
+        context.detach(token)
+    return _CallResult(started=started, duration=time.time() - started, value=value)
+
+
+class ProcessPool:
+    """Process pool for CPU-bound functions.
+    Log extra and trace context are passed to the child process, child logs are handled by the parent loggers.
+
+    Processes are recycled by generations: after size * max_tasks_per_child calls a new executor is started
+    and the previous one exits when its calls are done. ProcessPoolExecutor(max_tasks_per_child=...) is not used,
+    it deadlocks on python 3.11 when calls are queued: https://github.com/python/cpython/issues/115634
+    """
+
+    def __init__(self, name: str, size: int, max_tasks_per_child: Optional[int] = None):
+        self.name = name
+        self.size = size
+        self.max_tasks_per_child = max_tasks_per_child
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._log_queue: Optional[multiprocessing.Queue] = None
+        self._log_listener: Optional[logging.handlers.QueueListener] = None
+        self._in_flight = 0
+        self._submitted = 0
+        self._queued_gauge = PROCESS_POOL_TASK_GAUGE.labels(name, "queued")
+        self._running_gauge = PROCESS_POOL_TASK_GAUGE.labels(name, "running")
+        self._wait_histogram = PROCESS_POOL_WAIT_HISTOGRAM.labels(name)
+        self._execution_histogram = PROCESS_POOL_EXECUTION_HISTOGRAM.labels(name)
+
+    async def __aenter__(self) -> "ProcessPool":
+        self._log_queue = multiprocessing.get_context("spawn").Queue()
+        self._log_listener = logging.handlers.QueueListener(self._log_queue, _ForwardHandler())
+        self._log_listener.start()
+        self._executor = self._create_executor()
+        logger.info(
+            f"Process pool {self.name} started: size={self.size} max_tasks_per_child={self.max_tasks_per_child}"
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
+        self._log_queue = None
+
+    def _create_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._log_queue is None:
+            raise RuntimeError(f"Process pool {self.name} not started")
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.size,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_initialize_child,
+            initargs=(self._log_queue, logging.getLogger().getEffectiveLevel()),
+        )
+
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._executor is None:
+            raise RuntimeError(f"Process pool {self.name} not started")
+        if self.max_tasks_per_child and self._submitted >= self.size * self.max_tasks_per_child:
+            logger.info(f"Recycle processes of the pool {self.name} after {self._submitted} calls")
+            # already submitted calls are finished by the previous executor
+            self._executor.shutdown(wait=False)
+            self._executor = self._create_executor()
+            self._submitted = 0
+        self._submitted += 1
+        return self._executor
+
+    def _update_gauges(self) -> None:
+        self._running_gauge.set(min(self._in_flight, self.size))
+        self._queued_gauge.set(max(self._in_flight - self.size, 0))
+
+    async def run(self, function: Callable[..., async_utils.ReturnType], *args, **kwargs) -> async_utils.ReturnType:
+        """Run function(*args, **kwargs) in a child process, function and arguments must be picklable"""
+        executor = self._get_executor()
+        log_extra = async_utils.get_log_extra(should_copy=True)
+        if "log_extra" in kwargs:
+            log_extra.update(kwargs.pop("log_extra"))
+        carrier: Dict[str, str] = {}
+        propagate.inject(carrier)
+        loop = asyncio.get_running_loop()
+        submitted = time.time()
+        self._in_flight += 1
+        self._update_gauges()
+        try:
+            result: _CallResult = await loop.run_in_executor(
+                executor, functools.partial(_call, function, args, kwargs, log_extra, carrier)
+            )
+        finally:
+            self._in_flight -= 1
+            self._update_gauges()
+        self._wait_histogram.observe(max(result.started - submitted, 0))
+        self._execution_histogram.observe(result.duration)
+        if result.error is not None:
+            raise result.error
+        return result.value
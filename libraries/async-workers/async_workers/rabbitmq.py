@@ -1,10 +1,13 @@
 import abc
+import asyncio
+import contextlib
 import dataclasses
 import logging
 import uuid
-from typing import Any, AsyncIterator, Generic, Optional, TypeVar
+from typing import Any, AsyncGenerator, Generic, List, Optional, TypeVar
 
 import pydantic
+from prometheus_client import Counter
 
 import async_rabbitmq
 
@@ -12,6 +15,15 @@
 
 logger = logging.getLogger(__name__)
 
+RETRY_ATTEMPT_HEADER = "x-retry-attempt"
+ERROR_MESSAGE_HEADER = "x-error-message"
+
+RABBITMQ_RETRY_COUNTER = Counter(
+    "task_readers_rabbitmq_retry",
+    "Failed messages sent to a retry or the parking lot queue",
+    ["worker_name", "status"],
+)
+
 
 @dataclasses.dataclass
 class Task(base.BaseTask):
@@ -21,36 +33,151 @@ class Task(base.BaseTask):
 class TaskReaderSettings(base.TaskReaderSettings):
     request_timeout: int = pydantic.Field(10, validation_alias="RABBITMQ_REQUEST_TIMEOUT")
     rabbitmq: async_rabbitmq.config.Settings = pydantic.Field(default_factory=async_rabbitmq.config.Settings)
+    queues: Optional[List[str]] = pydantic.Field(
+        None,
+        validation_alias="RABBITMQ_QUEUES",
+        description='Consume several queues in turn instead of RABBITMQ_QUEUE, e.g. ["high", "low"]',
+    )
+    retry_max_attempts: int = pydantic.Field(
+        0, validation_alias="RABBITMQ_RETRY_MAX_ATTEMPTS", ge=0, description="0 - failed messages are dropped (nack)"
+    )
+    retry_delay_seconds: float = pydantic.Field(1, validation_alias="RABBITMQ_RETRY_DELAY_SECONDS", gt=0)
+    retry_multiplier: float = pydantic.Field(2, validation_alias="RABBITMQ_RETRY_MULTIPLIER", ge=1)
+    retry_max_delay_seconds: float = pydantic.Field(60 * 60, validation_alias="RABBITMQ_RETRY_MAX_DELAY_SECONDS", gt=0)
+    retry_parking_queue: Optional[str] = pydantic.Field(
+        None, validation_alias="RABBITMQ_RETRY_PARKING_QUEUE", description="<queue>.parking by default"
+    )
+
+    def get_retry_delays(self) -> List[float]:
+        """Delay before every retry attempt"""
+        return [
+            min(self.retry_delay_seconds * self.retry_multiplier**attempt, self.retry_max_delay_seconds)
+            for attempt in range(self.retry_max_attempts)
+        ]
+
+    def get_queues(self) -> List[str]:
+        return self.queues or ([self.rabbitmq.queue] if self.rabbitmq.queue else [])
 
 
 TaskReaderSettingsObj = TypeVar("TaskReaderSettingsObj", bound="TaskReaderSettings")
 
 
 class TaskReader(base.TaskReader[TaskReaderSettings, Task], Generic[TaskReaderSettingsObj], metaclass=abc.ABCMeta):
+    """Tasks from the RabbitMQ queue, or from the queues of RABBITMQ_QUEUES taken in turn.
+    With retry_max_attempts a failed message is republished to the retry queue of its attempt:
+    <queue>.retry.<delay ms> with x-message-ttl that dead-letters it back to the queue after the delay.
+    The attempt is counted in the x-retry-attempt header, after the last one the message goes to the parking lot queue.
+    Failed tasks do not occupy the handler while they wait for the retry
+    """
+
     def __init__(self, settings: TaskReaderSettingsObj, **kwargs):
         super().__init__(settings, **kwargs)
         self._rabbitmq = async_rabbitmq.client.Client.from_settings(settings.rabbitmq)
+        self._consumer: Optional[AsyncGenerator[async_rabbitmq.client.Response, None]] = None
+        self._next_response: Optional[asyncio.Future] = None
+        self._fetch_cursor = 0
+        # a failed message is retried and parked by the queues of the queue it came from
+        delays = settings.get_retry_delays()
+        self._retry_queues = {
+            queue: [f"{queue}.retry.{round(delay * 1000)}" for delay in delays] for queue in settings.get_queues()
+        }
+        self._parking_queues = {
+            queue: settings.retry_parking_queue or f"{queue}.parking" for queue in settings.get_queues()
+        }
 
     async def __aenter__(self) -> "TaskReader":
         await self._rabbitmq.__aenter__()
+        if self.settings.rabbitmq.prefetch_count is None and self.max_in_flight:
+            # the broker does not push more messages than the handler has free slots for
+            await self._rabbitmq.set_qos(self.max_in_flight)
+        if self.settings.retry_max_attempts:
+            await self._declare_retry_queues()
         return self
 
+    async def _declare_retry_queues(self) -> None:
+        if not self._retry_queues:
+            raise RuntimeError("Queue not set")
+        for queue, retry_queues in self._retry_queues.items():
+            for retry_queue, delay in zip(retry_queues, self.settings.get_retry_delays()):
+                await self._rabbitmq.declare_queue(
+                    retry_queue,
+                    arguments={
+                        "x-message-ttl": round(delay * 1000),
+                        "x-dead-letter-exchange": "",
+                        "x-dead-letter-routing-key": queue,
+                    },
+                )
+        for parking_queue in dict.fromkeys(self._parking_queues.values()):
+            await self._rabbitmq.declare_queue(parking_queue)
+
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._close_consumer()
         await self._rabbitmq.__aexit__(exc_type, exc_val, exc_tb)
 
-    async def receive(self) -> AsyncIterator[Task]:
-        async for response in self._rabbitmq.receive():
-            task_id = response.message.properties.message_id or str(uuid.uuid4())
-            yield Task(task_id=task_id, traceparent=response.headers.get("traceparent"), response=response)
+    @staticmethod
+    def _create_task(response: async_rabbitmq.client.Response) -> Task:
+        task_id = response.message.properties.message_id or str(uuid.uuid4())
+        return Task(task_id=task_id, traceparent=response.headers.get("traceparent"), response=response)
+
+    async def receive(self) -> AsyncGenerator[Task, None]:
+        # complete/error always ack the message, so tasks may be processed concurrently
+        async for response in self._rabbitmq.receive(manual_ack=True, queues=self.settings.queues):
+            yield self._create_task(response)
             if self.settings.run_once:
                 break
 
+    def get_enqueued_at(self, task: Task) -> Optional[float]:
+        """The message timestamp, AMQP keeps it with one second precision"""
+        timestamp = task.response.message.timestamp
+        return timestamp.timestamp() if timestamp else None
+
     async def fetch(self) -> Optional[Task]:
-        response = await self._rabbitmq.fetch(timeout=self.settings.request_timeout)
-        if not response:
-            return None
-        task_id = response.message.properties.message_id or str(uuid.uuid4())
-        return Task(task_id=task_id, traceparent=response.headers.get("traceparent"), response=response)
+        queues = self.settings.queues
+        if not queues:
+            response = await self._rabbitmq.fetch(timeout=self.settings.request_timeout)
+            return self._create_task(response) if response else None
+        # basic.get of the queues in turn, starting after the queue of the last message
+        for offset in range(len(queues)):
+            index = (self._fetch_cursor + offset) % len(queues)
+            response = await self._rabbitmq.fetch(
+                queue=queues[index], fail=False, timeout=self.settings.request_timeout
+            )
+            if response:
+                self._fetch_cursor = index + 1
+                return self._create_task(response)
+        return None
+
+    async def fetch_many(self, max_items: int, max_wait: float) -> List[Task]:
+        """Collect messages pushed by the consumer instead of a basic.get round-trip per message.
+        A message that arrives after max_wait is kept for the next call
+        """
+        if self._consumer is None:
+            self._consumer = self._rabbitmq.receive(manual_ack=True, queues=self.settings.queues)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait
+        tasks: List[Task] = []
+        while len(tasks) < max_items:
+            if self._next_response is None:
+                self._next_response = asyncio.ensure_future(anext(self._consumer))
+            done, _ = await asyncio.wait((self._next_response,), timeout=max(deadline - loop.time(), 0))
+            if not done:
+                break
+            next_response, self._next_response = self._next_response, None
+            try:
+                tasks.append(self._create_task(next_response.result()))
+            except StopAsyncIteration:
+                raise RuntimeError("RabbitMQ consumer stopped") from None
+        return tasks
+
+    async def _close_consumer(self):
+        if self._next_response is not None:
+            self._next_response.cancel()
+            with contextlib.suppress(asyncio.CancelledError, StopAsyncIteration):
+                await self._next_response
+            self._next_response = None
+        if self._consumer is not None:
+            await self._consumer.aclose()
+            self._consumer = None
 
     async def complete(self, task: Task, result: Optional[Any] = None):
         message = task.response.message
@@ -61,7 +188,40 @@ async def complete(self, task: Task, result: Optional[Any] = None):
         await task.response.message.ack()
 
     async def error(self, task: Task, error_message: str, error_details: Optional[str] = None):
-        await task.response.message.nack(requeue=False)
+        message = task.response.message
+        if not self.settings.retry_max_attempts or task.response.decode_failed:
+            # a retry does not fix a body that can not be decoded
+            await message.nack(requeue=False)
+            return
+        queue = task.response.queue or self.settings.get_queues()[0]
+        retry_queues = self._retry_queues[queue]
+        attempt = int(task.response.headers.get(RETRY_ATTEMPT_HEADER, 0))
+        if attempt < len(retry_queues):
+            routing_key, status = retry_queues[attempt], "retry"
+        else:
+            routing_key, status = self._parking_queues[queue], "parked"
+        headers = {key: value for key, value in task.response.headers.items() if key != "x-death"}
+        headers[RETRY_ATTEMPT_HEADER] = attempt + 1
+        headers[ERROR_MESSAGE_HEADER] = error_message[:1000]
+        try:
+            await self._rabbitmq.send_message(
+                message.body,
+                headers,
+                routing_key=routing_key,
+                content_type=message.content_type,
+                content_encoding=message.content_encoding,
+                priority=message.priority or 0,
+                message_id=message.message_id,
+                correlation_id=message.correlation_id,
+                reply_to=message.reply_to,
+            )
+        except Exception as exc:
+            logger.error(f"Error send task {task.task_id} to {routing_key}, requeue it: {exc}")
+            await message.nack(requeue=True)
+            return
+        await message.ack()
+        RABBITMQ_RETRY_COUNTER.labels(self.worker_name, status).inc()
+        logger.info(f"Task {task.task_id} attempt={attempt + 1} sent to {routing_key}")
 
 
 class HandlerSettings(base.BaseHandlerSettings):
@@ -0,0 +1,234 @@
+import asyncio
+import contextlib
+import dataclasses
+import logging
+import multiprocessing
+import multiprocessing.process
+import os
+import signal
+from typing import Any, AsyncContextManager, Callable, Dict, List, Optional, Type
+
+from prometheus_client import Counter, Gauge, multiprocess
+
+import async_utils
+
+from async_workers import base
+
+logger = logging.getLogger(__name__)
+
+DependenciesFactory = Callable[[], AsyncContextManager[Dict[str, Any]]]
+ProcessLifespan = Callable[[], AsyncContextManager[Any]]
+
+SUPERVISOR_PROCESS_GAUGE = Gauge(
+    "workers_supervisor_process", "Number of alive worker processes", ["worker_name"], multiprocess_mode="liveall"
+)
+SUPERVISOR_RESTART_COUNTER = Counter(
+    "workers_supervisor_restart", "Number of worker process restarts", ["worker_name"]
+)
+
+
+async def _serve_worker(
+    worker_cls: Type[base.TaskHandler],
+    dependencies_factory: DependenciesFactory,
+    drain_timeout: float,
+    process_lifespan: Optional[ProcessLifespan],
+) -> None:
+    loop = asyncio.get_running_loop()
+    terminate = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, terminate.set)
+    async with contextlib.AsyncExitStack() as stack:
+        if process_lifespan is not None:
+            await stack.enter_async_context(process_lifespan())
+        dependencies = await stack.enter_async_context(dependencies_factory())
+        stop_event = asyncio.Event()
+        worker = asyncio.create_task(
+            worker_cls.run_with_restarts(stop_event=stop_event, **dependencies),
+            name=f"WORKER::{worker_cls.get_worker_name()}",
+        )
+        terminating = asyncio.create_task(terminate.wait())
+        await asyncio.wait((worker, terminating), return_when=asyncio.FIRST_COMPLETED)
+        terminating.cancel()
+        if not terminate.is_set():
+            worker.result()
+        await base.stop_workers((worker,), stop_event, drain_timeout)
+
+
+def _run_worker_process(
+    worker_cls: Type[base.TaskHandler],
+    dependencies_factory: DependenciesFactory,
+    initializer: Optional[Callable[[], None]],
+    drain_timeout: float,
+    process_lifespan: Optional[ProcessLifespan] = None,
+) -> None:
+    # the parent process decides when to stop, e.g. on Ctrl+C in the terminal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer()
+    asyncio.run(_serve_worker(worker_cls, dependencies_factory, drain_timeout, process_lifespan))
+
+
+@dataclasses.dataclass
+class WorkerProcess:
+    worker_cls: Type[base.TaskHandler]
+    replica: int
+    settings: base.BaseHandlerSettings
+    process: Optional[multiprocessing.process.BaseProcess] = None
+    started_at: Optional[float] = None
+    restart_at: Optional[float] = None
+    # exits in a row without a healthy run of restart_reset_seconds
+    failures: int = 0
+
+    @property
+    def worker_name(self) -> str:
+        return self.worker_cls.get_worker_name()
+
+
+class Supervisor:
+    """Run workers in separate OS processes (replicas per worker), each with its own event loop.
+    process_lifespan (e.g. an event loop watchdog) is entered once in every process around its dependencies.
+    Crashed processes are restarted with the backoff of the worker settings (WorkerSettings.get_restart_delay),
+    after crash_loop_restarts exits in a row without a healthy run the worker is in crash loop
+    (task_handlers_crash_loop metric) like a worker restarted in the process.
+    On exit processes get SIGTERM and drain_timeout seconds to finish the tasks in progress,
+    they are killed after drain_timeout + kill_timeout seconds.
+
+    Metrics of the child processes are merged by prometheus_client multiprocess mode:
+    PROMETHEUS_MULTIPROC_DIR must be set for the whole service before it starts
+    """
+
+    def __init__(
+        self,
+        workers: Dict[Type[base.TaskHandler], int],
+        dependencies_factory: DependenciesFactory,
+        initializer: Optional[Callable[[], None]] = None,
+        drain_timeout: float = 30,
+        kill_timeout: float = 5,
+        check_interval_seconds: float = 1,
+        process_lifespan: Optional[ProcessLifespan] = None,
+    ):
+        self.processes: List[WorkerProcess] = []
+        for worker_cls, replicas in workers.items():
+            settings = worker_cls.load_settings()
+            self.processes.extend(
+                WorkerProcess(worker_cls=worker_cls, replica=replica, settings=settings) for replica in range(replicas)
+            )
+        self.dependencies_factory = dependencies_factory
+        self.initializer = initializer
+        self.drain_timeout = drain_timeout
+        self.kill_timeout = kill_timeout
+        self.check_interval_seconds = check_interval_seconds
+        self.process_lifespan = process_lifespan
+        self._mp_context = multiprocessing.get_context("spawn")
+        self._monitor: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "Supervisor":
+        if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+            logger.warning("PROMETHEUS_MULTIPROC_DIR is not set, metrics of worker processes will not be exported")
+        for worker_process in self.processes:
+            self._start(worker_process)
+        self._monitor = asyncio.create_task(self._monitor_processes(), name="WORKERS::supervisor")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._monitor
+            self._monitor = None
+        await self._stop_processes()
+
+    def _start(self, worker_process: WorkerProcess) -> None:
+        worker_name = worker_process.worker_name
+        with async_utils.LogExtraManager(worker_name=worker_name):
+            process = self._mp_context.Process(
+                target=_run_worker_process,
+                args=(
+                    worker_process.worker_cls,
+                    self.dependencies_factory,
+                    self.initializer,
+                    self.drain_timeout,
+                    self.process_lifespan,
+                ),
+                name=f"WORKER::{worker_name}::{worker_process.replica}",
+            )
+            process.start()
+            logger.info(f"Run worker {worker_name} replica={worker_process.replica} in process pid={process.pid}")
+        worker_process.process = process
+        worker_process.started_at = asyncio.get_running_loop().time()
+        worker_process.restart_at = None
+        SUPERVISOR_PROCESS_GAUGE.labels(worker_name).inc()
+
+    def _on_exit(self, worker_process: WorkerProcess) -> None:
+        process = worker_process.process
+        if process is None:
+            return
+        worker_process.process = None
+        SUPERVISOR_PROCESS_GAUGE.labels(worker_process.worker_name).dec()
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ and process.pid is not None:
+            multiprocess.mark_process_dead(process.pid)
+        process.close()
+
+    @staticmethod
+    def _ran_healthy(worker_process: WorkerProcess) -> bool:
+        """The process has been running for restart_reset_seconds, so its restart delay starts over"""
+        if worker_process.started_at is None:
+            return False
+        running = asyncio.get_running_loop().time() - worker_process.started_at
+        return running >= worker_process.settings.restart_reset_seconds
+
+    def _on_failure(self, worker_process: WorkerProcess, process: multiprocessing.process.BaseProcess) -> None:
+        settings = worker_process.settings
+        if self._ran_healthy(worker_process):
+            worker_process.failures = 0
+        worker_process.failures += 1
+        delay = settings.get_restart_delay(worker_process.failures)
+        logger.error(
+            f"Worker process {process.name} pid={process.pid} exited with code {process.exitcode} "
+            f"({worker_process.failures} in a row), restart after {round(delay, 3)} seconds"
+        )
+        self._on_exit(worker_process)
+        worker_process.restart_at = asyncio.get_running_loop().time() + delay
+        if worker_process.failures >= settings.crash_loop_restarts:
+            base._set_crash_loop(worker_process.worker_name, True)
+
+    def _on_healthy(self, worker_process: WorkerProcess) -> None:
+        worker_process.failures = 0
+        worker_name = worker_process.worker_name
+        # the worker is in crash loop while any of its replicas is
+        if not any(
+            p.failures >= p.settings.crash_loop_restarts for p in self.processes if p.worker_name == worker_name
+        ):
+            base._set_crash_loop(worker_name, False)
+
+    async def _monitor_processes(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.check_interval_seconds)
+            for worker_process in self.processes:
+                process = worker_process.process
+                if process is not None and not process.is_alive():
+                    self._on_failure(worker_process, process)
+                elif process is not None and worker_process.failures and self._ran_healthy(worker_process):
+                    self._on_healthy(worker_process)
+                if worker_process.restart_at is not None and worker_process.restart_at <= loop.time():
+                    SUPERVISOR_RESTART_COUNTER.labels(worker_process.worker_name).inc()
+                    self._start(worker_process)
+
+    async def _stop_processes(self) -> None:
+        running = [worker_process for worker_process in self.processes if worker_process.process is not None]
+        for worker_process in running:
+            if worker_process.process is not None:
+                worker_process.process.terminate()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.drain_timeout + self.kill_timeout
+        alive: List[WorkerProcess] = running
+        while alive and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+            alive = [p for p in alive if p.process is not None and p.process.is_alive()]
+        for worker_process in alive:
+            if worker_process.process is not None:
+                logger.warning(f"Kill worker process {worker_process.process.name} after shutdown timeout")
+                worker_process.process.kill()
+                await asyncio.to_thread(worker_process.process.join)
+        for worker_process in running:
+            self._on_exit(worker_process)
@@ -0,0 +1,221 @@
+"""Throughput and per-task overhead of base.TaskHandler.process_task with no-op tasks from the in-memory reader.
+
+    python -m tests_async_workers.benchmark --output benchmark.json
+    python -m tests_async_workers.benchmark --output new.json --baseline benchmark.json
+
+With --baseline the exit code is 1 if tasks/sec of any scenario dropped by more than --max-regression
+"""
+
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+import datetime
+import itertools
+import json
+import logging
+import os
+import pathlib
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+import async_workers.memory
+from tests_async_workers import conftest
+
+
+@dataclasses.dataclass
+class Scenario:
+    max_concurrency: int
+    error_rate: float
+    task_max_time_seconds: float
+    batch_size: int = 1
+
+    @property
+    def name(self) -> str:
+        return (
+            f"concurrency={self.max_concurrency} error_rate={self.error_rate} "
+            f"timeout={self.task_max_time_seconds} batch_size={self.batch_size}"
+        )
+
+
+@dataclasses.dataclass
+class Result:
+    scenario: str
+    tasks: int
+    errors: int
+    duration_seconds: float
+    tasks_per_second: float
+    overhead_p50_us: float
+    overhead_p99_us: float
+    overhead_mean_us: float
+
+
+class Worker(conftest.Worker):
+    """No-op handler: the measured time of process_task is the framework overhead"""
+
+    WORKER_NAME = "benchmark-worker"
+
+    def __init__(self, settings: async_workers.memory.HandlerSettings, task_reader: async_workers.memory.TaskReader):
+        super().__init__(settings, task_reader)
+        self.overheads: List[float] = []
+
+    async def process_task(self, task: async_workers.memory.Task) -> Any:
+        start = time.perf_counter()
+        try:
+            return await super().process_task(task)
+        finally:
+            self.overheads.append(time.perf_counter() - start)
+
+    async def process_batch(self, tasks: List[async_workers.memory.Task]) -> None:
+        start = time.perf_counter()
+        try:
+            return await super().process_batch(tasks)
+        finally:
+            self.overheads.extend([(time.perf_counter() - start) / len(tasks)] * len(tasks))
+
+    async def _process_task(self, task: async_workers.memory.Task) -> Any:
+        if task.payload:
+            raise ValueError("benchmark error")
+
+
+def _percentile(values: List[float], percent: int) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1] if len(values) > 1 else values[0]
+
+
+async def run_scenario(scenario: Scenario, tasks: int, seed: int) -> Result:
+    settings = async_workers.memory.HandlerSettings(
+        WORKER_MAX_CONCURRENCY=scenario.max_concurrency,
+        WORKER_TASK_MAX_TIME_SECONDS=scenario.task_max_time_seconds,
+        WORKER_BATCH_SIZE=scenario.batch_size,
+        WORKER_BATCH_MAX_WAIT_SECONDS=0,
+    )
+    worker = await Worker.initialization(settings)
+    rnd = random.Random(seed)
+    for _ in range(tasks):
+        worker.task_reader.put(rnd.random() < scenario.error_rate)
+    start = time.perf_counter()
+    async with worker:
+        running = asyncio.create_task(worker.run())
+        await worker.task_reader.join()
+        duration = time.perf_counter() - start
+        worker.stop_event.set()
+        await running
+    overheads = worker.overheads
+    return Result(
+        scenario=scenario.name,
+        tasks=tasks,
+        errors=len(worker.task_reader.errors),
+        duration_seconds=round(duration, 6),
+        tasks_per_second=round(tasks / duration, 1),
+        overhead_p50_us=round(_percentile(overheads, 50) * 1e6, 2),
+        overhead_p99_us=round(_percentile(overheads, 99) * 1e6, 2),
+        overhead_mean_us=round(statistics.fmean(overheads) * 1e6, 2),
+    )
+
+
+def scenarios(
+    concurrency: List[int], error_rates: List[float], timeouts: List[float], batch_sizes: List[int]
+) -> List[Scenario]:
+    return [
+        Scenario(max_concurrency=c, error_rate=e, task_max_time_seconds=t, batch_size=b)
+        for c, e, t, b in itertools.product(concurrency, error_rates, timeouts, batch_sizes)
+    ]
+
+
+async def run(selected: List[Scenario], tasks: int, seed: int) -> List[Result]:
+    # warm up imports, metric label children and the event loop
+    await run_scenario(selected[0], min(tasks, 1000), seed)
+    results = []
+    for scenario in selected:
+        result = await run_scenario(scenario, tasks, seed)
+        print(
+            f"{result.scenario:<60} {result.tasks_per_second:>10.1f} tasks/s "
+            f"p50={result.overhead_p50_us:.1f}us p99={result.overhead_p99_us:.1f}us",
+            file=sys.stderr,
+        )
+        results.append(result)
+    return results
+
+
+def find_regressions(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], max_regression: float
+) -> List[str]:
+    previous = {result["scenario"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        if result["scenario"] not in previous:
+            continue
+        before = previous[result["scenario"]]["tasks_per_second"]
+        if result["tasks_per_second"] < before * (1 - max_regression):
+            regressions.append(f"{result['scenario']}: {before} -> {result['tasks_per_second']} tasks/s")
+    return regressions
+
+
+def _floats(value: str) -> List[float]:
+    return [float(item) for item in value.split(",")]
+
+
+def _ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+@contextlib.contextmanager
+def _log_to(stream: TextIO, level: str) -> Iterator[None]:
+    """Format the records of the level to the stream, the handler is removed on exit"""
+    root = logging.getLogger()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    previous_level = root.level
+    root.addHandler(handler)
+    root.setLevel(level)
+    try:
+        yield
+    finally:
+        root.removeHandler(handler)
+        root.setLevel(previous_level)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=5000, help="tasks per scenario")
+    parser.add_argument("--concurrency", type=_ints, default=[1, 10, 100])
+    parser.add_argument("--error-rates", type=_floats, default=[0, 0.1])
+    parser.add_argument("--timeouts", type=_floats, default=[0, 900], help="0 disables asyncio.wait_for")
+    parser.add_argument("--batch-sizes", type=_ints, default=[1])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--log-level", default="INFO", help="logs are formatted and written to os.devnull to count their cost"
+    )
+    parser.add_argument("--output", type=pathlib.Path, help="write results as JSON")
+    parser.add_argument("--baseline", type=pathlib.Path, help="JSON results of a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed tasks/sec drop, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    selected = scenarios(args.concurrency, args.error_rates, args.timeouts, args.batch_sizes)
+    with open(os.devnull, "w") as devnull:
+        with _log_to(devnull, args.log_level):
+            results = [dataclasses.asdict(result) for result in asyncio.run(run(selected, args.tasks, args.seed))]
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "tasks": args.tasks,
+        "log_level": args.log_level,
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        regressions = find_regressions(results, json.loads(args.baseline.read_text())["results"], args.max_regression)
+        for regression in regressions:
+            print(f"Regression {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
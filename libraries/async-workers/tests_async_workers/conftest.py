@@ -0,0 +1,89 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional, Type, TypeVar
+
+import pytest
+
+import async_workers.memory
+
+Process = Callable[[Any], Awaitable[Any]]
+WorkerObj = TypeVar("WorkerObj", bound="Worker")
+
+
+class Worker(async_workers.memory.TaskHandler[async_workers.memory.HandlerSettings]):
+    """Worker of the in-memory reader for the tests and the benchmark, payloads are handled by process"""
+
+    WORKER_NAME = "test-worker"
+
+    def __init__(
+        self,
+        settings: async_workers.memory.HandlerSettings,
+        task_reader: async_workers.memory.TaskReader,
+        process: Optional[Process] = None,
+        **kwargs,
+    ):
+        super().__init__(settings, task_reader, **kwargs)
+        self.process = process
+
+    @classmethod
+    def load_settings(cls) -> async_workers.memory.HandlerSettings:
+        return async_workers.memory.HandlerSettings()
+
+    @classmethod
+    async def initialization(cls: Type[WorkerObj], settings, **kwargs) -> WorkerObj:
+        return cls(settings, async_workers.memory.TaskReader(async_workers.memory.TaskReaderSettings()), **kwargs)
+
+    @classmethod
+    def get_worker_name(cls) -> str:
+        return cls.WORKER_NAME
+
+    async def _process_task(self, task: async_workers.memory.Task) -> Any:
+        return await self.process(task.payload) if self.process else task.payload
+
+
+class Tracker:
+    """Handles payloads until released, counts the tasks in progress"""
+
+    def __init__(self) -> None:
+        self.in_progress = 0
+        self.max_in_progress = 0
+        self.released = asyncio.Event()
+
+    async def __call__(self, payload: Any) -> Any:
+        self.in_progress += 1
+        self.max_in_progress = max(self.max_in_progress, self.in_progress)
+        try:
+            await self.released.wait()
+        finally:
+            self.in_progress -= 1
+        return payload
+
+    async def wait_in_progress(self, count: int) -> None:
+        async with asyncio.timeout(1):
+            while self.in_progress < count:
+                await asyncio.sleep(0.001)
+
+
+CreateWorker = Callable[..., Awaitable[Worker]]
+
+
+@pytest.fixture
+def create_worker() -> CreateWorker:
+    """Worker with the settings (HandlerSettings by default) and process, kwargs are passed to the handler"""
+
+    async def create(
+        process: Optional[Process] = None, settings: Optional[async_workers.memory.HandlerSettings] = None, **kwargs
+    ) -> Worker:
+        return await Worker.initialization(settings or Worker.load_settings(), process=process, **kwargs)
+
+    return create
+
+
+async def run_tasks(worker: Worker, *tasks: tuple) -> None:
+    """Put the (task_id, payload) tasks, run the worker until they are handled and stop it"""
+    for task_id, payload in tasks:
+        worker.task_reader.put(payload, task_id=task_id)
+    async with worker:
+        running = asyncio.create_task(worker.run())
+        await worker.task_reader.join()
+        worker.stop_event.set()
+        await running
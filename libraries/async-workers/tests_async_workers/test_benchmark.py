@@ -0,0 +1,32 @@
+import json
+import pathlib
+
+from tests_async_workers import benchmark
+
+
+async def test_run_scenario():
+    scenario = benchmark.Scenario(max_concurrency=10, error_rate=0.5, task_max_time_seconds=1)
+    result = await benchmark.run_scenario(scenario, tasks=100, seed=0)
+    assert result.tasks == 100
+    assert 0 < result.errors < 100
+    assert result.tasks_per_second > 0
+    assert result.overhead_p50_us <= result.overhead_p99_us
+
+
+async def test_run_scenario_batch():
+    scenario = benchmark.Scenario(max_concurrency=2, error_rate=0, task_max_time_seconds=0, batch_size=10)
+    result = await benchmark.run_scenario(scenario, tasks=100, seed=0)
+    assert result.errors == 0
+
+
+def test_main_regression(tmp_path: pathlib.Path):
+    output = tmp_path / "benchmark.json"
+    argv = ["--tasks", "50", "--concurrency", "1", "--error-rates", "0", "--timeouts", "0", "--output", str(output)]
+    assert benchmark.main(argv) == 0
+    report = json.loads(output.read_text())
+    assert len(report["results"]) == 1
+
+    report["results"][0]["tasks_per_second"] *= 100
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps(report))
+    assert benchmark.main([*argv, "--baseline", str(baseline)]) == 1
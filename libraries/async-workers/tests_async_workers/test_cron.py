@@ -0,0 +1,55 @@
+import datetime
+
+import pytest
+
+from async_workers import cron
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def create_reader(policy: str) -> cron.TaskReader:
+    settings = cron.TaskReaderSettings(
+        cron_mask="* * * * * */10", CRON_MISFIRE_POLICY=policy, CRON_MISFIRE_GRACE_SECONDS=1
+    )
+    reader = cron.TaskReader(settings)
+    reader._last_tick = START
+    return reader
+
+
+def seconds(value: float) -> datetime.datetime:
+    return START + datetime.timedelta(seconds=value)
+
+
+@pytest.mark.parametrize(
+    "policy, now, expected, last_tick",
+    [
+        ("skip", 10.5, 10, 10),
+        ("skip", 35, None, 30),
+        ("skip", 30.5, 30, 30),
+        ("coalesce", 35, 30, 30),
+        ("catch_up", 35, 10, 10),
+    ],
+)
+def test_misfire_policy(policy: str, now: float, expected: float | None, last_tick: float):
+    reader = create_reader(policy)
+    due = reader._due_ticks(seconds(now))
+    selected = reader._select_tick(due, seconds(now))
+    assert selected == (None if expected is None else seconds(expected))
+    assert reader._last_tick == seconds(last_tick)
+
+
+def test_catch_up_runs_every_missed_tick():
+    reader = create_reader("catch_up")
+    now = seconds(35)
+    ticks = []
+    while due := reader._due_ticks(now):
+        ticks.append(reader._select_tick(due, now))
+    assert ticks == [seconds(10), seconds(20), seconds(30)]
+    assert reader._seconds_to_tick(now) == 5
+
+
+def test_late_tick_runs_by_default():
+    reader = cron.TaskReader(cron.TaskReaderSettings(cron_mask="* * * * * */10"))
+    reader._last_tick = START
+    now = seconds(13)
+    assert reader._select_tick(reader._due_ticks(now), now) == seconds(10)
@@ -0,0 +1,60 @@
+import asyncio
+from typing import Any, List
+
+import pytest
+
+import async_workers.memory
+from async_workers import dedup
+from tests_async_workers.conftest import CreateWorker, run_tasks
+
+
+class Doubler:
+    def __init__(self) -> None:
+        self.processed: List[Any] = []
+
+    async def __call__(self, payload: Any) -> Any:
+        if payload is None:
+            raise ValueError("no payload")
+        self.processed.append(payload)
+        return payload * 2
+
+
+async def test_memory_dedup_store_lru():
+    store = dedup.MemoryDedupStore(max_size=2, ttl_seconds=60)
+    await store.set("worker", "1", "a")
+    await store.set("worker", "2", "b")
+    assert await store.get("worker", "1") == dedup.Record("a")
+    await store.set("worker", "3", "c")
+    assert await store.get("worker", "2") is None
+    assert await store.get("worker", "1") == dedup.Record("a")
+    assert await store.get("other-worker", "1") is None
+    assert len(store) == 2
+
+
+async def test_memory_dedup_store_ttl():
+    store = dedup.MemoryDedupStore(max_size=2, ttl_seconds=0.01)
+    await store.set("worker", "1", None)
+    assert await store.get("worker", "1") == dedup.Record(None)
+    await asyncio.sleep(0.02)
+    assert await store.get("worker", "1") is None
+
+
+@pytest.mark.parametrize("batch_size", [1, 2])
+async def test_completed_tasks_are_replayed(create_worker: CreateWorker, batch_size: int):
+    settings = async_workers.memory.HandlerSettings(WORKER_DEDUP_CACHE_SIZE=10, WORKER_BATCH_SIZE=batch_size)
+    process = Doubler()
+    worker = await create_worker(process, settings)
+    await run_tasks(worker, ("1", 1), ("2", None), ("1", 10), ("2", 2), ("3", 3))
+    assert process.processed == [1, 2, 3]
+    assert worker.task_reader.results == {"1": 2, "2": 4, "3": 6}
+
+
+async def test_shared_store(create_worker: CreateWorker):
+    store = dedup.MemoryDedupStore(max_size=10, ttl_seconds=60)
+    process = Doubler()
+    first = await create_worker(Doubler(), dedup_store=store)
+    second = await create_worker(process, dedup_store=store)
+    await run_tasks(first, ("1", 1))
+    await run_tasks(second, ("1", 1), ("2", 2))
+    assert process.processed == [2]
+    assert second.task_reader.results == {"1": 2, "2": 4}
@@ -0,0 +1,60 @@
+import asyncio
+import types
+from typing import List, Type
+
+import async_workers
+import async_workers.memory
+from async_workers import base
+from tests_async_workers import conftest
+
+
+async def test_in_flight_tasks_finish_after_stop(create_worker: conftest.CreateWorker):
+    tracker = conftest.Tracker()
+    worker = await create_worker(tracker, async_workers.memory.HandlerSettings(WORKER_MAX_CONCURRENCY=2))
+    reader = worker.task_reader
+    for index in range(5):
+        reader.put(index, task_id=str(index))
+    async with worker:
+        running = asyncio.create_task(worker.run())
+        await tracker.wait_in_progress(2)
+        stopping = asyncio.create_task(base.stop_workers([running], worker.stop_event, timeout=1))
+        await asyncio.sleep(0.01)
+        tracker.released.set()
+        await stopping
+    assert running.done() and not running.cancelled()
+    # the tasks in progress are acked, no new task is fetched after stop
+    assert reader.results == {"0": 0, "1": 1}
+    assert reader._queue.qsize() == 3
+
+
+class DrainWorker(conftest.Worker):
+    WORKER_NAME = "test-drain-worker"
+    instances: List[conftest.Worker] = []
+
+    @classmethod
+    def load_settings(cls) -> async_workers.memory.HandlerSettings:
+        return async_workers.memory.HandlerSettings(WORKER_MAX_CONCURRENCY=2)
+
+    @classmethod
+    async def initialization(cls: Type["DrainWorker"], settings, **kwargs) -> "DrainWorker":
+        worker = await super().initialization(settings, **kwargs)
+        for index in range(3):
+            worker.task_reader.put(index, task_id=str(index))
+        cls.instances.append(worker)
+        return worker
+
+
+async def test_drain_timeout_cancels_tasks():
+    tracker = conftest.Tracker()
+    cancelled = base.TASK_HANDLERS_DRAIN_COUNTER.labels(DrainWorker.WORKER_NAME, "cancelled")
+    cancelled_before = cancelled._value.get()
+    module = types.SimpleNamespace(__all__=("drain",), drain=types.SimpleNamespace(Worker=DrainWorker))
+    lifespan = async_workers.WorkersLifespan(module, drain_timeout=0.05, process=tracker)
+    await lifespan.__aenter__()
+    await tracker.wait_in_progress(2)
+    async with asyncio.timeout(1):
+        await lifespan.__aexit__(None, None, None)
+    assert all(worker.done() for worker in lifespan.started_workers)
+    assert tracker.in_progress == 0
+    assert not DrainWorker.instances[-1].task_reader.results
+    assert cancelled._value.get() == cancelled_before + 2
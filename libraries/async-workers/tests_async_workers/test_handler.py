@@ -0,0 +1,185 @@
+import asyncio
+from typing import Any, Optional
+
+import pytest
+import pytest_mock
+from prometheus_client import REGISTRY
+
+import async_rabbitmq
+
+import async_workers.memory
+import async_workers.rabbitmq
+from async_workers import base
+from tests_async_workers import conftest
+from tests_async_workers.conftest import CreateWorker, Tracker
+
+
+class BlockingReader(async_workers.memory.TaskReader):
+    """Fetch waits for a task forever"""
+
+    def __init__(self) -> None:
+        super().__init__(async_workers.memory.TaskReaderSettings())
+        self.fetch_started = asyncio.Event()
+        self.fetch_cancelled = False
+
+    async def fetch(self) -> Optional[async_workers.memory.Task]:
+        self.fetch_started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.fetch_cancelled = True
+            raise
+        return None
+
+
+class FailingAckReader(async_workers.memory.TaskReader):
+    """Complete of the task "0" fails, e.g. the broker connection is lost"""
+
+    def __init__(self) -> None:
+        super().__init__(async_workers.memory.TaskReaderSettings())
+
+    async def complete(self, task: async_workers.memory.Task, result: Optional[Any] = None):
+        if task.task_id == "0":
+            self._queue.task_done()
+            raise ConnectionError("ack failed")
+        await super().complete(task, result)
+
+
+async def test_failed_ack_does_not_strand_the_batch(create_worker: CreateWorker):
+    settings = async_workers.memory.HandlerSettings(
+        WORKER_MAX_CONCURRENCY=2, WORKER_BATCH_SIZE=4, WORKER_BATCH_MAX_WAIT_SECONDS=0.05
+    )
+    worker = await create_worker(settings=settings)
+    reader = worker.task_reader = FailingAckReader()
+    for index in range(8):
+        reader.put(index, task_id=str(index))
+    async with worker:
+        running = asyncio.create_task(worker.run())
+        await asyncio.wait_for(reader.join(), 1)
+        worker.stop_event.set()
+        await asyncio.wait_for(running, 1)
+    assert reader.results == {str(index): index for index in range(1, 8)}
+
+
+async def test_concurrency_is_bounded(create_worker: CreateWorker):
+    tracker = Tracker()
+    settings = async_workers.memory.HandlerSettings(WORKER_MAX_CONCURRENCY=3, WORKER_BATCH_SIZE=2)
+    worker = await create_worker(tracker, settings)
+    for index in range(10):
+        worker.task_reader.put(index)
+    async with worker:
+        running = asyncio.create_task(worker.run())
+        await asyncio.sleep(0.05)
+        assert tracker.in_progress == 6
+        # the reader is not asked for tasks while every slot is busy
+        assert worker.task_reader._queue.qsize() == 4
+        assert worker.task_reader.max_in_flight == 6
+        tracker.released.set()
+        await worker.task_reader.join()
+        worker.stop_event.set()
+        await asyncio.wait_for(running, 1)
+    assert tracker.max_in_progress == 6
+    assert len(worker.task_reader.results) == 10
+
+
+async def test_stop_during_pending_fetch(create_worker: CreateWorker):
+    worker = await create_worker(settings=async_workers.memory.HandlerSettings(WORKER_MAX_CONCURRENCY=2))
+    reader = worker.task_reader = BlockingReader()
+    async with worker:
+        running = asyncio.create_task(worker.run())
+        await asyncio.wait_for(reader.fetch_started.wait(), 1)
+        worker.stop_event.set()
+        await asyncio.wait_for(running, 1)
+    assert reader.fetch_cancelled
+
+
+async def test_rabbitmq_prefetch_follows_free_slots(mocker: pytest_mock.MockerFixture):
+    reader = async_workers.rabbitmq.TaskReader(async_workers.rabbitmq.TaskReaderSettings())
+    client = reader._rabbitmq = mocker.AsyncMock()
+    reader.max_in_flight = 20
+    await reader.__aenter__()
+    client.set_qos.assert_awaited_once_with(20)
+
+    settings = async_workers.rabbitmq.TaskReaderSettings(
+        rabbitmq=async_rabbitmq.config.Settings(RABBITMQ_PREFETCH_COUNT=5)
+    )
+    reader = async_workers.rabbitmq.TaskReader(settings)
+    client = reader._rabbitmq = mocker.AsyncMock()
+    reader.max_in_flight = 20
+    await reader.__aenter__()
+    client.set_qos.assert_not_awaited()
+
+
+def test_backoff_idle_strategy():
+    strategy = base.BackoffIdleStrategy(0.1, 0.5, multiplier=2, jitter=0)
+    assert [strategy.next_delay() for _ in range(5)] == pytest.approx([0.1, 0.2, 0.4, 0.5, 0.5])
+    strategy.reset()
+    assert strategy.next_delay() == pytest.approx(0.1)
+
+    strategy = base.BackoffIdleStrategy(1, 100, multiplier=1, jitter=0.1)
+    assert all(0.9 <= strategy.next_delay() <= 1.1 for _ in range(100))
+
+
+@pytest.mark.parametrize(
+    "sleep_max_seconds, strategy_cls",
+    [(None, base.FixedIdleStrategy), (0.1, base.FixedIdleStrategy), (5, base.BackoffIdleStrategy)],
+)
+def test_create_idle_strategy(sleep_max_seconds: Optional[float], strategy_cls: type):
+    settings = async_workers.memory.TaskReaderSettings(
+        TASK_READER_SLEEP_SECONDS=0.1, TASK_READER_SLEEP_MAX_SECONDS=sleep_max_seconds
+    )
+    assert type(base.create_idle_strategy(settings)) is strategy_cls
+
+
+async def test_idle_backoff_resets_after_task():
+    strategy = base.BackoffIdleStrategy(0.001, 0.01, multiplier=2, jitter=0)
+    reader = async_workers.memory.TaskReader(async_workers.memory.TaskReaderSettings(), idle_strategy=strategy)
+    for _ in range(3):
+        await reader.idle()
+    assert strategy._current_delay == pytest.approx(0.008)
+
+    reader.put("payload")
+    received = reader.receive()
+    assert (await anext(received)).payload == "payload"
+    assert strategy._current_delay == pytest.approx(0.001)
+    await received.aclose()
+
+
+async def test_wake_up_interrupts_idle():
+    strategy = base.BackoffIdleStrategy(10, 60, multiplier=2, jitter=0)
+    reader = async_workers.memory.TaskReader(async_workers.memory.TaskReaderSettings(), idle_strategy=strategy)
+    idle = asyncio.create_task(reader.idle())
+    await asyncio.sleep(0.01)
+    assert not idle.done()
+    reader.wake_up()
+    await asyncio.wait_for(idle, 1)
+    # the reader is woken up for a new task, so the next delay starts over
+    assert strategy._current_delay == 10
+
+
+class StagesWorker(conftest.Worker):
+    WORKER_NAME = "test-stages-worker"
+
+
+async def fail_on_error(payload: Any) -> Any:
+    if payload == "error":
+        raise ValueError(payload)
+    return payload
+
+
+async def test_stage_metrics():
+    worker = await StagesWorker.initialization(StagesWorker.load_settings(), process=fail_on_error)
+    await conftest.run_tasks(worker, ("1", "ok"), ("2", "ok"), ("3", "error"))
+
+    def count(stage: str) -> Optional[float]:
+        labels = {"worker_name": "test-stages-worker", "stage": stage}
+        return REGISTRY.get_sample_value("task_handlers_stage_duration_seconds_count", labels)
+
+    assert {stage: count(stage) for stage in ("queue_wait", "fetch", "handle", "complete", "error")} == {
+        "queue_wait": 3,
+        "fetch": 3,
+        "handle": 3,
+        "complete": 2,
+        "error": 1,
+    }
+    assert count("unknown") is None
@@ -0,0 +1,58 @@
+import asyncio
+
+from async_workers import base
+
+
+def test_limit_grows_while_healthy():
+    limiter = base.AdaptiveLimiter("test-limiter", min_limit=1, max_limit=5)
+    for _ in range(100):
+        limiter.in_flight = int(limiter.limit)
+        limiter.observe(0.01)
+    assert limiter.limit == 5
+
+
+def test_limit_grows_from_half_utilization():
+    limiter = base.AdaptiveLimiter("test-limiter", min_limit=1, max_limit=20)
+    limiter.limit = 10
+    # in_flight includes the finished task, the limit grows from half of it in use
+    limiter.in_flight = 4
+    limiter.observe(0.01)
+    assert limiter.limit == 10
+    limiter.in_flight = 5
+    limiter.observe(0.01)
+    assert limiter.limit == 10.1
+
+
+def test_limit_decreases_once_per_window():
+    limiter = base.AdaptiveLimiter("test-limiter", min_limit=2, max_limit=100, backoff_ratio=0.5)
+    limiter.limit = 40
+    limiter.observe(0.01, error=True)
+    assert limiter.limit == 20
+    for _ in range(19):
+        limiter.observe(0.01, error=True)
+    assert limiter.limit == 20
+    limiter.observe(0.01, error=True)
+    assert limiter.limit == 10
+    for _ in range(100):
+        limiter.observe(0.01, error=True)
+    assert limiter.limit == 2
+
+
+def test_limit_decreases_on_latency():
+    limiter = base.AdaptiveLimiter("test-limiter", min_limit=1, max_limit=100, latency_tolerance=2)
+    limiter.limit = 50
+    limiter.observe(0.01)
+    for _ in range(20):
+        limiter.observe(0.1)
+    assert limiter.limit < 50
+
+
+async def test_acquire_waits_for_release():
+    limiter = base.AdaptiveLimiter("test-limiter", min_limit=1, max_limit=1)
+    await limiter.acquire()
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    limiter.release()
+    await asyncio.wait_for(waiting, 1)
+    assert limiter.in_flight == 1
@@ -0,0 +1,241 @@
+import contextlib
+import datetime
+import types
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+import aio_pika
+import pytest
+import sqlalchemy as sa
+from opentelemetry import trace
+from sqlalchemy.dialects import postgresql
+
+import async_rabbitmq
+
+import async_workers.outbox
+import async_workers.postgres
+
+TABLE = async_workers.outbox.create_outbox_table(sa.MetaData())
+PRODUCER_TRACEPARENT = f"00-{1:032x}-{2:016x}-01"
+
+
+class Result:
+    def __init__(self, values: List[Any]) -> None:
+        self.rowcount = len(values)
+        self.values = values
+
+    def scalars(self) -> "Result":
+        return self
+
+    def all(self) -> List[Any]:
+        return self.values
+
+
+class Database:
+    """Outbox table in memory, runs the insert, claim, fail expired, delete and release statements of the outbox.
+    The retry delay is not modelled: a released row is visible at once
+    """
+
+    def __init__(self) -> None:
+        self.rows: Dict[int, Dict[str, Any]] = {}
+        self.deleted: List[int] = []
+        self.released: List[int] = []
+
+    async def execute(self, stmt: Any, values: Optional[List[Dict[str, Any]]] = None) -> Result:
+        params = stmt.compile(dialect=postgresql.dialect()).params
+        if isinstance(stmt, sa.Insert):
+            return Result([self._insert(value) for value in values or []])
+        if isinstance(stmt, sa.Delete):
+            ids = self._leased(params["id_1"], params["lease_id_1"])
+            for id_ in ids:
+                del self.rows[id_]
+            self.deleted.extend(ids)
+            return Result(ids)
+        if "id_1" in params:
+            return Result(self._release(params["id_1"], params["lease_id_1"], params["attempts_1"]))
+        if "param_1" in params:
+            return Result(self._claim(params["lease_id"], params["attempts_2"], params["param_1"], params["now_1"]))
+        return Result(self._fail_expired(params["attempts_1"], params["error_message"]))
+
+    def _insert(self, value: Dict[str, Any]) -> int:
+        id_ = len(self.rows) + len(self.deleted) + 1
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.rows[id_] = dict(
+            value,
+            id=id_,
+            created_at=now,
+            visible_at=now,
+            lease_id=None,
+            attempts=0,
+            failed_at=None,
+            error_message=None,
+        )
+        return id_
+
+    def _leased(self, ids: Iterable[int], lease_id: uuid.UUID) -> List[int]:
+        return [id_ for id_ in ids if id_ in self.rows and self.rows[id_]["lease_id"] == lease_id]
+
+    def _visible(self) -> List[Dict[str, Any]]:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return [row for row in self.rows.values() if row["failed_at"] is None and row["visible_at"] <= now]
+
+    def _claim(
+        self, lease_id: uuid.UUID, max_attempts: int, limit: int, visibility_timeout: datetime.timedelta
+    ) -> List[Any]:
+        visible = [row for row in self._visible() if row["attempts"] < max_attempts][:limit]
+        visible_at = datetime.datetime.now(datetime.timezone.utc) + visibility_timeout
+        for row in visible:
+            row.update(visible_at=visible_at, lease_id=lease_id, attempts=row["attempts"] + 1)
+        return [types.SimpleNamespace(**row) for row in visible]
+
+    def _fail_expired(self, max_attempts: int, error_message: str) -> List[int]:
+        expired = [row for row in self._visible() if row["attempts"] >= max_attempts]
+        for row in expired:
+            row.update(failed_at=datetime.datetime.now(), lease_id=None, error_message=error_message)
+        return [row["id"] for row in expired]
+
+    def _release(self, ids: List[int], lease_id: uuid.UUID, max_attempts: int) -> List[Any]:
+        released = self._leased(ids, lease_id)
+        for id_ in released:
+            row = self.rows[id_]
+            row.update(
+                visible_at=datetime.datetime.now(datetime.timezone.utc),
+                lease_id=None,
+                failed_at=datetime.datetime.now() if row["attempts"] >= max_attempts else None,
+            )
+        self.released.extend(released)
+        return [self.rows[id_]["failed_at"] for id_ in released]
+
+
+class Storage:
+    def __init__(self, database: Database) -> None:
+        self.database = database
+
+    @property
+    def session_maker(self) -> "Storage":
+        return self
+
+    @contextlib.asynccontextmanager
+    async def begin(self) -> AsyncIterator[Database]:
+        yield self.database
+
+
+class Rabbitmq:
+    """Confirms the messages except the ones with a body from nacked"""
+
+    def __init__(self, *nacked: bytes) -> None:
+        self.nacked = set(nacked)
+        self.published: List[aio_pika.Message] = []
+
+    async def send_messages(
+        self, messages: Iterable[async_rabbitmq.client.OutgoingMessage]
+    ) -> List[Optional[Exception]]:
+        results: List[Optional[Exception]] = []
+        for item in messages:
+            properties = dict(item.properties or {})
+            self.published.append(async_rabbitmq.client.Client.build_message(item.data, item.headers, **properties))
+            results.append(ConnectionError("nack") if item.data in self.nacked else None)
+        return results
+
+
+def span(trace_id: int) -> Any:
+    context = trace.SpanContext(trace_id, 2, is_remote=False, trace_flags=trace.TraceFlags(1))
+    return trace.use_span(trace.NonRecordingSpan(context))
+
+
+def create_reader(database: Database, rabbitmq: Rabbitmq, **settings: Any) -> async_workers.outbox.TaskReader:
+    reader_settings = async_workers.outbox.TaskReaderSettings(OUTBOX_NOTIFY_CHANNEL=None, **settings)
+    reader = async_workers.outbox.TaskReader(reader_settings, Storage(database), TABLE)  # type: ignore[arg-type]
+    reader._rabbitmq = rabbitmq  # type: ignore[assignment]
+    return reader
+
+
+async def add(database: Database, *bodies: bytes) -> None:
+    messages = [async_rabbitmq.client.OutgoingMessage(body, {"key": "value"}, "queue") for body in bodies]
+    with span(1):
+        await async_workers.outbox.add_messages(database, TABLE, messages, notify_channel=None)  # type: ignore
+
+
+async def relay(reader: async_workers.outbox.TaskReader) -> bool:
+    """Publish one batch as the relay worker does, False if there are no messages"""
+    task = await reader.fetch()
+    if task is None:
+        return False
+    with span(3):
+        await reader.complete(task, await reader.publish(task))
+    return True
+
+
+async def test_partial_confirm():
+    database = Database()
+    await add(database, b"1", b"2", b"3", b"4")
+    rabbitmq = Rabbitmq(b"2", b"4")
+    reader = create_reader(database, rabbitmq)
+
+    assert await relay(reader)
+    assert database.deleted == [1, 3]
+    assert database.released == [2, 4]
+    assert {id_: row["lease_id"] for id_, row in database.rows.items()} == {2: None, 4: None}
+    # the message keeps the trace of add_messages, not the one of the relay
+    assert [message.headers for message in rabbitmq.published] == [
+        {"key": "value", "traceparent": PRODUCER_TRACEPARENT}
+    ] * 4
+
+    rabbitmq.nacked.clear()
+    assert await relay(reader)
+    assert database.deleted == [1, 3, 2, 4]
+    assert not database.rows
+    assert not await relay(reader)
+
+
+async def test_expired_lease(caplog: pytest.LogCaptureFixture):
+    database = Database()
+    await add(database, b"1", b"2")
+    reader = create_reader(database, Rabbitmq(b"2"))
+    task = await reader.fetch()
+    assert task is not None
+    # the lease has expired and another relay claimed the rows
+    for row in database.rows.values():
+        row["lease_id"] = uuid.uuid4()
+
+    await reader.complete(task, await reader.publish(task))
+    assert not database.deleted and not database.released
+    assert "deleted 0 of 1 published messages" in caplog.text
+
+
+async def test_max_attempts():
+    database = Database()
+    await add(database, b"1")
+    reader = create_reader(database, Rabbitmq(b"1"), OUTBOX_MAX_ATTEMPTS=2)
+
+    assert await relay(reader)
+    assert database.rows[1]["failed_at"] is None
+    assert await relay(reader)
+    assert database.rows[1]["failed_at"] is not None
+    assert not await relay(reader)
+
+
+async def test_expired_lease_max_attempts(caplog: pytest.LogCaptureFixture):
+    database = Database()
+    await add(database, b"1")
+    reader = create_reader(database, Rabbitmq(), OUTBOX_MAX_ATTEMPTS=2)
+
+    for _ in range(2):
+        # the relay dies during the batch and its lease expires
+        assert await reader.fetch() is not None
+        database.rows[1]["visible_at"] -= datetime.timedelta(seconds=60)
+
+    assert await reader.fetch() is None
+    row = database.rows[1]
+    assert row["attempts"] == 2 and row["failed_at"] is not None and row["lease_id"] is None
+    assert row["error_message"] == async_workers.postgres.LEASE_EXPIRED_ERROR
+    assert "1 messages of outbox outbox failed" in caplog.text
+    assert await reader.fetch() is None
+
+
+def test_claim_statement():
+    reader = create_reader(Database(), Rabbitmq())
+    sql = str(reader._claim_statement(uuid.uuid4(), 10).compile(dialect=postgresql.dialect()))
+    assert "FOR UPDATE SKIP LOCKED" in sql
+    assert "outbox.attempts < %(attempts_2)s" in sql
+    assert "attempts=(outbox.attempts + %(attempts_1)s" in sql
@@ -0,0 +1,181 @@
+import asyncio
+import contextlib
+import logging
+import types
+from typing import Any, AsyncIterator, Callable, Dict, List, Set
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+import async_workers.postgres
+
+TABLE = async_workers.postgres.create_queue_table(sa.MetaData())
+
+
+class Result:
+    def __init__(self, rowcount: int) -> None:
+        self.rowcount = rowcount
+
+    def all(self) -> List[Any]:
+        return []
+
+
+class Session:
+    def __init__(self) -> None:
+        self.statements: List[Any] = []
+
+    async def execute(self, stmt: Any, *args: Any) -> Result:
+        self.statements.append(stmt.compile(dialect=postgresql.dialect()))
+        return Result(1)
+
+
+class Storage:
+    def __init__(self) -> None:
+        self.session = Session()
+        self.transactions = 0
+
+    @property
+    def session_maker(self) -> "Storage":
+        return self
+
+    @contextlib.asynccontextmanager
+    async def begin(self) -> AsyncIterator[Session]:
+        self.transactions += 1
+        yield self.session
+
+
+async def test_claim_fails_expired_last_attempt():
+    storage = Storage()
+    settings = async_workers.postgres.TaskReaderSettings(TASK_QUEUE_MAX_ATTEMPTS=3, TASK_QUEUE_NOTIFY_CHANNEL=None)
+    reader = async_workers.postgres.TaskReader(settings, storage, TABLE)  # type: ignore[arg-type]
+
+    assert await reader._claim(10) == []
+    assert storage.transactions == 1
+    fail_expired, claim = storage.session.statements
+    sql = str(fail_expired)
+    assert sql.startswith("UPDATE task_queue SET lease_id=%(lease_id)s::UUID, failed_at=now(), error_message=")
+    assert "task_queue.visible_at <= now() AND task_queue.attempts >= %(attempts_1)s FOR UPDATE SKIP LOCKED" in sql
+    assert fail_expired.params["attempts_1"] == 3
+    assert fail_expired.params["lease_id"] is None
+    assert fail_expired.params["error_message"] == async_workers.postgres.LEASE_EXPIRED_ERROR
+    # the claim itself skips the rows without attempts left
+    assert "task_queue.attempts < %(attempts_2)s" in str(claim)
+    assert claim.params["attempts_2"] == 3
+
+
+class LockResult:
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+    def scalar(self) -> Any:
+        return self.value
+
+
+class LockConnection:
+    """Other replicas hold the advisory locks of the shards in held"""
+
+    def __init__(self, held: Set[int]) -> None:
+        self.held = held
+
+    async def execution_options(self, **kwargs: Any) -> "LockConnection":
+        return self
+
+    async def execute(self, stmt: Any) -> LockResult:
+        compiled = stmt.compile(dialect=postgresql.dialect())
+        if "pg_try_advisory_lock" in str(compiled):
+            shard = compiled.params["pg_try_advisory_lock_2"]
+            acquired = shard not in self.held
+            self.held.add(shard)
+            return LockResult(acquired)
+        assert "FROM pg_locks" in str(compiled)
+        return LockResult(len(self.held))
+
+
+async def test_advisory_lock_warns_about_unowned_shards(caplog: pytest.LogCaptureFixture):
+    connection = LockConnection({0, 1})
+    storage = types.SimpleNamespace(engine=types.SimpleNamespace(connect=lambda: connection.execution_options()))
+    lock = async_workers.postgres.AdvisoryLock(storage)  # type: ignore[arg-type]
+
+    with caplog.at_level(logging.INFO):
+        assert await lock.acquire("cron", 4) == 2
+        assert await lock.acquire("cron", 4) == 2
+        warnings = [record for record in caplog.records if record.levelno == logging.WARNING]
+        assert [record.getMessage().split(",")[0] for record in warnings] == [
+            "Lock cron: 1 of 4 shards are held by no replica and are not run"
+        ]
+
+        # another replica takes the free shard
+        connection.held.add(3)
+        assert await lock.acquire("cron", 4) == 2
+        assert caplog.records[-1].getMessage() == "Lock cron: every one of 4 shards is held"
+
+
+class DriverConnection:
+    """asyncpg connection with LISTEN, terminate() drops it like a database restart"""
+
+    def __init__(self) -> None:
+        self.listeners: Dict[str, Callable] = {}
+        self.termination_listeners: Set[Callable] = set()
+
+    async def add_listener(self, channel: str, callback: Callable) -> None:
+        self.listeners[channel] = callback
+
+    async def remove_listener(self, channel: str, callback: Callable) -> None:
+        del self.listeners[channel]
+
+    def add_termination_listener(self, callback: Callable) -> None:
+        self.termination_listeners.add(callback)
+
+    def remove_termination_listener(self, callback: Callable) -> None:
+        self.termination_listeners.discard(callback)
+
+    def notify(self, channel: str, payload: str) -> None:
+        self.listeners[channel](self, 1, channel, payload)
+
+    def terminate(self) -> None:
+        for callback in self.termination_listeners:
+            asyncio.get_running_loop().call_soon(callback, self)
+        self.termination_listeners.clear()
+
+
+class Engine:
+    def __init__(self) -> None:
+        self.connections: List[DriverConnection] = []
+
+    @contextlib.asynccontextmanager
+    async def connect(self) -> AsyncIterator[Any]:
+        self.connections.append(DriverConnection())
+        raw_connection = types.SimpleNamespace(driver_connection=self.connections[-1])
+
+        async def get_raw_connection() -> Any:
+            return raw_connection
+
+        yield types.SimpleNamespace(get_raw_connection=get_raw_connection)
+
+
+async def test_notify_listener_reconnects():
+    engine = Engine()
+    notified = []
+    storage = types.SimpleNamespace(engine=engine)
+    async with async_workers.postgres.NotifyListener(
+        storage, "task_queue", "default", lambda: notified.append(None), reconnect_seconds=0.01
+    ):
+        first = engine.connections[0]
+        first.notify("task_queue", "other")
+        first.notify("task_queue", "default")
+        assert len(notified) == 1
+
+        first.terminate()
+        async with asyncio.timeout(1):
+            while len(engine.connections) < 2:
+                await asyncio.sleep(0.001)
+            # notifications may have been missed while the connection was lost
+            while len(notified) < 2:
+                await asyncio.sleep(0.001)
+        engine.connections[1].notify("task_queue", "default")
+        assert len(notified) == 3
+
+    assert not engine.connections[1].listeners and not engine.connections[1].termination_listeners
+    await asyncio.sleep(0.01)
+    assert len(engine.connections) == 2
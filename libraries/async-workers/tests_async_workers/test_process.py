@@ -0,0 +1,42 @@
+import asyncio
+import logging
+import os
+
+import pytest
+from prometheus_client import REGISTRY
+
+from async_workers import process
+
+logger = logging.getLogger(__name__)
+
+
+def get_pid() -> int:
+    """Called in a child process, so it is a module-level function"""
+    return os.getpid()
+
+
+def log_warning(message: str) -> int:
+    logger.warning(message)
+    return os.getpid()
+
+
+async def test_process_pool(caplog: pytest.LogCaptureFixture):
+    async with process.ProcessPool("test-process", size=1, max_tasks_per_child=2) as pool:
+        pids = [await pool.run(get_pid) for _ in range(2)]
+        pids.append(await pool.run(log_warning, "from the child", log_extra={"request_id": "42"}))
+        async with asyncio.timeout(5):
+            while "from the child" not in caplog.text:
+                await asyncio.sleep(0.01)
+
+    # the process is recycled after max_tasks_per_child calls
+    assert pids[0] == pids[1] != pids[2]
+    assert os.getpid() not in pids
+    record = next(record for record in caplog.records if record.getMessage() == "from the child")
+    assert record.name == __name__
+    assert record.request_id == "42"  # type: ignore[attr-defined]
+    assert record.process != os.getpid()
+
+    labels = {"pool_name": "test-process"}
+    assert REGISTRY.get_sample_value("process_pool_execution_seconds_count", labels) == 3
+    assert REGISTRY.get_sample_value("process_pool_wait_seconds_count", labels) == 3
+    assert REGISTRY.get_sample_value("process_pool_task", {**labels, "state": "running"}) == 0
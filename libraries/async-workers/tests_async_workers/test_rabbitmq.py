@@ -0,0 +1,161 @@
+from typing import Any, AsyncIterator, Dict, Tuple
+
+import aio_pika
+import pytest
+import pytest_mock
+
+import async_rabbitmq
+
+import async_workers.rabbitmq
+
+RETRY_ATTEMPT = async_workers.rabbitmq.RETRY_ATTEMPT_HEADER
+ERROR_MESSAGE = async_workers.rabbitmq.ERROR_MESSAGE_HEADER
+
+
+def create_reader(mocker: pytest_mock.MockerFixture, **settings: Any) -> Tuple[async_workers.rabbitmq.TaskReader, Any]:
+    """The reader and its mocked client"""
+    reader_settings = async_workers.rabbitmq.TaskReaderSettings(
+        rabbitmq=async_rabbitmq.config.Settings(RABBITMQ_QUEUE="tasks"), **settings
+    )
+    reader = async_workers.rabbitmq.TaskReader(reader_settings)
+    client = reader._rabbitmq = mocker.AsyncMock(spec=async_rabbitmq.client.Client)
+    return reader, client
+
+
+def create_task(mocker: pytest_mock.MockerFixture, headers: Dict[str, Any]) -> async_workers.rabbitmq.Task:
+    message = mocker.Mock(
+        spec=aio_pika.abc.AbstractIncomingMessage,
+        body=b'{"key": "value"}',
+        headers=headers,
+        content_type="application/json",
+        content_encoding=None,
+        priority=None,
+        message_id="1",
+        correlation_id="2",
+        reply_to=None,
+        properties=mocker.Mock(message_id="1"),
+    )
+    return async_workers.rabbitmq.TaskReader._create_task(async_rabbitmq.client.Response(message, "tasks"))
+
+
+async def iterate(*items: Any) -> AsyncIterator[Any]:
+    for item in items:
+        yield item
+
+
+async def test_declare_retry_queues(mocker: pytest_mock.MockerFixture):
+    reader, client = create_reader(mocker, RABBITMQ_RETRY_MAX_ATTEMPTS=2)
+    await reader._declare_retry_queues()
+    assert client.declare_queue.await_args_list == [
+        mocker.call(
+            "tasks.retry.1000",
+            arguments={"x-message-ttl": 1000, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "tasks"},
+        ),
+        mocker.call(
+            "tasks.retry.2000",
+            arguments={"x-message-ttl": 2000, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "tasks"},
+        ),
+        mocker.call("tasks.parking"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "headers, routing_key",
+    [
+        ({}, "tasks.retry.1000"),
+        ({RETRY_ATTEMPT: 1, "x-death": [{"count": 1}]}, "tasks.retry.2000"),
+        ({RETRY_ATTEMPT: 2, "x-death": [{"count": 2}]}, "tasks.parking"),
+    ],
+)
+async def test_error_republishes(mocker: pytest_mock.MockerFixture, headers: Dict[str, Any], routing_key: str):
+    reader, client = create_reader(mocker, RABBITMQ_RETRY_MAX_ATTEMPTS=2)
+    task = create_task(mocker, {"traceparent": "parent", **headers})
+
+    await reader.error(task, "error" * 1000)
+    client.send_message.assert_awaited_once_with(
+        b'{"key": "value"}',
+        {
+            "traceparent": "parent",
+            RETRY_ATTEMPT: headers.get(RETRY_ATTEMPT, 0) + 1,
+            ERROR_MESSAGE: ("error" * 1000)[:1000],
+        },
+        routing_key=routing_key,
+        content_type="application/json",
+        content_encoding=None,
+        priority=0,
+        message_id="1",
+        correlation_id="2",
+        reply_to=None,
+    )
+    task.response.message.ack.assert_awaited_once_with()
+    task.response.message.nack.assert_not_awaited()
+
+
+async def test_error_requeues_if_republish_failed(mocker: pytest_mock.MockerFixture):
+    reader, client = create_reader(mocker, RABBITMQ_RETRY_MAX_ATTEMPTS=2)
+    client.send_message.side_effect = ConnectionError("Channel closed")
+    task = create_task(mocker, {})
+
+    await reader.error(task, "error")
+    client.send_message.assert_awaited_once()
+    task.response.message.nack.assert_awaited_once_with(requeue=True)
+    task.response.message.ack.assert_not_awaited()
+
+
+async def test_error_drops_undecodable(mocker: pytest_mock.MockerFixture):
+    reader, client = create_reader(mocker, RABBITMQ_RETRY_MAX_ATTEMPTS=2)
+    task = create_task(mocker, {})
+    task.response.decode_failed = True
+
+    await reader.error(task, "error")
+    client.send_message.assert_not_awaited()
+    task.response.message.nack.assert_awaited_once_with(requeue=False)
+    task.response.message.ack.assert_not_awaited()
+
+
+async def test_error_without_retry(mocker: pytest_mock.MockerFixture):
+    reader, client = create_reader(mocker)
+    task = create_task(mocker, {})
+
+    await reader.error(task, "error")
+    client.send_message.assert_not_awaited()
+    task.response.message.nack.assert_awaited_once_with(requeue=False)
+
+
+async def test_queues(mocker: pytest_mock.MockerFixture):
+    reader, client = create_reader(mocker, RABBITMQ_QUEUES=["high", "low"], RABBITMQ_RETRY_MAX_ATTEMPTS=1)
+
+    client.receive = mocker.MagicMock(return_value=iterate(create_task(mocker, {}).response))
+    assert [task.task_id async for task in reader.receive()] == ["1"]
+    client.receive.assert_called_once_with(manual_ack=True, queues=["high", "low"])
+
+    await reader._declare_retry_queues()
+    assert [call.args[0] for call in client.declare_queue.await_args_list] == [
+        "high.retry.1000",
+        "low.retry.1000",
+        "high.parking",
+        "low.parking",
+    ]
+    task = create_task(mocker, {})
+    task.response.queue = "low"
+    await reader.error(task, "error")
+    assert client.send_message.await_args.kwargs["routing_key"] == "low.retry.1000"
+
+
+async def test_fetch_queues_in_turn(mocker: pytest_mock.MockerFixture):
+    reader, client = create_reader(mocker, RABBITMQ_QUEUES=["high", "low"])
+    responses = {"high": [create_task(mocker, {}).response], "low": [create_task(mocker, {}).response] * 2}
+    client.fetch.side_effect = lambda queue, **kwargs: responses[queue].pop() if responses[queue] else None
+
+    assert await reader.fetch()
+    assert await reader.fetch()
+    assert await reader.fetch()
+    assert await reader.fetch() is None
+    assert [call.kwargs["queue"] for call in client.fetch.await_args_list] == [
+        "high",
+        "low",
+        "high",
+        "low",
+        "high",
+        "low",
+    ]
@@ -0,0 +1,105 @@
+import asyncio
+import contextlib
+import types
+from typing import Any, Type
+
+import pytest
+import pytest_mock
+
+import async_workers.memory
+from async_workers import base, supervisor
+from tests_async_workers import conftest
+
+
+class Worker(conftest.Worker):
+    WORKER_NAME = "test-restarts-worker"
+    initializations = 0
+    settings = async_workers.memory.HandlerSettings()
+
+    @classmethod
+    def load_settings(cls) -> async_workers.memory.HandlerSettings:
+        return cls.settings
+
+    @classmethod
+    async def initialization(cls: Type["Worker"], settings, **kwargs) -> "Worker":
+        cls.initializations += 1
+        raise ConnectionError("broker is unavailable")
+
+
+@pytest.mark.parametrize("failures,cap", [(1, 1), (2, 2), (4, 8), (10, 20)])
+def test_restart_delay(failures: int, cap: float):
+    settings = async_workers.memory.HandlerSettings(WORKER_RESTART_TIME_SECONDS=1, WORKER_RESTART_MAX_TIME_SECONDS=20)
+    delays = [settings.get_restart_delay(failures) for _ in range(200)]
+    assert all(0 <= delay <= cap for delay in delays)
+    assert max(delays) > cap / 2
+
+
+async def test_crash_loop():
+    Worker.initializations = 0
+    Worker.settings = async_workers.memory.HandlerSettings(
+        WORKER_RESTART_TIME_SECONDS=0.001,
+        WORKER_RESTART_MAX_TIME_SECONDS=0.001,
+        WORKER_CRASH_LOOP_RESTARTS=3,
+        WORKER_MAX_RESTARTS=3,
+    )
+    with pytest.raises(ConnectionError):
+        await Worker.run_with_restarts()
+    assert Worker.initializations == 3
+    assert "test-restarts-worker" in base.crash_looping_workers()
+    assert base.TASK_HANDLERS_CRASH_LOOP_GAUGE.labels("test-restarts-worker")._value.get() == 1
+
+    stop_event = asyncio.Event()
+    Worker.settings = async_workers.memory.HandlerSettings(WORKER_RESTART_TIME_SECONDS=10)
+    running = asyncio.create_task(Worker.run_with_restarts(stop_event))
+    await asyncio.sleep(0.01)
+    stop_event.set()
+    await running
+    assert "test-restarts-worker" not in base.crash_looping_workers()
+
+
+class Process:
+    """Worker process that exits right after the start while alive is False"""
+
+    alive = False
+
+    def __init__(self, target: Any, args: tuple, name: str) -> None:
+        self.name = name
+        self.pid = 1
+        self.exitcode = 1
+
+    def start(self) -> None:
+        pass
+
+    def is_alive(self) -> bool:
+        return self.alive
+
+    def close(self) -> None:
+        pass
+
+
+async def test_supervisor_restarts_with_backoff(mocker: pytest_mock.MockerFixture):
+    Worker.settings = async_workers.memory.HandlerSettings(
+        WORKER_CRASH_LOOP_RESTARTS=3, WORKER_RESTART_RESET_SECONDS=0.05
+    )
+    get_restart_delay = mocker.patch.object(async_workers.memory.HandlerSettings, "get_restart_delay", return_value=0)
+    dependencies_factory: Any = contextlib.nullcontext
+    workers = supervisor.Supervisor({Worker: 1}, dependencies_factory, check_interval_seconds=0.001)
+    workers._mp_context = types.SimpleNamespace(Process=Process)  # type: ignore[assignment]
+    workers._start(workers.processes[0])
+    monitor = asyncio.create_task(workers._monitor_processes())
+    try:
+        async with asyncio.timeout(1):
+            while get_restart_delay.call_count < 3:
+                await asyncio.sleep(0.001)
+        assert [call.args for call in get_restart_delay.call_args_list[:3]] == [(1,), (2,), (3,)]
+        assert "test-restarts-worker" in base.crash_looping_workers()
+
+        # the process runs for restart_reset_seconds
+        Process.alive = True
+        async with asyncio.timeout(1):
+            while workers.processes[0].failures:
+                await asyncio.sleep(0.001)
+        assert "test-restarts-worker" not in base.crash_looping_workers()
+    finally:
+        Process.alive = False
+        monitor.cancel()
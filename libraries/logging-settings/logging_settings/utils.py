@@ -60,7 +60,9 @@ def filter(self, record):
         for name, value in async_log_extra.items():
             if not hasattr(record, name):
                 setattr(record, name, value)
-        ctx = trace.get_current_span().get_span_context()
-        record.trace_id = ctx.trace_id
-        record.span_id = ctx.span_id
+        if not hasattr(record, "trace_id"):
+            # records forwarded from child processes already have the trace ids
+            ctx = trace.get_current_span().get_span_context()
+            record.trace_id = ctx.trace_id
+            record.span_id = ctx.span_id
         return True
@@ -1,4 +1,4 @@
-from service_settings import alembic, config
+from service_settings import alembic, config, watchdog
 from service_settings.application import basic_config, get_application
 
-__all__ = ("alembic", "config", "basic_config", "get_application")
+__all__ = ("alembic", "config", "watchdog", "basic_config", "get_application")
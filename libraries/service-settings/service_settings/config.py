@@ -1,4 +1,4 @@
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 
 import pydantic
 
@@ -16,6 +16,19 @@ class Settings(pydantic_base_settings.BaseSettings):
     allowed_hosts: Tuple[str, ...] = pydantic.Field(default_factory=lambda: ("*",), validation_alias="ALLOWED_HOSTS")
 
     skip_workers: Tuple[str, ...] = pydantic.Field((), validation_alias="SKIP_WORKERS")
+    workers_processes: Dict[str, int] = pydantic.Field(
+        default_factory=dict,
+        validation_alias="WORKERS_PROCESSES",
+        description="Workers running in separate processes: worker_name -> number of processes",
+        examples=[{"example-worker-rabbitmq": 4}],
+    )
+    workers_drain_timeout_seconds: float = pydantic.Field(30, validation_alias="WORKERS_DRAIN_TIMEOUT_SECONDS")
+    loop_watchdog_interval_seconds: float = pydantic.Field(
+        0.1, validation_alias="LOOP_WATCHDOG_INTERVAL_SECONDS", gt=0
+    )
+    loop_watchdog_stall_threshold_seconds: float = pydantic.Field(
+        1, validation_alias="LOOP_WATCHDOG_STALL_THRESHOLD_SECONDS", gt=0
+    )
 
     logging: logging_settings.config.Settings = pydantic.Field(default_factory=logging_settings.config.Settings)
     trace: trace_settings.config.Settings = pydantic.Field(default_factory=trace_settings.config.Settings)
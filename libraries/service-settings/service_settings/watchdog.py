@@ -0,0 +1,105 @@
+import asyncio
+import contextlib
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import List, Optional
+
+from prometheus_client import Counter, Histogram
+
+from service_settings import config
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOP_LAG_HISTOGRAM = Histogram(
+    "event_loop_lag_seconds",
+    "Delay of the event loop callbacks",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf")),
+)
+EVENT_LOOP_STALL_COUNTER = Counter("event_loop_stall", "Number of event loop stalls longer than the threshold")
+
+
+class LoopWatchdog:
+    """Measure the event loop lag and report stalls.
+    A heartbeat task sleeps for interval and observes how late it wakes up. A daemon thread checks the heartbeat:
+    when the loop has been blocked longer than stall_threshold, it logs the stack of the loop thread
+    and the running asyncio tasks (e.g. WORKER::<name>) once per stall
+    """
+
+    def __init__(self, interval: float = 0.1, stall_threshold: float = 1):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = time.monotonic()
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._monitor: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_settings(cls, settings: config.Settings) -> "LoopWatchdog":
+        return cls(
+            interval=settings.loop_watchdog_interval_seconds,
+            stall_threshold=settings.loop_watchdog_stall_threshold_seconds,
+        )
+
+    async def __aenter__(self) -> "LoopWatchdog":
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat = asyncio.create_task(self._beat(), name="WATCHDOG::heartbeat")
+        self._monitor = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._monitor.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._heartbeat
+            self._heartbeat = None
+        if self._monitor is not None:
+            await asyncio.to_thread(self._monitor.join)
+            self._monitor = None
+
+    async def _beat(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._last_beat = now = time.monotonic()
+            EVENT_LOOP_LAG_HISTOGRAM.observe(max(now - start - self.interval, 0))
+
+    def _watch(self) -> None:
+        reported_beat: Optional[float] = None
+        while not self._stopped.wait(self.interval):
+            last_beat = self._last_beat
+            stalled = time.monotonic() - last_beat
+            if stalled < self.stall_threshold or reported_beat == last_beat:
+                continue
+            reported_beat = last_beat
+            EVENT_LOOP_STALL_COUNTER.inc()
+            logger.warning(
+                f"Event loop is blocked for {round(stalled, 3)} sec, current task: {self._current_task_name()}, "
+                f"running tasks: {', '.join(self._task_names())}\n{self._loop_stack()}"
+            )
+
+    def _loop_stack(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread_id or 0)
+        return "".join(traceback.format_stack(frame)) if frame is not None else "<no stack>"
+
+    def _current_task_name(self) -> Optional[str]:
+        task = asyncio.current_task(self._loop) if self._loop is not None else None
+        return task.get_name() if task is not None else None
+
+    def _task_names(self) -> List[str]:
+        if self._loop is None:
+            return []
+        # the loop is blocked, so its tasks do not change while they are listed
+        for _ in range(3):
+            with contextlib.suppress(RuntimeError):
+                return sorted(task.get_name() for task in asyncio.all_tasks(self._loop))
+        return []
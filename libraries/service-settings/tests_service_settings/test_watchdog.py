@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import threading
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+
+from service_settings import watchdog
+
+
+def get_stalls() -> float:
+    return REGISTRY.get_sample_value("event_loop_stall_total") or 0
+
+
+def get_long_lags() -> float:
+    """Heartbeats that woke up more than 0.25 sec late"""
+    count = REGISTRY.get_sample_value("event_loop_lag_seconds_count") or 0
+    return count - (REGISTRY.get_sample_value("event_loop_lag_seconds_bucket", {"le": "0.25"}) or 0)
+
+
+async def blocking_task():
+    time.sleep(0.5)
+
+
+async def test_stall_reported(caplog: pytest.LogCaptureFixture):
+    stalls = get_stalls()
+    long_lags = get_long_lags()
+    loop_watchdog = watchdog.LoopWatchdog(interval=0.01, stall_threshold=0.2)
+    async with loop_watchdog:
+        await asyncio.sleep(0.05)
+        await asyncio.create_task(blocking_task(), name="WORKER::blocking")
+        await asyncio.sleep(0.05)
+
+    assert get_stalls() == stalls + 1
+    # the heartbeat woke up late by the blocked time
+    assert get_long_lags() == long_lags + 1
+    records = [record for record in caplog.records if record.name == watchdog.__name__]
+    assert len(records) == 1 and records[0].levelno == logging.WARNING
+    assert "current task: WORKER::blocking" in records[0].message
+    assert "in blocking_task" in records[0].message
+
+
+async def test_stopped_on_exit():
+    loop_watchdog = watchdog.LoopWatchdog(interval=0.01, stall_threshold=0.2)
+    async with loop_watchdog:
+        heartbeat, monitor = loop_watchdog._heartbeat, loop_watchdog._monitor
+        assert heartbeat is not None and monitor is not None and monitor.is_alive()
+
+    assert heartbeat.cancelled() and not monitor.is_alive()
+    assert loop_watchdog._heartbeat is None and loop_watchdog._monitor is None
+    assert "loop-watchdog" not in [thread.name for thread in threading.enumerate()]
+
+    stalls = get_stalls()
+    time.sleep(0.3)
+    await asyncio.sleep(0)
+    assert get_stalls() == stalls
@@ -1,8 +1,9 @@
 import fastapi
 
-from example_service.api import ping, root
+from example_service.api import health, ping, root
 
 router = fastapi.APIRouter()
 
+router.include_router(health.router)
 router.include_router(ping.router)
 router.include_router(root.router)
@@ -0,0 +1,14 @@
+import fastapi
+
+import async_workers
+
+router = fastapi.APIRouter()
+
+
+@router.get("/health", operation_id="health", status_code=fastapi.status.HTTP_200_OK)
+def health(response: fastapi.Response):
+    """503 while a worker of the process is in crash loop, so the orchestrator can restart the instance"""
+    crash_loop_workers = sorted(async_workers.base.crash_looping_workers())
+    if crash_loop_workers:
+        response.status_code = fastapi.status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"crash_loop_workers": crash_loop_workers}
@@ -1,10 +1,12 @@
 import contextlib
+import functools
 import logging
-from typing import AsyncIterator, cast
+from typing import Any, AsyncIterator, Dict, cast
 
 import fastapi
 
 import async_workers
+import service_settings
 
 from example_service import config, database, workers
 
@@ -15,15 +17,36 @@
 async def lifespan(app: fastapi.FastAPI, settings: config.Settings) -> AsyncIterator[None]:
     app.state.settings = settings  # noqa
 
+    async with contextlib.AsyncExitStack() as stack:
+        await stack.enter_async_context(service_settings.watchdog.LoopWatchdog.from_settings(settings))
+        dependencies = await stack.enter_async_context(create_dependencies(settings))
+        for name, dependency in dependencies.items():
+            setattr(app.state, name, dependency)  # noqa
+        await stack.enter_async_context(
+            async_workers.WorkersLifespan(
+                workers,
+                skip_workers=settings.skip_workers,
+                processes=settings.workers_processes,
+                dependencies_factory=functools.partial(create_dependencies, settings),
+                initializer=functools.partial(service_settings.basic_config, settings),
+                process_lifespan=functools.partial(service_settings.watchdog.LoopWatchdog.from_settings, settings),
+                drain_timeout=settings.workers_drain_timeout_seconds,
+                **dependencies,
+            )
+        )
+        yield
+
+
+@contextlib.asynccontextmanager
+async def create_dependencies(settings: config.Settings) -> AsyncIterator[Dict[str, Any]]:
+    """Dependencies of the application and workers, also created in every worker process"""
     dependencies = {
         "storage": database.storage.Storage.from_settings(settings.database),
     }
     async with contextlib.AsyncExitStack() as stack:
-        for name, dependency in dependencies.items():
+        for dependency in dependencies.values():
             await stack.enter_async_context(dependency)
-            setattr(app.state, name, dependency)  # noqa
-        await stack.enter_async_context(async_workers.WorkersLifespan(workers, **dependencies))
-        yield
+        yield dependencies
 
 
 def get_settings(request: fastapi.Request) -> config.Settings:
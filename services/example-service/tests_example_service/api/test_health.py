@@ -0,0 +1,8 @@
+import fastapi
+import httpx
+
+
+def test_health_get(app: fastapi.FastAPI, client: httpx.Client):
+    response = client.get(app.url_path_for("health"))
+    assert response.status_code == 200
+    assert response.json() == {"crash_loop_workers": []}